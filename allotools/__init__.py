@@ -2,3 +2,5 @@ from allotools.core import AlloUsage
 from allotools import util
 from allotools import filters
 from allotools import parameters
+from allotools import backends
+from allotools import export
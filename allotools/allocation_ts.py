@@ -7,6 +7,12 @@ Created on Mon Oct  1 09:55:07 2018
 import numpy as np
 import pandas as pd
 
+###################################
+### Parameters
+
+## The max number of group by day cells summed at once by interval_ts
+sweep_max_cells = 2**23
+
 ###################################
 ### Functions
 
@@ -77,6 +83,511 @@ def allo_ts_apply(row, from_date, to_date, freq, restr_col, remove_months=True):
     return vols
 
 
+def period_codes(days, freq):
+    """
+    Function to convert daily datetime64 values to integer period codes for the 'D', 'W', 'M', 'A-JUN', and 'A' frequencies. The periods are right closed like the pandas frequencies (e.g. weeks end on a Sunday and water years end on the 30th of June).
+
+    Parameters
+    ----------
+    days : ndarray of datetime64[D]
+        The dates.
+    freq : str
+        Pandas frequency str. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+
+    Returns
+    -------
+    ndarray of int64
+    """
+    d1 = days.astype('datetime64[D]').astype('int64')
+    if freq == 'D':
+        return d1
+    elif freq == 'W':
+        return (d1 + 3) // 7
+    elif freq == 'M':
+        return days.astype('datetime64[M]').astype('int64')
+    elif freq == 'A-JUN':
+        return (days.astype('datetime64[M]').astype('int64') + 6) // 12
+    elif freq == 'A':
+        return days.astype('datetime64[Y]').astype('int64')
+    else:
+        raise ValueError("freq must be either 'A', 'A-JUN', 'M', 'W', or 'D'")
+
+
+def period_ends(codes, freq):
+    """
+    Function to convert the integer period codes from period_codes to the end dates of the periods.
+
+    Parameters
+    ----------
+    codes : ndarray of int64
+        The period codes.
+    freq : str
+        Pandas frequency str. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+
+    Returns
+    -------
+    ndarray of datetime64[D]
+    """
+    if freq == 'D':
+        return codes.astype('datetime64[D]')
+    elif freq == 'W':
+        return (codes * 7 + 3).astype('datetime64[D]')
+    elif freq == 'M':
+        return (codes + 1).astype('datetime64[M]').astype('datetime64[D]') - 1
+    elif freq == 'A-JUN':
+        return (codes * 12 + 6).astype('datetime64[M]').astype('datetime64[D]') - 1
+    elif freq == 'A':
+        return (codes + 1).astype('datetime64[Y]').astype('datetime64[D]') - 1
+    else:
+        raise ValueError("freq must be either 'A', 'A-JUN', 'M', 'W', or 'D'")
+
+
+def restr_matrix(restr, from_date, to_date, freq):
+    """
+    Function to aggregate a daily restriction ratio Series to a dense float32 matrix of the keys (e.g. RecordNumbers) by the periods of the freq. Each cell is the mean of the daily ratios of the key within the period and the periods without any restrictions are 1.0.
+
+    Parameters
+    ----------
+    restr : Series
+        The daily restriction ratios indexed by the key and the Date.
+    from_date : str or Timestamp
+        The start date of the matrix.
+    to_date : str or Timestamp
+        The end date of the matrix.
+    freq : str
+        Pandas frequency str. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+
+    Returns
+    -------
+    DataFrame
+        indexed by the key with a column for each period end date
+    """
+    start1 = np.array([pd.Timestamp(from_date).date(), pd.Timestamp(to_date).date()], dtype='datetime64[D]')
+    first, last = period_codes(start1, freq)
+    n_periods = max(last - first + 1, 0)
+
+    key_codes, keys = pd.factorize(restr.index.get_level_values(0))
+    codes = period_codes(restr.index.get_level_values('Date').values.astype('datetime64[D]'), freq) - first
+
+    ### Sum and count the daily ratios of each cell
+    valid = (key_codes >= 0) & (codes >= 0) & (codes < n_periods)
+    cells = key_codes[valid] * n_periods + codes[valid]
+    size = len(keys) * n_periods
+    sums = np.bincount(cells, weights=restr.values[valid], minlength=size)
+    counts = np.bincount(cells, minlength=size)
+
+    matrix = np.ones(size, dtype='float32')
+    restricted = counts > 0
+    matrix[restricted] = sums[restricted] / counts[restricted]
+
+    dates = pd.DatetimeIndex(period_ends(np.arange(first, first + n_periods), freq).astype('datetime64[ns]'), name='Date')
+    matrix1 = pd.DataFrame(matrix.reshape(len(keys), n_periods), index=keys, columns=dates)
+
+    return matrix1
+
+
+def _expand_periods(allo, from_date, to_date, freq, remove_months=True):
+    """
+    Function to expand all of the allocation rows to the periods of the freq. Returns the start and end dates of each row and the row position, period code, period end date, days, and active flag of each period.
+    """
+    ### Determine the start and end of each consent within the time series
+    start1 = np.datetime64(pd.Timestamp(from_date).date(), 'D')
+    end1 = np.datetime64(pd.Timestamp(to_date).date(), 'D')
+
+    crc_from = pd.to_datetime(allo['FromDate']).values.astype('datetime64[D]')
+    crc_to = pd.to_datetime(allo['ToDate']).values.astype('datetime64[D]')
+    start = np.where(crc_from > start1, crc_from, start1)
+    end = np.where(crc_to < end1, crc_to, end1)
+
+    first_code = period_codes(start, freq)
+    n_periods = period_codes(end, freq) - first_code + 1
+    n_periods[n_periods < 0] = 0
+
+    ### Expand all of the consents to their periods
+    row = np.repeat(np.arange(len(allo)), n_periods)
+    offsets = np.concatenate(([0], np.cumsum(n_periods)[:-1]))
+    codes = first_code[row] + (np.arange(len(row)) - offsets[row])
+    dates = period_ends(codes, freq)
+
+    ## Days per period
+    if freq == 'D':
+        days = np.ones(len(row), dtype='int64')
+    elif freq == 'W':
+        days = np.full(len(row), 7, dtype='int64')
+    elif freq == 'M':
+        days = (dates - dates.astype('datetime64[M]').astype('datetime64[D]')).astype('int64') + 1
+    else:
+        days = (dates - dates.astype('datetime64[Y]').astype('datetime64[D]')).astype('int64') + 1 + 184
+
+    ## Months to remove
+    if remove_months and ('A' not in freq):
+        months = dates.astype('datetime64[M]').astype('int64') % 12 + 1
+        from_month = allo['FromMonth'].values[row]
+        to_month = allo['ToMonth'].values[row]
+        active = (months >= from_month) | (months <= to_month)
+    else:
+        active = np.ones(len(row), dtype=bool)
+
+    days = np.where(active, days, 0)
+
+    return start, end, row, codes, dates, days, active
+
+
+def _water_year_days(row, codes, days):
+    """
+    Function to sum the active days of the monthly periods per allocation row and water year.
+    """
+    wy = (codes + 6) // 12
+    grp = np.cumsum(np.concatenate(([True], (row[1:] != row[:-1]) | (wy[1:] != wy[:-1])))) - 1
+    year_days = np.bincount(grp, weights=days)[grp]
+
+    return year_days
+
+
+def _to_series(allo, row, dates, vols):
+    """
+    Function to package up the period volumes as a Series indexed by the allo index and Date.
+    """
+    index1 = allo.index[row]
+    if not isinstance(index1, pd.MultiIndex):
+        index1 = pd.MultiIndex.from_arrays([index1])
+    date_index, date_codes = np.unique(dates, return_inverse=True)
+    levels = list(index1.levels) + [pd.DatetimeIndex(date_index.astype('datetime64[ns]'))]
+    codes1 = list(index1.codes) + [date_codes]
+    names = list(index1.names) + ['Date']
+    index2 = pd.MultiIndex(levels=levels, codes=codes1, names=names, verify_integrity=False)
+
+    vols1 = pd.Series(vols, index=index2, name='allo')
+
+    return vols1
+
+
+def allo_ts_vec(allo, from_date, to_date, freq, restr_col, remove_months=True):
+    """
+    Vectorised version of allo_ts_apply. Converts all of the allocation rows to a time series at once rather than row by row. The results are identical to stacking the output of allo_ts_apply.
+
+    Parameters
+    ----------
+    allo : DataFrame
+        The allocation DataFrame with the FromDate, ToDate, FromMonth, ToMonth, and restr_col columns. The index will be carried over to the output.
+    from_date : str or Timestamp
+        The start date for the time series.
+    to_date: str or Timestamp
+        The end date for the time series.
+    freq : str
+        Pandas frequency str. Must be 'D', 'W', 'M', or 'A-JUN'.
+    restr_col : str
+        The allocation rate/volume column used as the values in the time series.
+    remove_months : bool
+        Should the months outside of the FromMonth and ToMonth be set to zero?
+
+    Returns
+    -------
+    Series
+        indexed by the allo index and Date
+    """
+    if freq not in ['D', 'W', 'M', 'A-JUN']:
+        raise ValueError("freq must be either 'A-JUN', 'M', 'W', or 'D'")
+
+    start, end, row, codes, dates, days, active = _expand_periods(allo, from_date, to_date, freq, remove_months)
+
+    ## Remove consents without any active periods
+    row_active = np.bincount(row, weights=active, minlength=len(allo)) > 0
+    keep = row_active[row]
+
+    ### Volumes per period
+    vol = pd.to_numeric(allo[restr_col], errors='coerce').values.astype('float64')[row]
+
+    if freq == 'M':
+        year_days = _water_year_days(row, codes, days)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol = days / year_days * vol
+
+    ### Pro-rata the first and last periods
+    n_periods = np.bincount(row, minlength=len(allo))
+    offsets = np.concatenate(([0], np.cumsum(n_periods)[:-1]))
+
+    alt_days = days.copy()
+    first = offsets[n_periods > 0]
+    last = first + n_periods[n_periods > 0] - 1
+    single = first == last
+
+    start_days = start[row[first]]
+    end_days = end[row[last]]
+
+    one1 = first[single]
+    alt_days[one1] = (end_days[single] - start_days[single]).astype('int64')
+
+    first1 = first[~single]
+    start_diff = (dates[first1] - start_days[~single]).astype('int64') + 1
+    first2 = active[first1] & (start_diff < days[first1])
+    alt_days[first1[first2]] = start_diff[first2]
+
+    last1 = last[~single]
+    end_diff = days[last1] - (dates[last1] - end_days[~single]).astype('int64')
+    last2 = active[last1] & (end_diff < days[last1])
+    alt_days[last1[last2]] = end_diff[last2]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_days = alt_days / days
+
+    vols = np.round(ratio_days * vol)
+    vols[np.isnan(vols)] = 0
+
+    ### Package up the results
+    vols1 = _to_series(allo, row[keep], dates[keep], vols[keep])
+
+    return vols1
+
+
+def allo_ts_daily(allo, from_date, to_date, restr_col='AllocatedAnnualVolume', remove_months=True):
+    """
+    Function to convert the annual allocation volumes to a daily time series. The annual volume is split over the active months of each water year like the monthly allo_ts_vec, then split evenly over the days of each month. The days of the inactive months are zero like the other freqs of allo_ts_vec. The daily volumes are not rounded so that they can be summed to any other freq. Summing to months gives the monthly allo_ts_vec volumes before rounding.
+
+    Parameters
+    ----------
+    allo : DataFrame
+        The allocation DataFrame with the FromDate, ToDate, FromMonth, ToMonth, and restr_col columns. The index will be carried over to the output.
+    from_date : str or Timestamp
+        The start date for the time series.
+    to_date: str or Timestamp
+        The end date for the time series.
+    restr_col : str
+        The annual allocation volume column.
+    remove_months : bool
+        Should the months outside of the FromMonth and ToMonth be set to zero?
+
+    Returns
+    -------
+    Series
+        indexed by the allo index and Date
+    """
+    start, end, row, codes, dates, days, active = _expand_periods(allo, from_date, to_date, 'M', remove_months)
+
+    ## Remove consents without any active periods
+    row_active = np.bincount(row, weights=active, minlength=len(allo)) > 0
+
+    year_days = _water_year_days(row, codes, days)
+    vol = pd.to_numeric(allo[restr_col], errors='coerce').values.astype('float64')[row]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        day_vol = vol / year_days
+    day_vol[~active | np.isnan(day_vol)] = 0
+
+    ### Expand the months to their days within the time series
+    month_start = dates.astype('datetime64[M]').astype('datetime64[D]')
+    day1 = np.where(start[row] > month_start, start[row], month_start)
+    day2 = np.where(end[row] < dates, end[row], dates)
+    n_days = (day2 - day1).astype('int64') + 1
+    n_days[~row_active[row] | (n_days < 0)] = 0
+
+    period = np.repeat(np.arange(len(row)), n_days)
+    offsets = np.concatenate(([0], np.cumsum(n_days)[:-1]))
+    days1 = day1[period] + (np.arange(len(period)) - offsets[period])
+
+    vols1 = _to_series(allo, row[period], days1, day_vol[period])
+
+    return vols1
+
+
+def allo_intervals(allo, from_date, to_date, restr_col='AllocatedAnnualVolume', remove_months=True):
+    """
+    Function to convert the allocation rows to intervals rather than a time series. Each allocation row is split into its water years within the time series and each interval has the Start and End dates, the FromMonth and ToMonth of the active months, the rate, and the DayVolume. The DayVolume is the annual volume split evenly over the active days of the water year like allo_ts_daily. The totals of the intervals for any freq and grouping can be calculated with interval_ts.
+
+    Parameters
+    ----------
+    allo : DataFrame
+        The allocation DataFrame with the FromDate, ToDate, FromMonth, ToMonth, and restr_col columns. The index and all of the other columns will be carried over to the output.
+    from_date : str or Timestamp
+        The start date for the time series.
+    to_date: str or Timestamp
+        The end date for the time series.
+    restr_col : str
+        The annual allocation volume column.
+    remove_months : bool
+        Should the months outside of the FromMonth and ToMonth be inactive? False will set the FromMonth and ToMonth to 1 and 12.
+
+    Returns
+    -------
+    DataFrame
+        with one row per allocation row and water year
+    """
+    start, end, row, codes, dates, days, active = _expand_periods(allo, from_date, to_date, 'M', remove_months)
+
+    year_days = _water_year_days(row, codes, days)
+    wy = (codes + 6) // 12
+
+    ### One interval per row and water year
+    first = np.flatnonzero(np.concatenate(([True], (row[1:] != row[:-1]) | (wy[1:] != wy[:-1])))) if len(row) else np.array([], dtype='int64')
+    row1 = row[first]
+    wy1 = wy[first]
+
+    wy_start = (wy1 * 12 - 6).astype('datetime64[M]').astype('datetime64[D]')
+    wy_end = period_ends(wy1, 'A-JUN')
+
+    vol = pd.to_numeric(allo[restr_col], errors='coerce').values.astype('float64')[row1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        day_vol = vol / year_days[first]
+    day_vol[~np.isfinite(day_vol)] = 0
+
+    intervals = allo.iloc[row1].copy()
+    intervals['Start'] = np.where(start[row1] > wy_start, start[row1], wy_start).astype('datetime64[ns]')
+    intervals['End'] = np.where(end[row1] < wy_end, end[row1], wy_end).astype('datetime64[ns]')
+    intervals['DayVolume'] = day_vol
+    if not remove_months:
+        intervals['FromMonth'] = 1
+        intervals['ToMonth'] = 12
+
+    return intervals
+
+
+def interval_ts(intervals, freq, value_col, by=None, from_date=None, to_date=None, months=None, max_cells=sweep_max_cells):
+    """
+    Function to calculate the totals of the allocation intervals from allo_intervals per group and period without creating the time series of every interval. The values of the intervals are summed over the days (a sweep of the Start and End dates) of blocks of groups at a time, so the memory is bounded by max_cells rather than the number of intervals and days.
+
+    The values are summed like allo_ts_vec. For the 'D', 'M', 'A-JUN', and 'A' freqs, the values of the active days within the intervals are summed (e.g. the DayVolume for monthly and annual volumes or the AllocatedRate for daily rates). For the 'W' freq, the value is the sum of the days within the intervals divided by 7 if the month of the end of the week is active (e.g. the AllocatedRate). Unlike allo_ts_vec, the values are not rounded.
+
+    Parameters
+    ----------
+    intervals : DataFrame
+        The output of allo_intervals.
+    freq : str
+        Pandas frequency str. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+    value_col : str
+        The column of the values to be summed (e.g. 'DayVolume' or 'AllocatedRate').
+    by : list of str or None
+        The columns or index levels of the intervals to group by. None will use the index of the intervals (i.e. the allocation rows), which is the dense time series.
+    from_date : str, Timestamp, or None
+        The start date of the totals. None will use the first Start.
+    to_date : str, Timestamp, or None
+        The end date of the totals. None will use the last End.
+    months : list of int or None
+        Only these months are summed (e.g. the irrigation season). None will sum all of the active months.
+    max_cells : int
+        The max number of group by day cells to sum at once.
+
+    Returns
+    -------
+    Series
+        indexed by the by and Date
+    """
+    if freq not in ['D', 'W', 'M', 'A-JUN', 'A']:
+        raise ValueError("freq must be either 'A', 'A-JUN', 'M', 'W', or 'D'")
+
+    if by is None:
+        by = list(intervals.index.names)
+
+    def get_col(c):
+        if c in intervals.columns:
+            return intervals[c].values
+        return intervals.index.get_level_values(c)
+
+    ### The days of the totals
+    start = intervals['Start'].values.astype('datetime64[D]')
+    end = intervals['End'].values.astype('datetime64[D]')
+    start1 = start.min() if from_date is None else np.datetime64(pd.Timestamp(from_date).date(), 'D')
+    end1 = end.max() if to_date is None else np.datetime64(pd.Timestamp(to_date).date(), 'D')
+    n_days = max(int((end1 - start1).astype('int64')) + 1, 0)
+
+    start = np.where(start > start1, start, start1)
+    end = np.where(end < end1, end, end1)
+    keep = end >= start
+
+    day_dates = start1 + np.arange(n_days)
+    day_months = day_dates.astype('datetime64[M]').astype('int64') % 12
+    day_codes = period_codes(day_dates, freq)
+    bounds = np.flatnonzero(np.concatenate(([True], day_codes[1:] != day_codes[:-1]))) if n_days else np.array([], dtype='int64')
+    period_dates = period_ends(day_codes[bounds], freq)
+
+    ### The groups and the active month patterns
+    grp_codes, grp_index = pd.MultiIndex.from_arrays([get_col(c) for c in by], names=by).factorize(sort=True)
+
+    from_month = intervals['FromMonth'].values.astype('int64')
+    to_month = intervals['ToMonth'].values.astype('int64')
+    pat_codes, pat_index = pd.factorize(from_month * 100 + to_month, sort=True)
+    mon1 = np.arange(1, 13)
+    mask = (mon1 >= (pat_index[:, None] // 100)) | (mon1 <= (pat_index[:, None] % 100))
+    if months is not None:
+        mask = mask & np.isin(mon1, months)
+
+    values = pd.to_numeric(pd.Series(get_col(value_col)), errors='coerce').fillna(0).values
+    keep = keep & (grp_codes >= 0)
+
+    ## The keys are the groups and patterns
+    key = grp_codes[keep].astype('int64') * len(pat_index) + pat_codes[keep]
+    key_index, key_codes = np.unique(key, return_inverse=True)
+    key_grp = key_index // len(pat_index)
+    key_pat = key_index % len(pat_index)
+
+    order = np.argsort(key_codes, kind='stable')
+    key_codes = key_codes[order]
+    s1 = (start[keep][order] - start1).astype('int64')
+    e1 = (end[keep][order] - start1).astype('int64') + 1
+    values = values[keep][order]
+
+    ### Sum blocks of whole groups
+    grp_first = np.flatnonzero(np.concatenate(([True], key_grp[1:] != key_grp[:-1]))) if len(key_index) else np.array([], dtype='int64')
+    block_size = max(1, max_cells // (n_days + 1))
+    block_id = grp_first // block_size
+    block_first = grp_first[np.concatenate(([True], block_id[1:] != block_id[:-1]))] if len(grp_first) else grp_first
+    block_last = np.concatenate((block_first[1:], [len(key_index)]))
+
+    out_grp = []
+    out_period = []
+    out_values = []
+
+    for k0, k1 in zip(block_first, block_last):
+        i0, i1 = np.searchsorted(key_codes, [k0, k1])
+        n_keys = k1 - k0
+        width = n_days + 1
+        flat_start = (key_codes[i0:i1] - k0) * width + s1[i0:i1]
+        flat_end = (key_codes[i0:i1] - k0) * width + e1[i0:i1]
+
+        delta = (np.bincount(flat_start, weights=values[i0:i1], minlength=n_keys * width) - np.bincount(flat_end, weights=values[i0:i1], minlength=n_keys * width)).reshape(n_keys, width)
+        count = (np.bincount(flat_start, minlength=n_keys * width) - np.bincount(flat_end, minlength=n_keys * width)).reshape(n_keys, width)
+
+        daily = np.cumsum(delta, axis=1)[:, :n_days]
+        in_range = np.cumsum(count, axis=1)[:, :n_days] > 0
+        block_mask = mask[key_pat[k0:k1]]
+
+        if freq == 'W':
+            per = np.add.reduceat(daily, bounds, axis=1) / 7
+            per = per * block_mask[:, period_dates.astype('datetime64[M]').astype('int64') % 12]
+        else:
+            per = np.add.reduceat(daily * block_mask[:, day_months], bounds, axis=1)
+        present = np.logical_or.reduceat(in_range, bounds, axis=1)
+
+        ## Sum the patterns of each group
+        grp_first1 = np.flatnonzero(np.concatenate(([True], key_grp[k0 + 1:k1] != key_grp[k0:k1 - 1])))
+        per_grp = np.add.reduceat(per, grp_first1, axis=0)
+        present_grp = np.logical_or.reduceat(present, grp_first1, axis=0)
+
+        g1, p1 = np.nonzero(present_grp)
+        out_grp.append(key_grp[k0 + grp_first1][g1])
+        out_period.append(p1)
+        out_values.append(per_grp[g1, p1])
+
+    ### Package up the results
+    if out_grp:
+        out_grp = np.concatenate(out_grp)
+        out_period = np.concatenate(out_period)
+        out_values = np.concatenate(out_values)
+    else:
+        out_grp = np.array([], dtype='int64')
+        out_period = np.array([], dtype='int64')
+        out_values = np.array([], dtype='float64')
+
+    index1 = grp_index[out_grp]
+    if not isinstance(index1, pd.MultiIndex):
+        index1 = pd.MultiIndex.from_arrays([index1])
+    levels = list(index1.levels) + [pd.DatetimeIndex(period_dates.astype('datetime64[ns]'))]
+    codes1 = list(index1.codes) + [out_period]
+    index2 = pd.MultiIndex(levels=levels, codes=codes1, names=by + ['Date'], verify_integrity=False)
+
+    ts1 = pd.Series(out_values, index=index2, name='allo')
+
+    return ts1
+
+
 #def allo_ts(server, from_date, to_date, freq, restr_type, site_filter=None, crc_filter=None, crc_wap_filter=None, remove_months=False, in_allo=True):
 #    """
 #    Combo function to completely create a time series from the allocation DataFrame. Source data must be from an instance of the Hydro db.
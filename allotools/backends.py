@@ -0,0 +1,778 @@
+# -*- coding: utf-8 -*-
+import os
+import numbers
+import sqlite3
+import pandas as pd
+import pyarrow.parquet as pq
+from allotools import cache, usage, util
+from allotools import parameters as param
+from allotools.allocation_ts import period_codes, period_ends
+
+#####################################
+### Parameters
+
+ts_summ_cols = ['ExtSiteID', 'DatasetTypeID', 'FromDate', 'ToDate']
+ts_cols = ['ExtSiteID', 'DateTime', 'Value']
+lf_cols = ['RecordNumber', 'AllocationBlock', 'RestrDate', 'Allocation']
+
+## The SQL of the day (d) of the low flow restrictions and the daily usage and the period end dates of the day for the freqs of rd_lf_agg and rd_ts_agg
+lf_day = {'mssql': 'CAST([RestrDate] AS date)', 'sqlite': 'date("RestrDate")'}
+ts_day = {'mssql': 'CAST([DateTime] AS date)', 'sqlite': 'date("DateTime")'}
+period_end_stmts = {
+    'mssql': {'D': 'd', 'W': "DATEADD(day, 6 - DATEDIFF(day, '19000101', d) % 7, d)", 'M': 'EOMONTH(d)', 'A-JUN': 'DATEFROMPARTS(YEAR(d) + CASE WHEN MONTH(d) > 6 THEN 1 ELSE 0 END, 6, 30)', 'A': 'DATEFROMPARTS(YEAR(d), 12, 31)'},
+    'sqlite': {'D': 'd', 'W': "date(d, 'weekday 0')", 'M': "date(d, 'start of month', '+1 month', '-1 day')", 'A-JUN': "date(d, '+6 months', 'start of year', '+6 months', '-1 day')", 'A': "date(d, 'start of year', '+1 year', '-1 day')"}
+    }
+quote = {'mssql': '[{}]', 'sqlite': '"{}"'}
+
+## The usage.remove_spikes methods that rd_ts_agg can do in SQL
+sql_spike_methods = [None, 'shift']
+
+## pdsql puts longer where lists into temp tables, which can't be used with a custom statement
+mssql_max_where = 20000
+
+## The SQL versions of the Wap regex of filters.rd_sites. They only cut down the rows, as SQL Server's LIKE isn't case sensitive.
+wap_patterns = {'mssql': "[ExtSiteID] LIKE '%[A-Z][0-9][0-9]/[0-9]%'", 'sqlite': "\"ExtSiteID\" GLOB '*[A-Z][0-9][0-9]/[0-9]*'"}
+
+#####################################
+### Functions
+
+
+def lf_agg(lf, freq='D'):
+    """
+    Function to aggregate the low flow restrictions table to the daily min Allocation of each RecordNumber and optionally to the mean of the daily mins over the periods of a freq. This is the pandas version of the aggregation in Backend.rd_lf_agg.
+
+    Parameters
+    ----------
+    lf : DataFrame
+        The low flow restrictions table with the lf_cols.
+    freq : str
+        Pandas frequency str of the periods. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+
+    Returns
+    -------
+    DataFrame
+        with the RecordNumber, Date (the end of the period), and Allocation columns
+    """
+    if freq not in period_end_stmts['sqlite']:
+        raise ValueError('freq must be one of ' + str(list(period_end_stmts['sqlite'])))
+
+    lf1 = pd.DataFrame({'RecordNumber': lf['RecordNumber'].values, 'Date': pd.to_datetime(lf['RestrDate']).dt.normalize().values, 'Allocation': lf['Allocation'].values})
+    lf2 = lf1.groupby(['RecordNumber', 'Date'])['Allocation'].min().reset_index()
+
+    if freq != 'D':
+        days = lf2['Date'].values.astype('datetime64[D]')
+        lf2['Date'] = period_ends(period_codes(days, freq), freq).astype('datetime64[ns]')
+        lf2 = lf2.groupby(['RecordNumber', 'Date'])['Allocation'].mean().reset_index()
+
+    return lf2
+
+
+def lf_agg_stmt(table, where_lst=None, freq='D', dialect='mssql'):
+    """
+    Function to create the SQL statement of the daily min Allocation of each RecordNumber and optionally the mean of the daily mins over the periods of a freq (see lf_agg).
+
+    Parameters
+    ----------
+    table : str
+        The low flow restrictions table name.
+    where_lst : list of str or None
+        The where conditions of the rows (joined by AND).
+    freq : str
+        Pandas frequency str of the periods. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+    dialect : str
+        Either 'mssql' or 'sqlite'.
+
+    Returns
+    -------
+    str
+    """
+    if freq not in period_end_stmts[dialect]:
+        raise ValueError('freq must be one of ' + str(list(period_end_stmts[dialect])))
+
+    crc = quote[dialect].format('RecordNumber')
+    day = lf_day[dialect]
+    table1 = table if dialect == 'mssql' else quote[dialect].format(table)
+
+    stmt = 'SELECT ' + crc + ', ' + day + ' AS d, MIN(' + quote[dialect].format('Allocation') + ') AS Allocation FROM ' + table1
+    if where_lst:
+        stmt = stmt + ' WHERE ' + ' AND '.join(where_lst)
+    stmt = stmt + ' GROUP BY ' + crc + ', ' + day
+
+    ### Average the daily mins over the periods
+    if freq == 'D':
+        stmt = 'SELECT RecordNumber, d AS Date, Allocation FROM (' + stmt + ') AS daily'
+    else:
+        period = period_end_stmts[dialect][freq]
+        stmt = 'SELECT RecordNumber, ' + period + ' AS Date, AVG(CAST(Allocation AS float)) AS Allocation FROM (' + stmt + ') AS daily GROUP BY RecordNumber, ' + period
+
+    return stmt
+
+
+def ts_agg_stmt(table, where_lst=None, freq='M', dialect='mssql', spike_method='shift', min_diff=2):
+    """
+    Function to create the SQL statement of the cleaned daily usage summed per Wap over the periods of a freq. The negative values are set to zero and the spikes are removed like usage.prep_usage. Only the 'shift' spike method can be done in SQL (with the LAG and LEAD window functions).
+
+    Parameters
+    ----------
+    table : str
+        The daily ts table name.
+    where_lst : list of str or None
+        The where conditions of the rows (joined by AND).
+    freq : str
+        Pandas frequency str of the periods. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+    dialect : str
+        Either 'mssql' or 'sqlite'.
+    spike_method : str or None
+        Either 'shift' or None.
+    min_diff : int or float
+        The min_diff of the 'shift' spike method.
+
+    Returns
+    -------
+    str
+    """
+    if freq not in period_end_stmts[dialect]:
+        raise ValueError('freq must be one of ' + str(list(period_end_stmts[dialect])))
+    if spike_method not in sql_spike_methods:
+        raise ValueError('spike_method must be one of ' + str(sql_spike_methods))
+
+    q = quote[dialect].format
+    table1 = table if dialect == 'mssql' else q(table)
+
+    stmt = 'SELECT ' + q('ExtSiteID') + ' AS Wap, ' + ts_day[dialect] + ' AS d, CASE WHEN ' + q('Value') + ' < 0 THEN 0 ELSE ' + q('Value') + ' END AS v FROM ' + table1
+    if where_lst:
+        stmt = stmt + ' WHERE ' + ' AND '.join(where_lst)
+
+    ### Remove the spikes with the values either side of each day
+    if spike_method == 'shift':
+        stmt = 'SELECT Wap, d, v, LAG(v) OVER (PARTITION BY Wap ORDER BY d) AS p, LEAD(v) OVER (PARTITION BY Wap ORDER BY d) AS n FROM (' + stmt + ') AS clean'
+        value = 'CASE WHEN v > p + n + ' + str(min_diff) + ' THEN (p + n) / 2.0 ELSE v END'
+    else:
+        value = 'v'
+
+    ### Sum the days over the periods
+    period = period_end_stmts[dialect][freq]
+    stmt = 'SELECT Wap, ' + period + ' AS Date, SUM(' + value + ') AS TotalUsage FROM (' + stmt + ') AS daily GROUP BY Wap, ' + period
+
+    return stmt
+
+
+def _sql_spikes(spike_method, spike_params):
+    """
+    Function to determine if the spike method and params can be done in SQL (see ts_agg_stmt).
+    """
+    if spike_params is None:
+        spike_params = {}
+
+    return (spike_method in sql_spike_methods) and set(spike_params).issubset(['min_diff'])
+
+
+def _sql_literal(value):
+    """
+    Function to put a number, str, or date value into an SQL statement.
+    """
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return str(value)
+
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _and_where_in(where_in, col, values):
+    """
+    Function to add the values of a column to a where_in dict. If the column is already in the where_in then only the values in both are kept.
+    """
+    if values is None:
+        return where_in
+
+    where_in1 = dict(where_in) if where_in is not None else {}
+    if col in where_in1:
+        values1 = set(values)
+        where_in1[col] = [v for v in where_in1[col] if v in values1]
+    else:
+        where_in1[col] = list(values)
+
+    return where_in1
+
+
+def _empty_where_in(where_in):
+    """
+    Function to determine if any of the where_in lists are empty. SQL Server can't run an empty IN () and the query wouldn't return any rows anyway.
+    """
+    if where_in is None:
+        return False
+
+    return any(len(v) == 0 for v in where_in.values())
+
+
+def allo_where_stmts(dialect, exclude_uses=None, from_date=None, to_date=None, min_days=None):
+    """
+    Function to create the SQL where conditions of the allocation filters of filters.rd_allo. The conditions keep all of the rows that the pandas filters keep (and possibly a few more), so the pandas filters still need to be applied to the results.
+
+    Parameters
+    ----------
+    dialect : str
+        Either 'mssql' or 'sqlite'.
+    exclude_uses : list of str or None
+        The WaterUses to remove.
+    from_date : str or None
+        The consents must end after the from_date.
+    to_date : str or None
+        The consents must start before the to_date.
+    min_days : int or None
+        The consents must be longer than the min_days.
+
+    Returns
+    -------
+    list of str
+    """
+    q = quote[dialect].format
+    if dialect == 'mssql':
+        date = q
+    else:
+        date = lambda c: 'datetime(' + q(c) + ')'
+
+    where_lst = []
+    if exclude_uses:
+        where_lst.append('(' + q('WaterUse') + ' IS NULL OR ' + q('WaterUse') + ' NOT IN (' + ', '.join(_sql_literal(u) for u in exclude_uses) + '))')
+    if from_date is not None:
+        where_lst.append(date('ToDate') + ' > ' + _sql_literal(pd.Timestamp(from_date)))
+    if to_date is not None:
+        where_lst.append(date('FromDate') + ' < ' + _sql_literal(pd.Timestamp(to_date)))
+    if min_days is not None:
+        if dialect == 'mssql':
+            where_lst.append('DATEDIFF(day, [FromDate], [ToDate]) > ' + str(int(min_days)))
+        else:
+            where_lst.append('julianday("ToDate") - julianday("FromDate") > ' + str(int(min_days)))
+
+    return where_lst
+
+#####################################
+### Backends
+
+
+class Backend(object):
+    """
+    Base class for the data sources of AlloUsage. Subclasses only need to implement rd_table, but can override any of the five source reads (allocation, sites, ts summary, ts, and low flow restrictions) with more efficient versions.
+    """
+
+    def rd_table(self, table, col_names=None, where_in=None, from_date=None, to_date=None, date_col=None):
+        """
+        Function to read a table from the data source.
+
+        Parameters
+        ----------
+        table : str
+            The table name (e.g. param.allo_table).
+        col_names : list of str
+            The column names that should be retrieved.
+        where_in : dict
+            A dictionary of column names to lists of values.
+        from_date : str
+            The start date in the form '2010-01-01'.
+        to_date : str
+            The end date in the form '2010-01-01'.
+        date_col : str
+            The column that contains the dates.
+
+        Returns
+        -------
+        DataFrame
+        """
+        raise NotImplementedError
+
+
+    def _allo_where_in(self, where_in, status, site_where_in, sites=None):
+        """
+        Function to add the ConsentStatus values and the ExtSiteIDs of the sites that match the site_where_in to the where_in of the allocation table. The sites are only read if they haven't been passed.
+        """
+        where_in1 = _and_where_in(where_in, 'ConsentStatus', status)
+        if site_where_in is not None:
+            if sites is None:
+                sites = self.rd_sites(site_where_in, waps_only=True)
+            where_in1 = _and_where_in(where_in1, 'ExtSiteID', sites['ExtSiteID'].tolist())
+
+        return where_in1
+
+
+    def rd_allo(self, where_in=None, status=None, exclude_uses=None, from_date=None, to_date=None, min_days=None, site_where_in=None, sites=None):
+        """
+        Function to read the allocation table. The filters are compiled into the query where the backend can (see allo_where_stmts). This version reads the site_where_in sites first and pushes their ExtSiteIDs and the status into the where_in of rd_table. The other filters are left to filters.rd_allo.
+
+        Parameters
+        ----------
+        where_in : dict
+            A dictionary of column names to lists of values.
+        status : list of str or None
+            The ConsentStatus values to keep.
+        exclude_uses : list of str or None
+            The WaterUses to remove.
+        from_date : str or None
+            The consents must end after the from_date.
+        to_date : str or None
+            The consents must start before the to_date.
+        min_days : int or None
+            The consents must be longer than the min_days.
+        site_where_in : dict or None
+            A dictionary of ExternalSite column names to lists of values. Only the allocation of the matching Waps is kept.
+        sites : DataFrame or None
+            The sites of the site_where_in with an ExtSiteID column (e.g. from rd_sites) if they have already been read, so that they aren't read again. Ignored without a site_where_in.
+
+        Returns
+        -------
+        DataFrame
+        """
+        where_in1 = self._allo_where_in(where_in, status, site_where_in, sites)
+
+        return self.rd_table(param.allo_table, param.allo_cols, where_in=where_in1)
+
+
+    def rd_sites(self, where_in=None, waps_only=False):
+        """
+        Function to read the ExternalSite table. waps_only will remove most of the sites that don't look like Waps in the query where the backend can (see wap_patterns).
+        """
+        return self.rd_table(param.site_table, param.site_cols, where_in=where_in)
+
+
+    def rd_ts_summ(self, dataset_types):
+        """
+        Function to read the ts summary table.
+        """
+        return self.rd_table(param.ts_summ_table, ts_summ_cols, where_in={'DatasetTypeID': list(dataset_types)})
+
+
+    def rd_ts(self, waps, dataset_types, from_date=None, to_date=None):
+        """
+        Function to read the daily ts table.
+        """
+        return self.rd_table(param.ts_table, ts_cols, where_in={'ExtSiteID': list(waps), 'DatasetTypeID': list(dataset_types)}, from_date=from_date, to_date=to_date, date_col='DateTime')
+
+
+    def rd_lf(self, crcs, from_date=None, to_date=None):
+        """
+        Function to read the low flow restrictions table.
+        """
+        return self.rd_table(param.lf_table, lf_cols, where_in={'RecordNumber': list(crcs)}, from_date=from_date, to_date=to_date, date_col='RestrDate')
+
+
+    def rd_lf_agg(self, crcs, from_date=None, to_date=None, freq='D'):
+        """
+        Function to read the low flow restrictions as the daily min Allocation of each RecordNumber and optionally the mean of the daily mins over the periods of a freq (see lf_agg). Backends that can run SQL do the aggregation in the query, so only the aggregated rows are transferred. This version reads the table and aggregates it with pandas.
+
+        Returns
+        -------
+        DataFrame
+            with the RecordNumber, Date (the end of the period), and Allocation columns
+        """
+        return lf_agg(self.rd_lf(crcs, from_date, to_date), freq)
+
+
+    def rd_ts_agg(self, waps, dataset_types, from_date=None, to_date=None, freq='M', spike_method='shift', spike_params=None):
+        """
+        Function to read the daily usage cleaned like usage.prep_usage and summed per Wap over the periods of a freq. Backends that can run SQL do the cleaning and the sums in the query (for the spike methods in sql_spike_methods), so only the period sums are transferred. This version reads the daily data and does it in pandas.
+
+        Parameters
+        ----------
+        waps : list of str
+            The Waps to read.
+        dataset_types : list of int
+            The DatasetTypeIDs of the ts table.
+        from_date : str
+            The start date.
+        to_date : str
+            The end date.
+        freq : str
+            Pandas frequency str of the periods. Must be 'D', 'W', 'M', 'A-JUN', or 'A'.
+        spike_method : str or None
+            The usage.remove_spikes method.
+        spike_params : dict or None
+            Any kwargs to be passed to usage.remove_spikes.
+
+        Returns
+        -------
+        DataFrame
+            with the Wap, Date (the end of the period), and TotalUsage columns
+        """
+        tsdata1 = usage.prep_usage(self.rd_ts(waps, dataset_types, from_date, to_date), spike_method, spike_params)
+        if tsdata1.empty:
+            return usage.empty_usage()
+
+        return util.period_agg(tsdata1, 'Wap', 'Date', freq).reset_index()
+
+
+class MssqlBackend(Backend):
+    """
+    The ECan MSSQL databases as the data source. Queries can optionally be cached on disk (see cache.rd_sql).
+
+    Parameters
+    ----------
+    hydro_server : str
+        The server of the hydro database.
+    hydro_database : str
+        The hydro database with the site and ts tables.
+    crc_server : str
+        The server of the consents database.
+    crc_database : str
+        The consents database with the allocation and low flow restriction tables.
+    cache_dir : str or None
+        The path to a directory to cache the queries as parquet files. None will not cache the queries.
+    ttl : int or None
+        The time to live of the cached queries in seconds.
+    max_size : int or None
+        The max size of the cache directory in bytes.
+    refresh : bool
+        Should the database be requeried and the cached queries be replaced?
+    """
+
+    def __init__(self, hydro_server=param.hydro_server, hydro_database=param.hydro_database, crc_server=param.crc_server, crc_database=param.crc_database, cache_dir=None, ttl=param.cache_ttl, max_size=param.cache_max_size, refresh=False):
+        """
+
+        """
+        setattr(self, 'hydro_server', hydro_server)
+        setattr(self, 'hydro_database', hydro_database)
+        setattr(self, 'crc_server', crc_server)
+        setattr(self, 'crc_database', crc_database)
+        setattr(self, 'cache_kwargs', {'cache_dir': cache_dir, 'ttl': ttl, 'max_size': max_size, 'refresh': refresh})
+
+
+    def _server_db(self, table):
+        """
+
+        """
+        if table in [param.allo_table, param.lf_table]:
+            return self.crc_server, self.crc_database
+        else:
+            return self.hydro_server, self.hydro_database
+
+
+    def rd_table(self, table, col_names=None, where_in=None, from_date=None, to_date=None, date_col=None):
+        """
+        Function to read a table from the MSSQL databases.
+        """
+        if _empty_where_in(where_in):
+            return pd.DataFrame(columns=col_names)
+
+        server, database = self._server_db(table)
+        df = cache.rd_sql(server, database, table, col_names, where_in=where_in, from_date=from_date, to_date=to_date, date_col=date_col, **self.cache_kwargs)
+
+        return df
+
+
+    def _rd_stmt(self, table, col_names, where_in, where_lst):
+        """
+        Function to read a table with the where_in and the extra where conditions as a custom statement. Returns None if a where_in list is too long to be put in the statement.
+        """
+        if where_in is None:
+            where_in = {}
+        if any(len(v) > mssql_max_where for v in where_in.values()):
+            return None
+        if _empty_where_in(where_in):
+            return pd.DataFrame(columns=col_names)
+
+        from pdsql import mssql
+
+        where_in_lst = None
+        if where_in:
+            where_in_lst, _ = mssql.sql_where_stmts({k: list(v) for k, v in where_in.items()})
+        where_lst1 = (where_in_lst or []) + where_lst
+
+        stmt = 'SELECT ' + ', '.join(['[' + c + ']' for c in col_names]) + ' FROM ' + table
+        if where_lst1:
+            stmt = stmt + ' WHERE ' + ' AND '.join(where_lst1)
+
+        server, database = self._server_db(table)
+        df = cache.rd_sql(server, database, table, stmt=stmt, **self.cache_kwargs)
+
+        return df
+
+
+    def rd_allo(self, where_in=None, status=None, exclude_uses=None, from_date=None, to_date=None, min_days=None, site_where_in=None, sites=None):
+        """
+        Function to read the allocation table with the filters in the query (see Backend.rd_allo). The sites are on a different server, so the site_where_in is pushed down as the list of the matching ExtSiteIDs.
+        """
+        where_in1 = self._allo_where_in(where_in, status, site_where_in, sites)
+        df = self._rd_stmt(param.allo_table, param.allo_cols, where_in1, allo_where_stmts('mssql', exclude_uses, from_date, to_date, min_days))
+        if df is None:
+            df = self.rd_table(param.allo_table, param.allo_cols, where_in=where_in1)
+
+        return df
+
+
+    def rd_sites(self, where_in=None, waps_only=False):
+        """
+        Function to read the ExternalSite table (see Backend.rd_sites).
+        """
+        df = None
+        if waps_only:
+            df = self._rd_stmt(param.site_table, param.site_cols, where_in, [wap_patterns['mssql']])
+        if df is None:
+            df = self.rd_table(param.site_table, param.site_cols, where_in=where_in)
+
+        return df
+
+
+    def rd_lf_agg(self, crcs, from_date=None, to_date=None, freq='D'):
+        """
+        Function to aggregate the low flow restrictions in the crc database (see Backend.rd_lf_agg).
+        """
+        crcs = list(crcs)
+        if not crcs:
+            return pd.DataFrame(columns=['RecordNumber', 'Date', 'Allocation'])
+        if len(crcs) > mssql_max_where:
+            return super(MssqlBackend, self).rd_lf_agg(crcs, from_date, to_date, freq)
+
+        from pdsql import mssql
+
+        from_date1 = None if from_date is None else str(pd.Timestamp(from_date))
+        to_date1 = None if to_date is None else str(pd.Timestamp(to_date))
+        where_lst, _ = mssql.sql_where_stmts({'RecordNumber': crcs}, from_date=from_date1, to_date=to_date1, date_col='RestrDate')
+        stmt = lf_agg_stmt(param.lf_table, where_lst, freq, 'mssql')
+
+        server, database = self._server_db(param.lf_table)
+        df = cache.rd_sql(server, database, param.lf_table, stmt=stmt, **self.cache_kwargs)
+        df['Date'] = pd.to_datetime(df['Date'])
+
+        return df
+
+
+    def rd_ts_agg(self, waps, dataset_types, from_date=None, to_date=None, freq='M', spike_method='shift', spike_params=None):
+        """
+        Function to clean and sum the daily usage in the hydro database (see Backend.rd_ts_agg).
+        """
+        waps = list(waps)
+        dataset_types = list(dataset_types)
+        if (not waps) or (not dataset_types):
+            return usage.empty_usage()
+        if (len(waps) > mssql_max_where) or (not _sql_spikes(spike_method, spike_params)):
+            return super(MssqlBackend, self).rd_ts_agg(waps, dataset_types, from_date, to_date, freq, spike_method, spike_params)
+
+        from pdsql import mssql
+
+        from_date1 = None if from_date is None else str(pd.Timestamp(from_date))
+        to_date1 = None if to_date is None else str(pd.Timestamp(to_date))
+        where_lst, _ = mssql.sql_where_stmts({'ExtSiteID': waps, 'DatasetTypeID': dataset_types}, from_date=from_date1, to_date=to_date1, date_col='DateTime')
+        min_diff = (spike_params or {}).get('min_diff', 2)
+        stmt = ts_agg_stmt(param.ts_table, where_lst, freq, 'mssql', spike_method, min_diff)
+
+        server, database = self._server_db(param.ts_table)
+        df = cache.rd_sql(server, database, param.ts_table, stmt=stmt, **self.cache_kwargs)
+        df['Date'] = pd.to_datetime(df['Date'])
+        df['TotalUsage'] = df['TotalUsage'].astype(float)
+
+        return df
+
+
+class LocalBackend(Backend):
+    """
+    A local SQLite database or a directory of parquet files as the data source. The tables must have the same names and columns as the ECan databases (e.g. 'reporting.CrcAlloSiteSumm'). Parquet files are named after the table with a .parquet extension.
+
+    Parameters
+    ----------
+    path : str
+        The path to the SQLite file or the parquet directory.
+    """
+
+    def __init__(self, path):
+        """
+
+        """
+        setattr(self, 'path', path)
+        setattr(self, 'is_sqlite', not os.path.isdir(path))
+
+
+    def _connect(self):
+        """
+
+        """
+        return sqlite3.connect(self.path)
+
+
+    def rd_table(self, table, col_names=None, where_in=None, from_date=None, to_date=None, date_col=None):
+        """
+        Function to read a table from the SQLite database or the parquet files.
+        """
+        if self.is_sqlite:
+            return self._rd_sqlite(table, col_names, where_in, from_date, to_date, date_col)
+        else:
+            return self._rd_parquet(table, col_names, where_in, from_date, to_date, date_col)
+
+
+    def _rd_sqlite(self, table, col_names, where_in, from_date, to_date, date_col, extra_where=None):
+        """
+        Where values are put into temp tables so that long lists don't hit the SQLite variable limit. Dates are compared via the SQLite datetime function as they are stored as text. The extra_where conditions are added as they are.
+        """
+        if col_names is not None:
+            col_stmt = ', '.join(['"' + c + '"' for c in col_names])
+        else:
+            col_stmt = '*'
+
+        conn = self._connect()
+        try:
+            where_lst, params = self._sqlite_where(conn, where_in, from_date, to_date, date_col)
+            if extra_where:
+                where_lst = where_lst + extra_where
+
+            stmt = 'SELECT ' + col_stmt + ' FROM "' + table + '"'
+            if where_lst:
+                stmt = stmt + ' WHERE ' + ' AND '.join(where_lst)
+
+            df = pd.read_sql(stmt, conn, params=params)
+        finally:
+            conn.close()
+
+        return df
+
+
+    def _sqlite_where(self, conn, where_in, from_date, to_date, date_col):
+        """
+        Function to create the where conditions and params of a query. The where_in values are put into temp tables of the connection.
+        """
+        where_lst = []
+        params = []
+        if isinstance(where_in, dict):
+            for i, (key, value) in enumerate(where_in.items()):
+                temp_tab = 'temp_where' + str(i)
+                conn.execute('CREATE TEMP TABLE ' + temp_tab + ' (v)')
+                conn.executemany('INSERT INTO ' + temp_tab + ' VALUES (?)', [(v.item() if hasattr(v, 'item') else v,) for v in value])
+                where_lst.append('"' + key + '" IN (SELECT v FROM ' + temp_tab + ')')
+        if from_date is not None:
+            where_lst.append('datetime("' + date_col + '") >= datetime(?)')
+            params.append(str(pd.Timestamp(from_date)))
+        if to_date is not None:
+            where_lst.append('datetime("' + date_col + '") <= datetime(?)')
+            params.append(str(pd.Timestamp(to_date)))
+
+        return where_lst, params
+
+
+    def rd_allo(self, where_in=None, status=None, exclude_uses=None, from_date=None, to_date=None, min_days=None, site_where_in=None, sites=None):
+        """
+        Function to read the allocation table with the filters in the SQLite query and the sites joined in the query unless they have been passed (see Backend.rd_allo). The parquet files only get the pushdown of Backend.rd_allo.
+        """
+        if not self.is_sqlite:
+            return super(LocalBackend, self).rd_allo(where_in, status, exclude_uses, from_date, to_date, min_days, site_where_in, sites)
+
+        if sites is not None:
+            where_in1 = self._allo_where_in(where_in, status, site_where_in, sites)
+        else:
+            where_in1 = _and_where_in(where_in, 'ConsentStatus', status)
+        where_lst = allo_where_stmts('sqlite', exclude_uses, from_date, to_date, min_days)
+        if (site_where_in is not None) and (sites is None):
+            site_lst = ['"' + k + '" IN (' + ', '.join(_sql_literal(v) for v in values) + ')' for k, values in site_where_in.items()]
+            where_lst.append('"ExtSiteID" IN (SELECT "ExtSiteID" FROM "' + param.site_table + '" WHERE ' + ' AND '.join(site_lst + [wap_patterns['sqlite']]) + ')')
+
+        return self._rd_sqlite(param.allo_table, param.allo_cols, where_in1, None, None, None, where_lst)
+
+
+    def rd_sites(self, where_in=None, waps_only=False):
+        """
+        Function to read the ExternalSite table (see Backend.rd_sites).
+        """
+        if self.is_sqlite and waps_only:
+            return self._rd_sqlite(param.site_table, param.site_cols, where_in, None, None, None, [wap_patterns['sqlite']])
+        else:
+            return self.rd_table(param.site_table, param.site_cols, where_in=where_in)
+
+
+    def rd_lf_agg(self, crcs, from_date=None, to_date=None, freq='D'):
+        """
+        Function to aggregate the low flow restrictions in the SQLite database (see Backend.rd_lf_agg). The parquet files are aggregated with pandas.
+        """
+        if not self.is_sqlite:
+            return super(LocalBackend, self).rd_lf_agg(crcs, from_date, to_date, freq)
+
+        conn = self._connect()
+        try:
+            where_lst, params = self._sqlite_where(conn, {'RecordNumber': list(crcs)}, from_date, to_date, 'RestrDate')
+            stmt = lf_agg_stmt(param.lf_table, where_lst, freq, 'sqlite')
+
+            df = pd.read_sql(stmt, conn, params=params)
+        finally:
+            conn.close()
+        df['Date'] = pd.to_datetime(df['Date'])
+
+        return df
+
+
+    def rd_ts_agg(self, waps, dataset_types, from_date=None, to_date=None, freq='M', spike_method='shift', spike_params=None):
+        """
+        Function to clean and sum the daily usage in the SQLite database (see Backend.rd_ts_agg). The parquet files are done in pandas.
+        """
+        if (not self.is_sqlite) or (not _sql_spikes(spike_method, spike_params)):
+            return super(LocalBackend, self).rd_ts_agg(waps, dataset_types, from_date, to_date, freq, spike_method, spike_params)
+
+        conn = self._connect()
+        try:
+            where_lst, params = self._sqlite_where(conn, {'ExtSiteID': list(waps), 'DatasetTypeID': list(dataset_types)}, from_date, to_date, 'DateTime')
+            min_diff = (spike_params or {}).get('min_diff', 2)
+            stmt = ts_agg_stmt(param.ts_table, where_lst, freq, 'sqlite', spike_method, min_diff)
+
+            df = pd.read_sql(stmt, conn, params=params)
+        finally:
+            conn.close()
+        df['Date'] = pd.to_datetime(df['Date'])
+        df['TotalUsage'] = df['TotalUsage'].astype(float)
+
+        return df
+
+
+    def _rd_parquet(self, table, col_names, where_in, from_date, to_date, date_col):
+        """
+
+        """
+        path1 = os.path.join(self.path, table + '.parquet')
+
+        filters = None
+        if isinstance(where_in, dict):
+            filters = [(k, 'in', list(v)) for k, v in where_in.items()]
+
+        if col_names is not None:
+            cols = list(col_names)
+            if (date_col is not None) and (date_col not in cols):
+                cols.append(date_col)
+        else:
+            cols = None
+
+        ## pyarrow can't type an empty in filter and nothing would be returned anyway
+        if _empty_where_in(where_in):
+            df = pq.read_schema(path1).empty_table().to_pandas()
+            df = df[cols] if cols is not None else df
+        else:
+            df = pd.read_parquet(path1, columns=cols, filters=filters)
+
+        if date_col is not None:
+            dates = pd.to_datetime(df[date_col])
+            mask = pd.Series(True, index=df.index)
+            if from_date is not None:
+                mask = mask & (dates >= pd.Timestamp(from_date))
+            if to_date is not None:
+                mask = mask & (dates <= pd.Timestamp(to_date))
+            df = df[mask]
+        if col_names is not None:
+            df = df[col_names]
+
+        return df.reset_index(drop=True)
+
+
+    def write_table(self, table, df):
+        """
+        Function to write (or replace) a table in the local data source. Useful for saving a snapshot of the ECan databases (e.g. from the MssqlBackend) for offline use.
+
+        Parameters
+        ----------
+        table : str
+            The table name.
+        df : DataFrame
+            The table data.
+
+        Returns
+        -------
+        None
+        """
+        if self.is_sqlite:
+            conn = self._connect()
+            try:
+                df.to_sql(table, conn, if_exists='replace', index=False)
+            finally:
+                conn.close()
+        else:
+            df.to_parquet(os.path.join(self.path, table + '.parquet'), index=False)
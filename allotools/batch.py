@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from allotools import AlloUsage, export
+from allotools.backends import LocalBackend
+
+#####################################
+### Parameters
+
+plot_kinds = {'group': 'plot_group', 'stacked': 'plot_stacked'}
+ts_formats = ['csv', 'parquet', 'arrow']
+
+example_config = {
+    'from_date': '2015-07-01',
+    'to_date': '2018-06-30',
+    'local_path': None,
+    'alloc': {'site_filter': {'CwmsName': ['Selwyn - Waihora']}, 'cache_dir': None},
+    'export_path': 'output',
+    'format': 'csv',
+    'n_procs': 4,
+    'jobs': [
+        {'name': 'Selwyn',
+         'filter': {'CatchmentGroupName': ['Selwyn River']},
+         'ts': [{'datasets': ['Allo', 'MeteredAllo', 'Usage'], 'freq': 'A-JUN', 'groupby': ['RecordNumber', 'Wap'], 'usage_allo_ratio': 10}],
+         'plots': [{'kind': 'group', 'freq': 'A-JUN', 'val': 'total', 'group': 'CatchmentName', 'with_restr': True}, {'kind': 'stacked', 'freq': 'A-JUN', 'val': 'total'}]},
+        {'name': 'Selwyn_2017',
+         'filter': {'CatchmentGroupName': ['Selwyn River']},
+         'from_date': '2016-07-01',
+         'ts': [{'datasets': ['Allo', 'RestrAllo'], 'freq': 'M', 'groupby': ['WaterUse']}]}
+    ]
+}
+
+#####################################
+### Functions
+
+
+def rd_config(path):
+    """
+    Function to read a batch config json file. See example_config for the structure.
+
+    Parameters
+    ----------
+    path : str
+        The path to the json file.
+
+    Returns
+    -------
+    dict
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    return config
+
+
+def _job_mask(allo, job_filter, from_date, to_date):
+    """
+    Function to select the allo rows of a job by a dict of {column or index level: [values]} and the job dates.
+    """
+    mask = ((allo.FromDate < to_date) & (allo.ToDate > from_date)).values
+
+    if job_filter is not None:
+        for col, values in job_filter.items():
+            if col in allo.columns:
+                col_values = allo[col]
+            elif col in allo.index.names:
+                col_values = allo.index.get_level_values(col)
+            else:
+                raise ValueError(col + ' is not a column of the allo')
+            mask = mask & np.asarray(col_values.isin(values))
+
+    return mask
+
+
+def run_job(alloc, job, export_path, format='csv'):
+    """
+    Function to run the time series and plots of one job and write them to a directory named after the job.
+
+    Parameters
+    ----------
+    alloc : AlloUsage
+        The AlloUsage object of the job (e.g. a subset of the shared object).
+    job : dict
+        The job config with the name, ts, and plots keys. Every ts item needs the datasets, freq, and groupby and can have any other get_ts kwargs. Every plot item needs the kind ('group' or 'stacked') and freq and can have any other plot_group or plot_stacked kwargs.
+    export_path : str
+        The base directory of the outputs.
+    format : str
+        The format of the time series. Either 'csv', 'parquet', or 'arrow'. The parquet and arrow time series are partitioned by water year.
+
+    Returns
+    -------
+    list of str
+        The paths of the written outputs.
+    """
+    job_path = os.path.join(export_path, job['name'])
+    if not os.path.exists(job_path):
+        os.makedirs(job_path)
+
+    paths = []
+
+    ### Time series
+    for ts_job in job.get('ts', []):
+        kwargs = ts_job.copy()
+        datasets = kwargs.pop('datasets')
+        freq = kwargs.pop('freq')
+        groupby = kwargs.pop('groupby')
+
+        ts1 = alloc.get_ts(datasets, freq, groupby[:], **kwargs)
+
+        name = '_'.join([job['name'], freq, '-'.join(groupby)])
+        if format == 'csv':
+            path1 = os.path.join(job_path, name + '.csv')
+            ts1.to_csv(path1)
+        else:
+            path1 = os.path.join(job_path, name)
+            export.write_ts(ts1, path1, ['WaterYear'], format)
+        paths.append(path1)
+
+    ### Plots
+    for plot_job in job.get('plots', []):
+        kwargs = plot_job.copy()
+        kind = kwargs.pop('kind')
+        freq = kwargs.pop('freq')
+
+        paths.extend(getattr(alloc, plot_kinds[kind])(freq, export_path=job_path, **kwargs))
+
+    return paths
+
+
+def run(config):
+    """
+    Function to run all of the jobs of a batch config. The source data for the dates and filters of the whole batch is read once (with prefetch), then each job gets a subset of it by its filter and dates and the jobs are run in a pool of processes.
+
+    Parameters
+    ----------
+    config : dict
+        The batch config with the keys:
+            from_date and to_date : the dates of the batch and the default dates of the jobs.
+            local_path : the path to a LocalBackend (optional, otherwise the ECan databases are used).
+            alloc : any other AlloUsage kwargs (optional, e.g. site_filter, crc_filter, or cache_dir).
+            export_path : the base directory of the outputs.
+            format : 'csv', 'parquet', or 'arrow' (optional, default 'csv').
+            n_procs : the number of processes (optional, None uses the number of processors and 1 runs the jobs in this process).
+            jobs : the list of jobs (see run_job). The job filter is a dict of {column: [values]} of any column of the allo (including the site columns). The job dates must be within the batch dates.
+
+    Returns
+    -------
+    dict
+        of job name to the list of the written output paths
+    """
+    format = config.get('format', 'csv')
+    if format not in ts_formats:
+        raise ValueError('format must be one of ' + str(ts_formats))
+
+    jobs = config['jobs']
+    names = [j['name'] for j in jobs]
+    if len(set(names)) < len(names):
+        raise ValueError('The job names must be unique')
+
+    for job in jobs:
+        for plot_job in job.get('plots', []):
+            if plot_job['kind'] not in plot_kinds:
+                raise ValueError('The plot kind must be one of ' + str(list(plot_kinds)))
+
+    ### Read the shared source data once
+    kwargs = dict(config.get('alloc', {}))
+    if config.get('local_path') is not None:
+        kwargs['backend'] = LocalBackend(config['local_path'])
+
+    alloc = AlloUsage(config['from_date'], config['to_date'], prefetch=True, **kwargs)
+
+    ### Split it into the jobs
+    tasks = []
+    for job in jobs:
+        from_date = job.get('from_date', alloc.from_date)
+        to_date = job.get('to_date', alloc.to_date)
+        mask = _job_mask(alloc.allo, job.get('filter'), from_date, to_date)
+        tasks.append((alloc._subset(mask, from_date, to_date), job, config['export_path'], format))
+
+    ### Run them
+    n_procs = config.get('n_procs')
+    if n_procs == 1:
+        results = [run_job(*t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(n_procs) as executor:
+            futures = [executor.submit(run_job, *t) for t in tasks]
+            results = [f.result() for f in futures]
+
+    return dict(zip(names, results))
+
+
+def main(args=None):
+    """
+    Command line interface to run a batch config json file.
+    """
+    parser = argparse.ArgumentParser(description='Run a batch of AlloUsage time series and plots from a json config file.')
+    parser.add_argument('config', nargs='?', help='The path to the json config file.')
+    parser.add_argument('--n-procs', type=int, help='The number of processes (overrides the config).')
+    parser.add_argument('--example', action='store_true', help='Print an example config and exit.')
+    args = parser.parse_args(args)
+
+    if args.example:
+        print(json.dumps(example_config, indent=1))
+        return 0
+
+    if args.config is None:
+        parser.error('the config path is required')
+
+    config = rd_config(args.config)
+    if args.n_procs is not None:
+        config['n_procs'] = args.n_procs
+
+    outputs = run(config)
+
+    for name, paths in outputs.items():
+        print(name + ': ' + str(len(paths)) + ' outputs')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import subprocess
+import tracemalloc
+import pandas as pd
+from allotools import AlloUsage, synthetic
+from allotools import parameters as param
+
+#####################################
+### Parameters
+
+freqs = ['D', 'W', 'M', 'A-JUN']
+result_cols = ['stage', 'freq', 'dataset', 'time', 'peak_mem']
+
+## Modules that are slow to import and should only be imported on first use
+lazy_modules = ['seaborn', 'matplotlib', 'pdsql']
+
+import_code = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+time1 = time.perf_counter() - start
+print(json.dumps([time1, [m for m in {lazy} if m in sys.modules]]))
+"""
+
+#####################################
+### Functions
+
+
+def _measure(func, *args, **kwargs):
+    """
+    Function to run a function and return the result, the wall time in seconds, and the peak memory of the python allocations in bytes during the run.
+    """
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        time1 = time.perf_counter() - start
+        peak_mem = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, time1, peak_mem
+
+
+def import_time(module='allotools', repeat=3):
+    """
+    Function to measure the time to import a module in new python processes. The min time of the repeats is returned, as the first import can include the time to compile or read the files from disk.
+
+    Parameters
+    ----------
+    module : str
+        The module to import.
+    repeat : int
+        The number of processes to run.
+
+    Returns
+    -------
+    float
+        The import time in seconds.
+    list of str
+        The lazy_modules that were imported with the module.
+    """
+    times = []
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, '-c', import_code.format(module=module, lazy=lazy_modules)], capture_output=True, text=True, check=True).stdout
+        time1, loaded = json.loads(out.strip().splitlines()[-1])
+        times.append(time1)
+
+    return min(times), loaded
+
+
+def _reset(alloc):
+    """
+    Function to remove the time series results from an AlloUsage object, but keep the source data.
+    """
+    alloc.result_cache.clear()
+    for d in param.temp_datasets:
+        if hasattr(alloc, d):
+            delattr(alloc, d)
+
+
+def run(n_consents=1000, n_years=1, to_date='2019-06-30', seed=0, freqs=freqs, datasets=param.dataset_types, groupby=['CatchmentGroupName'], plots=True, path=None):
+    """
+    Function to benchmark AlloUsage on the synthetic data from synthetic.gen_tables. The import time of allotools (see import_time), the AlloUsage initialisation (with prefetch so that all of the source data is read), each dataset of get_ts at each freq, and the plot functions are run separately. Each get_ts run starts with no time series results, but with the source data already read. The peak memory is measured with tracemalloc, which also adds some time to every stage.
+
+    Parameters
+    ----------
+    n_consents : int
+        The number of consents to generate.
+    n_years : int
+        The number of years of daily data to generate.
+    to_date : str
+        The end date of the data and the time series.
+    seed : int
+        The seed of the random number generator.
+    freqs : list of str
+        The freqs to run get_ts at.
+    datasets : list of str
+        The datasets to run get_ts with.
+    groupby : list of str
+        The groupby for get_ts.
+    plots : bool
+        Should plot_group and plot_stacked be run at the 'A-JUN' freq?
+    path : str or None
+        The directory to write the synthetic parquet files and plots to. None will use a temporary directory.
+
+    Returns
+    -------
+    DataFrame
+        with the stage, freq, dataset, time (in seconds), and peak_mem (in bytes) columns
+    """
+    if path is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        path = temp_dir.name
+
+    backend = synthetic.gen_backend(path, n_consents=n_consents, n_years=n_years, to_date=to_date, seed=seed)
+    from_date = str((pd.Timestamp(to_date) - pd.DateOffset(years=n_years) + pd.DateOffset(days=1)).date())
+
+    results = []
+
+    ### Import
+    time1, loaded = import_time()
+    results.append(['import', None, None, time1, None])
+
+    ### Initialisation
+    alloc, time1, peak_mem = _measure(AlloUsage, from_date, to_date, backend=backend, prefetch=True)
+    results.append(['__init__', None, None, time1, peak_mem])
+
+    ### get_ts
+    for freq in freqs:
+        for d in datasets:
+            _reset(alloc)
+            ts1, time1, peak_mem = _measure(alloc.get_ts, [d], freq, groupby[:])
+            results.append(['get_ts', freq, d, time1, peak_mem])
+
+    ### Plots
+    if plots:
+        for name in ['plot_group', 'plot_stacked']:
+            _reset(alloc)
+            plot1, time1, peak_mem = _measure(getattr(alloc, name), 'A-JUN', group='CatchmentGroupName', export_path=path)
+            results.append([name, 'A-JUN', None, time1, peak_mem])
+
+    results1 = pd.DataFrame(results, columns=result_cols)
+
+    return results1
+
+
+def save_baseline(results, baseline_path, **meta):
+    """
+    Function to save the benchmark results as a json file that later runs can be compared against.
+
+    Parameters
+    ----------
+    results : DataFrame
+        The output of run.
+    baseline_path : str
+        The path to the json file.
+    **meta
+        Any other info to be saved with the results (e.g. the run parameters).
+
+    Returns
+    -------
+    None
+    """
+    meta.update({'created': str(pd.Timestamp.now()), 'python': platform.python_version(), 'pandas': pd.__version__, 'platform': platform.platform()})
+    baseline = {'meta': meta, 'results': json.loads(results.to_json(orient='records', double_precision=15))}
+
+    with open(baseline_path, 'w') as f:
+        json.dump(baseline, f, indent=1)
+
+
+def compare(results, baseline_path, tolerance=0.2):
+    """
+    Function to compare benchmark results to a baseline file from save_baseline.
+
+    Parameters
+    ----------
+    results : DataFrame
+        The output of run.
+    baseline_path : str
+        The path to the json file.
+    tolerance : float
+        The fraction over the baseline time or peak memory that counts as a regression.
+
+    Returns
+    -------
+    DataFrame
+        with the time and memory ratios to the baseline and a regression column
+    """
+    with open(baseline_path) as f:
+        baseline = pd.DataFrame(json.load(f)['results'], columns=result_cols)
+
+    keys = ['stage', 'freq', 'dataset']
+    comp1 = pd.merge(results.fillna({'freq': '', 'dataset': ''}), baseline.fillna({'freq': '', 'dataset': ''}), on=keys, how='left', suffixes=('', '_base'))
+
+    comp1['time_ratio'] = comp1['time'] / comp1['time_base']
+    comp1['mem_ratio'] = comp1['peak_mem'] / comp1['peak_mem_base']
+    comp1['regression'] = (comp1['time_ratio'] > (1 + tolerance)) | (comp1['mem_ratio'] > (1 + tolerance))
+
+    return comp1
+
+
+def main(args=None):
+    """
+    Command line interface to run the benchmarks and save or compare them to a baseline file.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark AlloUsage on synthetic data.')
+    parser.add_argument('--consents', type=int, default=1000, help='The number of consents.')
+    parser.add_argument('--years', type=int, default=1, help='The number of years of daily data.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed.')
+    parser.add_argument('--no-plots', action='store_true', help='Do not benchmark the plots.')
+    parser.add_argument('--save', help='Save the results to this baseline json file.')
+    parser.add_argument('--compare', help='Compare the results to this baseline json file.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='The fraction over the baseline that counts as a regression.')
+    args = parser.parse_args(args)
+
+    results = run(args.consents, args.years, seed=args.seed, plots=not args.no_plots)
+
+    if args.compare is not None:
+        results = compare(results, args.compare, args.tolerance)
+    print(results.to_string())
+
+    if args.save is not None:
+        save_baseline(results[result_cols], args.save, n_consents=args.consents, n_years=args.years, seed=args.seed)
+
+    if (args.compare is not None) and results['regression'].any():
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
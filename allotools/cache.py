@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import pandas as pd
+try:
+    import fcntl
+except ImportError:
+    import msvcrt
+    fcntl = None
+
+#####################################
+### Parameters
+
+index_file = 'index.json'
+lock_file = 'index.lock'
+
+## The index is read, modified, and written, so the threads (and processes, see _index_lock) sharing a cache need to take turns
+_lock = threading.Lock()
+
+#####################################
+### Classes
+
+
+class LRUCache(object):
+    """
+    In memory least recently used cache for DataFrames and Series with a memory budget. The least recently used entries are removed when the total memory of the entries is over the max size. The hits and misses are counted.
+
+    Parameters
+    ----------
+    max_size : int or None
+        The max memory of the entries in bytes. None has no limit and 0 will not keep anything.
+    """
+
+    def __init__(self, max_size=None):
+        """
+
+        """
+        setattr(self, 'max_size', max_size)
+        setattr(self, 'entries', OrderedDict())
+        setattr(self, 'size', 0)
+        setattr(self, 'hits', 0)
+        setattr(self, 'misses', 0)
+
+
+    def get(self, key):
+        """
+        Function to get an entry from the cache. Returns None if the key is not in the cache.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+        else:
+            self.misses += 1
+            return None
+
+
+    def put(self, key, value):
+        """
+        Function to add an entry to the cache and remove the least recently used entries if the cache is over the max size. Entries larger than the max size are not kept.
+        """
+        self.pop(key)
+        size1 = int(value.memory_usage(index=True, deep=True).sum()) if isinstance(value, pd.DataFrame) else int(value.memory_usage(index=True, deep=True))
+        if (self.max_size is not None) and (size1 > self.max_size):
+            return
+
+        self.entries[key] = (value, size1)
+        self.size += size1
+
+        if self.max_size is not None:
+            while self.size > self.max_size:
+                self.pop(next(iter(self.entries)))
+
+
+    def pop(self, key):
+        """
+        Function to remove an entry from the cache.
+        """
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+
+    def clear(self):
+        """
+        Function to remove all entries from the cache. The hits and misses are kept.
+        """
+        self.entries.clear()
+        setattr(self, 'size', 0)
+
+
+    def info(self):
+        """
+        Function to summarise the cache.
+
+        Returns
+        -------
+        dict
+            of the hits, misses, number of entries, size, and max_size
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'size': self.size, 'max_size': self.max_size}
+
+
+#####################################
+### Functions
+
+
+def _query_meta(server, database, table, col_names, where_in, from_date, to_date, date_col, stmt=None):
+    """
+    Function to normalise the query parameters so that equivalent queries get the same key.
+    """
+    if isinstance(col_names, str):
+        col_names = [col_names]
+    if col_names is not None:
+        col_names = sorted(col_names)
+    if where_in is not None:
+        where_in = {k: sorted(set(v), key=str) for k, v in where_in.items()}
+    if from_date is not None:
+        from_date = str(pd.Timestamp(from_date))
+    if to_date is not None:
+        to_date = str(pd.Timestamp(to_date))
+
+    meta = {'server': server, 'database': database, 'table': table, 'col_names': col_names, 'where_in': where_in, 'from_date': from_date, 'to_date': to_date, 'date_col': date_col}
+    ## Only added for custom statements so that the keys of the other queries don't change
+    if stmt is not None:
+        meta['stmt'] = stmt
+
+    return meta
+
+
+def _query_key(meta):
+    """
+    Function to create the hash key from the query metadata.
+    """
+    str1 = json.dumps(meta, sort_keys=True, default=str)
+    key = hashlib.sha1(str1.encode()).hexdigest()
+
+    return key
+
+
+@contextmanager
+def _index_lock(cache_dir):
+    """
+    Context manager to lock the index of a cache_dir while it is read, modified, and written. The threads of a process take turns via the module lock and the processes (e.g. the workers of get_ts_partitioned) via an OS lock on the lock_file. It must not be nested.
+    """
+    with _lock:
+        with open(os.path.join(cache_dir, lock_file), 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                ## msvcrt gives up after 10 seconds, so keep trying
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _rd_index(cache_dir):
+    """
+
+    """
+    path1 = os.path.join(cache_dir, index_file)
+    if os.path.isfile(path1):
+        with open(path1) as f:
+            index1 = json.load(f)
+    else:
+        index1 = {}
+
+    return index1
+
+
+def _wr_index(cache_dir, index1):
+    """
+    Write the index to a temp file then move it over the old one so that a parallel run never reads a half written index.
+    """
+    path1 = os.path.join(cache_dir, index_file)
+    temp_path = path1 + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+    with open(temp_path, 'w') as f:
+        json.dump(index1, f)
+    os.replace(temp_path, path1)
+
+
+def _rm_entry(cache_dir, index1, key):
+    """
+
+    """
+    path1 = os.path.join(cache_dir, key + '.parquet')
+    if os.path.isfile(path1):
+        os.remove(path1)
+    index1.pop(key, None)
+
+
+def _covers(cached, meta):
+    """
+    Function to determine if a cached query returns a superset of the rows and columns of a new query. The where_in keys and date column of the new query must be in the cached columns so that it can be filtered locally.
+    """
+    for k in ['server', 'database', 'table']:
+        if cached[k] != meta[k]:
+            return False
+    if ('stmt' in cached) or ('stmt' in meta):
+        return False
+
+    if cached['col_names'] is not None:
+        if meta['col_names'] is None:
+            return False
+        if not set(meta['col_names']).issubset(cached['col_names']):
+            return False
+        cols = set(cached['col_names'])
+    else:
+        cols = None
+
+    c_where = cached['where_in'] if cached['where_in'] is not None else {}
+    m_where = meta['where_in'] if meta['where_in'] is not None else {}
+    if not set(c_where).issubset(m_where):
+        return False
+    for k, v in m_where.items():
+        if k in c_where:
+            if not set(v).issubset(c_where[k]):
+                return False
+            if (set(v) != set(c_where[k])) and (cols is not None) and (k not in cols):
+                return False
+        elif (cols is not None) and (k not in cols):
+            return False
+
+    for d, op in [('from_date', min), ('to_date', max)]:
+        if cached[d] is not None:
+            if (meta[d] is None) or (cached['date_col'] != meta['date_col']):
+                return False
+            if op(pd.Timestamp(cached[d]), pd.Timestamp(meta[d])) != pd.Timestamp(cached[d]):
+                return False
+        if (meta[d] is not None) and (cols is not None) and (meta['date_col'] not in cols):
+            return False
+
+    return True
+
+
+def _filter_cached(df, meta):
+    """
+    Function to filter a superset from the cache down to the new query.
+    """
+    if meta['where_in'] is not None:
+        for k, v in meta['where_in'].items():
+            if k in df:
+                df = df[df[k].isin(v)]
+    if meta['date_col'] is not None:
+        dates = pd.to_datetime(df[meta['date_col']])
+        mask = pd.Series(True, index=df.index)
+        if meta['from_date'] is not None:
+            mask = mask & (dates >= pd.Timestamp(meta['from_date']))
+        if meta['to_date'] is not None:
+            mask = mask & (dates <= pd.Timestamp(meta['to_date']))
+        df = df[mask]
+    if meta['col_names'] is not None:
+        df = df[[c for c in df.columns if c in meta['col_names']]]
+
+    return df.reset_index(drop=True)
+
+
+def evict(cache_dir, ttl=None, max_size=None):
+    """
+    Function to remove expired entries from the cache and then the least recently used entries until the cache is under the max size.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The path to the cache directory.
+    ttl : int or None
+        The time to live of the cache entries in seconds. None will never expire the entries.
+    max_size : int or None
+        The max size of the cache in bytes. None has no limit.
+
+    Returns
+    -------
+    None
+    """
+    with _index_lock(cache_dir):
+        index1 = _rd_index(cache_dir)
+        now1 = time.time()
+
+        if ttl is not None:
+            for key in [k for k, v in index1.items() if (now1 - v['created']) > ttl]:
+                _rm_entry(cache_dir, index1, key)
+
+        if max_size is not None:
+            keys = sorted(index1, key=lambda k: index1[k]['accessed'])
+            size1 = sum(v['size'] for v in index1.values())
+            for key in keys:
+                if size1 <= max_size:
+                    break
+                size1 = size1 - index1[key]['size']
+                _rm_entry(cache_dir, index1, key)
+
+        _wr_index(cache_dir, index1)
+
+
+def clear(cache_dir):
+    """
+    Function to remove all entries from the cache.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The path to the cache directory.
+
+    Returns
+    -------
+    None
+    """
+    with _index_lock(cache_dir):
+        index1 = _rd_index(cache_dir)
+        for key in list(index1):
+            _rm_entry(cache_dir, index1, key)
+        _wr_index(cache_dir, index1)
+
+
+def rd_sql(server, database, table, col_names=None, where_in=None, from_date=None, to_date=None, date_col=None, stmt=None, cache_dir=None, ttl=None, max_size=None, refresh=False):
+    """
+    Function to read data via pdsql's mssql.rd_sql with a persistent on-disk cache. The results are stored as parquet files in the cache_dir and are keyed by the server, database, table, columns, where_in, and date bounds. A cached query that returns a superset of a new query will be filtered locally rather than requerying the database.
+
+    Parameters
+    ----------
+    server : str
+        The server name.
+    database : str
+        The specific database within the server.
+    table : str
+        The specific table within the database.
+    col_names : list of str
+        The column names that should be retrieved.
+    where_in : dict
+        A dictionary of strings to lists of strings.
+    from_date : str
+        The start date in the form '2010-01-01'.
+    to_date : str
+        The end date in the form '2010-01-01'.
+    date_col : str
+        The SQL table column that contains the dates.
+    stmt : str or None
+        A custom SQL statement to be run instead of the table query (e.g. an aggregation). The other query parameters are ignored and the result is only reused for the same statement.
+    cache_dir : str or None
+        The path to the cache directory. None will not use the cache.
+    ttl : int or None
+        The time to live of the cache entries in seconds. None will never expire the entries.
+    max_size : int or None
+        The max size of the cache in bytes. None has no limit.
+    refresh : bool
+        Should the database be requeried and the cache entry be replaced?
+
+    Returns
+    -------
+    DataFrame
+    """
+    ## pdsql (and the database driver) is slow to import, so it's only imported when querying
+    from pdsql import mssql
+
+    if cache_dir is None:
+        return mssql.rd_sql(server, database, table, col_names, where_in=where_in, from_date=from_date, to_date=to_date, date_col=date_col, stmt=stmt)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    evict(cache_dir, ttl, max_size)
+
+    meta = _query_meta(server, database, table, col_names, where_in, from_date, to_date, date_col, stmt)
+    key = _query_key(meta)
+
+    ### Check the cache
+    if not refresh:
+        with _index_lock(cache_dir):
+            index1 = _rd_index(cache_dir)
+            if key in index1:
+                df = pd.read_parquet(os.path.join(cache_dir, key + '.parquet'))
+                index1[key]['accessed'] = time.time()
+                _wr_index(cache_dir, index1)
+                return df
+
+            for k, v in index1.items():
+                if _covers(v['meta'], meta):
+                    df = _filter_cached(pd.read_parquet(os.path.join(cache_dir, k + '.parquet')), meta)
+                    index1[k]['accessed'] = time.time()
+                    _wr_index(cache_dir, index1)
+                    return df
+
+    ### Query the db and save
+    df = mssql.rd_sql(server, database, table, col_names, where_in=where_in, from_date=from_date, to_date=to_date, date_col=date_col, stmt=stmt)
+
+    path1 = os.path.join(cache_dir, key + '.parquet')
+    with _index_lock(cache_dir):
+        df.to_parquet(path1, index=False)
+        now1 = time.time()
+        index1 = _rd_index(cache_dir)
+        index1[key] = {'meta': meta, 'created': now1, 'accessed': now1, 'size': os.path.getsize(path1)}
+        _wr_index(cache_dir, index1)
+
+    if max_size is not None:
+        evict(cache_dir, max_size=max_size)
+
+    return df
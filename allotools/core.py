@@ -4,13 +4,16 @@ Created on Sat Feb 16 09:50:42 2019
 
 @author: michaelek
 """
+import os
+import copy
 import numpy as np
 import pandas as pd
-from pdsql import mssql
 from allotools import filters
+from allotools.backends import MssqlBackend, sql_spike_methods
+from allotools.cache import LRUCache
 #import filters
-from allotools.allocation_ts import allo_ts_apply
-#from allocation_ts import allo_ts_apply
+from allotools.allocation_ts import allo_ts_vec, allo_ts_daily, allo_intervals, interval_ts, period_codes, period_ends, restr_matrix
+#from allocation_ts import allo_ts_vec, allo_ts_daily
 from allotools.plot import plot_group as pg
 from allotools.plot import plot_stacked as ps
 #from plot import plot_group as pg
@@ -18,7 +21,52 @@ from allotools.plot import plot_stacked as ps
 from allotools import parameters as param
 #import parameters as param
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from allotools import util
+from allotools import usage
+from allotools import export
+
+########################################
+### Functions
+
+
+def _partition_labels(allo, partition):
+    """
+    Function to assign the allo rows to partitions by the values of the partition column. Partitions that share a consent or a Wap are merged so that the groupings within the get_ts pipeline (e.g. the usage/allocation ratio per consent and the allocation per Wap) are never split.
+
+    Returns
+    -------
+    ndarray of int
+        The partition of each allo row.
+    """
+    codes, uniques = pd.factorize(allo[partition].astype(str))
+    parent = np.arange(len(uniques))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for key in ['RecordNumber', 'Wap']:
+        key_codes = pd.DataFrame({'key': np.asarray(allo.index.get_level_values(key)), 'code': codes}).drop_duplicates()
+        key_codes = key_codes[key_codes['key'].duplicated(keep=False)]
+        for k, grp in key_codes.groupby('key')['code']:
+            root1 = find(grp.iloc[0])
+            for c in grp.iloc[1:]:
+                parent[find(c)] = root1
+
+    labels = np.array([find(i) for i in range(len(uniques))])[codes]
+
+    return labels
+
+
+def _partition_ts(alloc, datasets, freq, groupby, irr_season, usage_allo_ratio, combine_meters):
+    """
+    Function to run the get_ts pipeline on a partition in a worker process.
+    """
+    return alloc._sum_ts(datasets, freq, groupby, irr_season, usage_allo_ratio, combine_meters)
+
 
 ########################################
 ### Core class
@@ -44,6 +92,34 @@ class AlloUsage(object):
         Should only the consumptive takes be included?
     include_hydroelectric : bool
         Should hydroelectric takes be included?
+    spike_method : str or None
+        The method used to remove spikes from the daily usage data. Either 'shift', 'mad', or None.
+    spike_params : dict or None
+        Any kwargs to be passed to usage.remove_spikes (e.g. min_diff, window, n_mad).
+    usage_store : str or None
+        The path to a directory to keep the cleaned daily usage data. Subsequent runs will only read the new days per Wap. None will read all of the usage data every time.
+    usage_chunk_size : int or None
+        The number of Waps per chunk when reading the daily usage data. Each chunk is cleaned and aggregated before the next is read, so the daily data is not kept. None will read all of the Waps at once.
+    daily_base : bool
+        Should the allocation and usage time series be built once at a daily resolution and every freq be aggregated from them?
+    result_cache_size : int or None
+        The max memory in bytes of the dataset time series kept by get_ts for reuse. None has no limit and 0 will not keep any.
+    profile : bool or str
+        Should the internal stages be profiled? True records the wall time, rows in and out, and memory change of each stage, 'time' leaves out the memory. See profile_report.
+    prefetch : bool
+        Should all of the source data be read at initialisation in parallel threads?
+    n_threads : int
+        The number of threads (and therefore database connections) used when prefetch is True.
+    backend : Backend or None
+        The data source (see the backends module). None will use the MssqlBackend with the class server and database attributes and the below cache parameters.
+    cache_dir : str or None
+        The path to a directory to cache the database queries as parquet files. None will not cache the queries.
+    cache_ttl : int or None
+        The time to live of the cached queries in seconds.
+    cache_max_size : int or None
+        The max size of the cache directory in bytes.
+    refresh_cache : bool
+        Should the database be requeried and the cached queries be replaced?
 
     Returns
     -------
@@ -62,7 +138,7 @@ class AlloUsage(object):
 
 
     ### Initial import and assignment function
-    def __init__(self, from_date='1900-07-01', to_date='2020-06-30', site_filter=None, crc_filter=None, include_hydroelectric=False):
+    def __init__(self, from_date='1900-07-01', to_date='2020-06-30', site_filter=None, crc_filter=None, include_hydroelectric=False, spike_method='shift', spike_params=None, usage_store=None, usage_chunk_size=None, daily_base=False, result_cache_size=param.result_cache_size, profile=False, prefetch=False, n_threads=4, backend=None, cache_dir=None, cache_ttl=param.cache_ttl, cache_max_size=param.cache_max_size, refresh_cache=False, backend_usage_agg=False):
         """
 
         Parameters
@@ -77,6 +153,36 @@ class AlloUsage(object):
             A dict in the form of {str: [values]} to select specific values from a specific column in the CrcAllo table.
         include_hydroelectric : bool
             Should hydroelectric takes be included?
+        spike_method : str or None
+            The method used to remove spikes from the daily usage data. Either 'shift', 'mad', or None. See usage.remove_spikes.
+        spike_params : dict or None
+            Any kwargs to be passed to usage.remove_spikes (e.g. min_diff, window, n_mad).
+        usage_store : str or None
+            The path to a directory to keep the cleaned daily usage data (see usage.update_usage_store). Subsequent runs will only read the dates per Wap that have not been read before. None will read all of the usage data every time.
+        usage_chunk_size : int or None
+            The number of Waps per chunk when reading the daily usage data (see usage.iter_usage). Each chunk is cleaned and aggregated to the freq before the next is read, which bounds the peak memory to one chunk. The daily data is not kept, so changing the freq will read the data again. None will read all of the Waps at once.
+        daily_base : bool
+            Should the allocation and usage time series be built once at a daily resolution and every freq be aggregated from them? Changing the freq in get_ts will then only aggregate the daily time series rather than reading and building them again. The restriction ratios, metered allocation, and usage splits are still determined per period of the freq (per month for the 'A-JUN' and 'A' freqs) like the default mode, so the 'M', 'A-JUN', and 'A' results only differ from the default mode by the rounding. The daily allocation is the annual volume split over the active months like the monthly freq and then evenly over the days (see allocation_ts.allo_ts_daily), so the 'D' and 'W' allocations are volumes rather than the rates of the default mode, and the high usage outliers are removed against those volumes.
+        result_cache_size : int or None
+            The max memory in bytes of the dataset time series kept by get_ts for reuse. Each dataset is kept per freq, irr_season, usage_allo_ratio, and combine_meters, so calling get_ts again with a previous set of parameters returns the kept results. The least recently used results are removed first. None has no limit and 0 will not keep any. See cache_info for the hits and misses.
+        profile : bool or str
+            Should the internal stages be profiled? True records the wall time, the number of rows in and out, and the change in the traced python memory of each stage (see util.stage). Tracing the memory with tracemalloc slows down the stages, so 'time' will record everything except the memory. The records are also logged as json to the 'allotools.profile' logger at the INFO level. See profile_report. False has close to no cost.
+        prefetch : bool
+            Should all of the source data be read at initialisation in parallel threads? The ts summary table is read at the same time as the site and then the allocation tables (which are filtered by the sites), then the low flow restriction and daily usage tables are read in chunks of param.prefetch_chunk_size RecordNumbers/Waps at the same time. The daily usage data is kept, so usage_chunk_size is ignored.
+        n_threads : int
+            The number of threads (and therefore database connections) used when prefetch is True.
+        backend : Backend or None
+            The data source (see the backends module). None will use the MssqlBackend with the class server and database attributes and the below cache parameters.
+        cache_dir : str or None
+            The path to a directory to cache the database queries as parquet files. None will not cache the queries.
+        cache_ttl : int or None
+            The time to live of the cached queries in seconds.
+        cache_max_size : int or None
+            The max size of the cache directory in bytes. The least recently used queries will be removed first.
+        refresh_cache : bool
+            Should the database be requeried and the cached queries be replaced?
+        backend_usage_agg : bool
+            Should the usage be cleaned and summed per Wap and period by the backend (see Backend.rd_ts_agg) rather than reading the daily usage? The SQL backends set the negative values to zero, remove the spikes, and sum the periods in the query, so a monthly run transfers around 30 times fewer rows. The trade-off is that the daily usage is never read: only the 'shift' spike method (or None) can be used as the other spike filters need the daily data, usage_store and daily_base can't be used, usage_chunk_size and the usage part of prefetch are ignored, and the usage is read again for every freq.
 
         Returns
         -------
@@ -84,18 +190,44 @@ class AlloUsage(object):
             with all of the base sites, allo, and allo_wap DataFrames
 
         """
-        allo1 = filters.rd_allo(from_date, to_date, crc_filter, include_hydroelectric).reset_index()
+        if backend_usage_agg:
+            if spike_method not in sql_spike_methods:
+                raise ValueError('spike_method must be one of ' + str(sql_spike_methods) + ' with backend_usage_agg as the other spike filters need the daily usage')
+            if (usage_store is not None) or daily_base:
+                raise ValueError('backend_usage_agg can not be used with the usage_store or daily_base as they need the daily usage')
+
+        setattr(self, 'profile', profile)
+        setattr(self, 'profile_records', [])
+        setattr(self, '_profile_depth', 0)
+
+        if backend is None:
+            backend = MssqlBackend(self.ts_server, self.ts_db, self.crc_server, self.crc_db, cache_dir, cache_ttl, cache_max_size, refresh_cache)
+        setattr(self, 'backend', backend)
+
+        ## The sites are read first so that the allocation can be filtered by them without reading them again
+        if prefetch:
+            executor = ThreadPoolExecutor(n_threads)
+            ts_summ_future = executor.submit(backend.rd_ts_summ, list(param.dataset_dict.keys()))
+        sites1 = filters.rd_sites(site_filter, backend)
+        allo1 = filters.rd_allo(from_date, to_date, crc_filter, include_hydroelectric, backend, site_filter, sites1).reset_index()
+        sites1 = sites1.reset_index()
         allo1.FromMonth = allo1.FromMonth + 6
         allo1.loc[allo1.FromMonth > 12, 'FromMonth'] = allo1.loc[allo1.FromMonth > 12, 'FromMonth'] - 12
         allo1.ToMonth = allo1.ToMonth + 6
         allo1.loc[allo1.ToMonth > 12, 'ToMonth'] = allo1.loc[allo1.ToMonth > 12, 'ToMonth'] - 12
-        sites1 = filters.rd_sites(site_filter).reset_index()
 
         allo_sites1 = pd.merge(allo1, sites1, on='ExtSiteID')
         allo_sites1.rename(columns={'ExtSiteID': 'Wap'}, inplace=True)
 
         waps = allo_sites1.Wap.unique()
 
+        ## Encode the keys as categoricals so that the merges and groupbys work on integer codes
+        key_dtypes = {}
+        for c in param.key_cols:
+            allo_sites1[c] = allo_sites1[c].astype('category')
+            key_dtypes[c] = allo_sites1[c].dtype
+
+        setattr(self, 'key_dtypes', key_dtypes)
         setattr(self, 'waps', waps)
         setattr(self, 'allo', allo_sites1.set_index(['RecordNumber', 'HydroFeature', 'AllocationBlock', 'Wap']))
 
@@ -106,13 +238,64 @@ class AlloUsage(object):
         setattr(self, 'from_date', from_date)
         setattr(self, 'to_date', to_date)
 
+        if spike_params is None:
+            spike_params = {}
+        setattr(self, 'spike_method', spike_method)
+        setattr(self, 'spike_params', spike_params)
+        setattr(self, 'usage_store', usage_store)
+        setattr(self, 'usage_chunk_size', usage_chunk_size)
+        setattr(self, 'daily_base', daily_base)
+        setattr(self, 'backend_usage_agg', backend_usage_agg)
+        setattr(self, 'result_cache', LRUCache(result_cache_size))
+
+        if prefetch:
+            try:
+                self._prefetch(executor, ts_summ_future.result())
+            finally:
+                executor.shutdown()
+
+
+    def _prefetch(self, executor, ts_summ1):
+        """
+        Function to read the low flow restriction and daily usage data in parallel chunks.
+        """
+        chunk_size = param.prefetch_chunk_size
+        self._usage_summ(ts_summ1)
+
+        ### Submit all of the reads
+        crcs = self.allo.index.levels[0].unique().tolist()
+        lf_futures = [executor.submit(self.backend.rd_lf_agg, crcs[i:(i + chunk_size)], self.from_date, self.to_date) for i in range(0, len(crcs), chunk_size)]
+
+        waps = self.ts_usage_summ.Wap.unique().tolist()
+        dataset_types = self.ts_usage_summ.DatasetTypeID.unique().tolist()
+
+        if self.backend_usage_agg:
+            ts_futures = []
+        elif self.usage_store is None:
+            def rd_usage(waps1):
+                tsdata1 = self.backend.rd_ts(waps1, dataset_types, self.from_date, self.to_date)
+                return usage.prep_usage(tsdata1, self.spike_method, self.spike_params)
+
+            ts_futures = [executor.submit(rd_usage, waps[i:(i + chunk_size)]) for i in range(0, len(waps), chunk_size)]
+        else:
+            ## The store file can only be updated by one thread at a time
+            ts_futures = [executor.submit(usage.update_usage_store, self.usage_store, self.backend, waps, dataset_types, self.from_date, self.to_date, self.spike_method, self.spike_params)]
+
+        ### Combine the results
+        if lf_futures:
+            self._lowflow_daily(pd.concat([f.result() for f in lf_futures]))
+        if ts_futures:
+            setattr(self, 'usage_ts_daily', self._encode(pd.concat([f.result() for f in ts_futures]).reset_index(drop=True)))
+
 
-    def _usage_summ(self):
+    @util.stage(rows_out='ts_usage_summ')
+    def _usage_summ(self, ts_summ1=None):
         """
 
         """
         ### Get the ts summary tables
-        ts_summ1 = mssql.rd_sql(self.ts_server, self.ts_db, param.ts_summ_table, ['ExtSiteID', 'DatasetTypeID', 'FromDate', 'ToDate'], {'DatasetTypeID': list(param.dataset_dict.keys())})
+        if ts_summ1 is None:
+            ts_summ1 = self.backend.rd_ts_summ(list(param.dataset_dict.keys()))
         ts_summ2 = ts_summ1[ts_summ1.ExtSiteID.isin(self.waps)].copy()
 #        ts_summ2['HydroFeature'] = ts_summ2['DatasetTypeID']
 #        ts_summ2.replace({'HydroFeature': param.dataset_dict}, inplace=True)
@@ -126,17 +309,17 @@ class AlloUsage(object):
         setattr(self, 'ts_usage_summ', ts_summ3)
 
 
+    @util.stage(['allo'], 'allo_ts')
     def _est_allo_ts(self):
         """
 
         """
-        restr_col = param.allo_type_dict[self.freq]
-
-        allo3 = self.allo.apply(allo_ts_apply, axis=1, from_date=self.from_date, to_date=self.to_date, freq=self.freq, restr_col=restr_col, remove_months=True)
+        if self.daily_base:
+            allo4 = allo_ts_daily(self.allo, from_date=self.from_date, to_date=self.to_date, restr_col='AllocatedAnnualVolume', remove_months=True)
+        else:
+            restr_col = param.allo_type_dict[self.freq]
 
-        allo4 = allo3.stack()
-        allo4.index.set_names(['RecordNumber', 'HydroFeature', 'AllocationBlock', 'Wap', 'Date'], inplace=True)
-        allo4.name = 'allo'
+            allo4 = allo_ts_vec(self.allo, from_date=self.from_date, to_date=self.to_date, freq=self.freq, restr_col=restr_col, remove_months=True)
 
         ## Rearrange
         allo5 = allo4.unstack(1).rename(columns={'Groundwater': 'GwAllo', 'Surface Water': 'SwAllo'})
@@ -169,7 +352,8 @@ class AlloUsage(object):
             self._est_allo_ts()
 
 
-    def _get_metered_allo_ts(self, restr_allo=False, combine_meters=False):
+    @util.stage(['allo_ts'])
+    def _get_metered_allo_ts(self, restr_allo=False, combine_meters=False, usage_allo_ratio=2):
         """
 
         """
@@ -186,20 +370,27 @@ class AlloUsage(object):
             rename_dict = {'SwAllo': 'SwMeteredAllo', 'GwAllo': 'GwMeteredAllo', 'TotalAllo': 'TotalMeteredAllo'}
 
         ### Combine the usage data to the allo data
-        if not hasattr(self, 'usage_crc_ts'):
-            self._get_usage_ts()
-        allo2 = pd.merge(self.usage_crc_ts.reset_index()[param.pk], allo1, on=param.pk, how='right', indicator=True)
+        ## The allocation is metered over the whole period_freq period when there is usage within it
+        usage_crc_ts = self._get_dataset('Usage', usage_allo_ratio)
+        usage_keys = usage_crc_ts.reset_index()[param.pk].rename(columns={'Date': 'Period'})
+        allo1['Period'] = allo1['Date']
+        if self.period_freq != self.freq:
+            usage_keys['Period'] = self._period_dates(usage_keys['Period'])
+            usage_keys = usage_keys.drop_duplicates()
+            allo1['Period'] = self._period_dates(allo1['Period'])
+        on = ['RecordNumber', 'AllocationBlock', 'Wap', 'Period']
+        allo2 = pd.merge(usage_keys, allo1, on=on, how='right', indicator=True)
 
         ## Re-categorise
         allo2['_merge'] = allo2._merge.cat.rename_categories({'left_only': 2, 'right_only': 0, 'both': 1}).astype(int)
 
         if combine_meters:
-            allo2['usage_waps'] = allo2.groupby(['RecordNumber', 'AllocationBlock', 'Date'])['_merge'].transform('sum')
+            allo2['usage_waps'] = allo2.groupby(['RecordNumber', 'AllocationBlock', 'Period'], observed=True)['_merge'].transform('sum')
             allo2.loc[allo2.usage_waps == 0, list(rename_dict.keys())] = 0
-            allo3 = allo2.drop(['_merge', 'usage_waps'], axis=1).copy()
+            allo3 = allo2.drop(['_merge', 'usage_waps', 'Period'], axis=1).copy()
         else:
             allo2.loc[allo2._merge != 1, list(rename_dict.keys())] = 0
-            allo3 = allo2.drop('_merge', axis=1).copy()
+            allo3 = allo2.drop(['_merge', 'Period'], axis=1).copy()
 
         allo3.rename(columns=rename_dict, inplace=True)
         allo3.set_index(param.pk, inplace=True)
@@ -209,7 +400,10 @@ class AlloUsage(object):
         else:
             setattr(self, 'metered_restr_allo_ts', allo3)
 
+        return allo3
 
+
+    @util.stage(['usage_ts_daily'], 'usage_ts')
     def _process_usage(self):
         """
 
@@ -219,38 +413,54 @@ class AlloUsage(object):
             self._usage_summ()
         ts_usage_summ = self.ts_usage_summ.copy()
 
+        waps = ts_usage_summ.Wap.unique().tolist()
+        dataset_types = ts_usage_summ.DatasetTypeID.unique().tolist()
+
+        ## Get the cleaned period sums from the backend
+        if self.backend_usage_agg:
+            tsdata1 = self._encode(self.backend.rd_ts_agg(waps, dataset_types, self.from_date, self.to_date, self.freq, self.spike_method, self.spike_params))
+            tsdata2 = tsdata1[tsdata1.Wap.notnull()].set_index(['Wap', 'Date']).sort_index()
+
+            setattr(self, 'usage_ts', tsdata2)
+            return
+
+        ## Stream the ts data in chunks of Waps and aggregate each chunk
+        if (self.usage_chunk_size is not None) and (not hasattr(self, 'usage_ts_daily')):
+            agg_list = []
+            for tsdata1 in usage.iter_usage(self.backend, waps, dataset_types, self.from_date, self.to_date, self.usage_chunk_size, self.spike_method, self.spike_params, self.usage_store):
+                agg_list.append(util.period_agg(self._encode(tsdata1), 'Wap', 'Date', self.freq))
+            ## No chunks have data (e.g. a filter without any metered Waps)
+            if not agg_list:
+                agg_list.append(util.period_agg(self._encode(usage.empty_usage()), 'Wap', 'Date', self.freq))
+
+            setattr(self, 'usage_ts', pd.concat(agg_list))
+            return
+
         ## Get the ts data and aggregate
         if hasattr(self, 'usage_ts_daily'):
             tsdata1 = self.usage_ts_daily
         else:
-            tsdata1 = mssql.rd_sql(self.ts_server, self.ts_db, param.ts_table, ['ExtSiteID', 'DateTime', 'Value'], where_in={'ExtSiteID': ts_usage_summ.Wap.unique().tolist(), 'DatasetTypeID': ts_usage_summ.DatasetTypeID.unique().tolist()}, from_date=self.from_date, to_date=self.to_date, date_col='DateTime')
-
-            tsdata1['DateTime'] = pd.to_datetime(tsdata1['DateTime'])
-            tsdata1.rename(columns={'DateTime': 'Date', 'ExtSiteID': 'Wap', 'Value': 'TotalUsage'}, inplace=True)
-
-            ### filter - remove individual spikes and negative values
-            tsdata1.loc[tsdata1['TotalUsage'] < 0, 'TotalUsage'] = 0
+            if self.usage_store is None:
+                tsdata1 = self.backend.rd_ts(waps, dataset_types, self.from_date, self.to_date)
 
-            def remove_spikes(x):
-                val1 = bool(x[1] > (x[0] + x[2] + 2))
-                if val1:
-                    return (x[0] + x[2])/2
-                else:
-                    return x[1]
-
-            tsdata1.iloc[1:-1, 2] = tsdata1['TotalUsage'].rolling(3, center=True).apply(remove_spikes, raw=True).iloc[1:-1]
+                ### filter - remove individual spikes and negative values
+                tsdata1 = usage.prep_usage(tsdata1, self.spike_method, self.spike_params)
+            else:
+                tsdata1 = usage.update_usage_store(self.usage_store, self.backend, waps, dataset_types, self.from_date, self.to_date, self.spike_method, self.spike_params)
 
+            tsdata1 = self._encode(tsdata1)
             setattr(self, 'usage_ts_daily', tsdata1)
 
         ### Aggregate
-        tsdata2 = util.grp_ts_agg(tsdata1, 'Wap', 'Date', self.freq).sum()
+        tsdata2 = util.period_agg(tsdata1, 'Wap', 'Date', self.freq)
 
         setattr(self, 'usage_ts', tsdata2)
 
 
-    def _get_usage_ts(self, usage_allo_ratio=2):
+    @util.stage(['usage_ts', 'allo_ts'], 'usage_crc_base')
+    def _usage_crc_base(self):
         """
-
+        Function to split the usage per Wap to the consents and calculate the water year usage/allocation ratios before any outliers are removed. The result doesn't depend on the usage_allo_ratio, so it is kept for every ratio.
         """
         ### Get the usage data if it exists
         if not hasattr(self, 'usage_ts'):
@@ -261,56 +471,90 @@ class AlloUsage(object):
             allo1 = self._get_allo_ts()
         allo1 = self.allo_ts.copy().reset_index()
 
-        allo1['combo_allo'] = allo1.groupby(['Wap', 'Date'])['TotalAllo'].transform('sum')
-        allo1['combo_ratio'] = (allo1['TotalAllo']/allo1['combo_allo']).fillna(1)
+        ## The usage is split by the allocations of the whole period_freq periods, so the daily base splits the usage of every day of the periods like the other freqs
+        allo1['Period'] = allo1['Date']
+        if self.period_freq != self.freq:
+            allo1['Period'] = self._period_dates(allo1['Date'])
+            period_allo = allo1.groupby(['RecordNumber', 'AllocationBlock', 'Wap', 'Period'], observed=True)[['SwAllo', 'TotalAllo']].transform('sum')
+        else:
+            period_allo = allo1[['SwAllo', 'TotalAllo']]
+        allo1['combo_allo'] = allo1.groupby(['Wap', 'Period'], observed=True)['TotalAllo'].transform('sum')
+        allo1['combo_ratio'] = (period_allo['TotalAllo']/allo1['combo_allo']).fillna(1)
+        allo1['SwRatio'] = (period_allo['SwAllo']/period_allo['TotalAllo']).fillna(1)
 
         ### combine with consents info
-        usage1 = pd.merge(allo1, tsdata2, on=['Wap', 'Date'], how='left')
+        tsdata2 = tsdata2.reset_index()
+        tsdata2['Period'] = tsdata2['Date'] if self.period_freq == self.freq else self._period_dates(tsdata2['Date'])
+        crc_periods = allo1.drop_duplicates(['RecordNumber', 'AllocationBlock', 'Wap', 'Period'])[['RecordNumber', 'AllocationBlock', 'Wap', 'Period', 'combo_ratio', 'SwRatio']]
+        usage1 = pd.merge(crc_periods, tsdata2, on=['Wap', 'Period'])
         usage1['TotalUsage'] = (usage1['TotalUsage'] * usage1['combo_ratio'])
 
-        ### Remove high outliers
-        t1 = util.grp_ts_agg(usage1, ['RecordNumber', 'AllocationBlock'], 'Date', 'A-Jun')[['TotalAllo', 'TotalUsage']].transform('sum')
-        t2 = t1['TotalUsage'] > (t1['TotalAllo'] * usage_allo_ratio)
-        usage1.loc[t2.values, 'TotalUsage'] = np.nan
+        ### Water year ratios for the high outliers
+        ## The allocation totals include the periods without usage
+        ratio_data = pd.concat([allo1[['RecordNumber', 'AllocationBlock', 'Date', 'TotalAllo']], usage1[['RecordNumber', 'AllocationBlock', 'Date', 'TotalUsage']]], ignore_index=True)
+        usage1['usage_ratio'] = usage.usage_allo_ratio(ratio_data)[len(allo1):]
 
-        ### Split the GW and SW components
-        usage1['SwRatio'] = (usage1['SwAllo']/usage1['TotalAllo']).fillna(1)
+        usage2 = usage1[param.pk + ['TotalUsage', 'SwRatio', 'usage_ratio']]
+
+        setattr(self, 'usage_crc_base', usage2)
+
+
+    @util.stage(['usage_crc_base'], 'usage_crc_ts')
+    def _get_usage_ts(self, usage_allo_ratio=2):
+        """
 
-        usage1['SwUsage'] = usage1['SwRatio'] * usage1['TotalUsage']
-        usage1['GwUsage'] = usage1['TotalUsage'] - usage1['SwUsage']
-        usage1.loc[usage1['GwUsage'] < 0, 'GwUsage'] = 0
+        """
+        if not hasattr(self, 'usage_crc_base'):
+            self._usage_crc_base()
+        usage1 = self.usage_crc_base
 
-        usage1.drop(['SwAllo', 'GwAllo', 'TotalAllo', 'combo_allo', 'combo_ratio', 'SwRatio'], axis=1, inplace=True)
+        ### Remove high outliers
+        keep = ~(usage1['usage_ratio'].values > usage_allo_ratio)
+        usage2 = usage1.loc[keep, param.pk + ['TotalUsage']].copy()
 
-        usage2 = usage1.dropna().set_index(param.pk)
+        ### Split the GW and SW components
+        usage2['SwUsage'] = usage1['SwRatio'].values[keep] * usage2['TotalUsage'].values
+        usage2['GwUsage'] = usage2['TotalUsage'] - usage2['SwUsage']
+        usage2.loc[usage2['GwUsage'] < 0, 'GwUsage'] = 0
+
+        usage2 = usage2.set_index(param.pk)
 
         setattr(self, 'usage_crc_ts', usage2)
 
 
-    def _lowflow_data(self):
+    @util.stage(rows_out='lf_restr_daily')
+    def _lowflow_daily(self, lf_crc1=None):
         """
 
         """
-        if hasattr(self, 'lf_restr_daily'):
-            lf_crc2 = self.lf_restr_daily
-        else:
-            ## Pull out the lowflows data
-            lf_crc1 = mssql.rd_sql(self.crc_server, self.crc_db, param.lf_table, ['RecordNumber', 'AllocationBlock', 'RestrDate', 'Allocation'], where_in={'RecordNumber': self.allo.index.levels[0].unique().tolist()}, from_date=self.from_date, to_date=self.to_date, date_col='RestrDate')
-            lf_crc1.rename(columns={'RestrDate': 'Date'}, inplace=True)
-            lf_crc1.Date = pd.to_datetime(lf_crc1.Date)
+        ## Pull out the lowflows data as the daily min of each crc (aggregated by the backend)
+        if lf_crc1 is None:
+            lf_crc1 = self.backend.rd_lf_agg(self.allo.index.levels[0].unique().tolist(), self.from_date, self.to_date)
+        lf_crc1 = self._encode(lf_crc1)
+        lf_crc1 = lf_crc1[lf_crc1.RecordNumber.notnull()].sort_values(['RecordNumber', 'Date'])
+
+        lf_crc2 = lf_crc1.set_index(['RecordNumber', 'Date'])['Allocation'] * 0.01
+        lf_crc2.name = 'restr_ratio'
+
+        setattr(self, 'lf_restr_daily', lf_crc2)
+
 
-            ## Aggregate to the crc and date - min restr ratio
-            lf_crc2 = util.grp_ts_agg(lf_crc1, 'RecordNumber', 'Date', 'D')['Allocation'].min() * 0.01
-            lf_crc2.name = 'restr_ratio'
+    @util.stage(['lf_restr_daily'], 'lf_restr')
+    def _lowflow_data(self):
+        """
 
-            setattr(self, 'lf_restr_daily', lf_crc2)
+        """
+        if not hasattr(self, 'lf_restr_daily'):
+            self._lowflow_daily()
+        lf_crc2 = self.lf_restr_daily
 
-        ### Aggregate to the appropriate freq
-        lf_crc3 = util.grp_ts_agg(lf_crc2.reset_index(), 'RecordNumber', 'Date', self.freq)['restr_ratio'].mean()
+        ### Aggregate to the appropriate freq as a dense crc by period matrix
+        lf_crc3 = restr_matrix(lf_crc2, self.from_date, self.to_date, self.period_freq)
 
         setattr(self, 'lf_restr', lf_crc3)
 
 
+    @util.stage(['allo_ts', 'lf_restr'], 'restr_allo_ts')
     def _get_restr_allo_ts(self):
         """
 
@@ -321,24 +565,25 @@ class AlloUsage(object):
         if not hasattr(self, 'lf_restr'):
             self._lowflow_data()
 
-        allo1 = self.allo_ts.copy().reset_index()
-        lf_restr = self.lf_restr.copy().reset_index()
+        allo1 = self.allo_ts
+        lf_restr = self.lf_restr
 
-        ### Combine base data
-        allo2 = pd.merge(allo1, lf_restr, on=['RecordNumber', 'Date'], how='left')
-        allo2.loc[allo2.restr_ratio.isnull(), 'restr_ratio'] = 1
+        ### Look up the restr ratio of each allo row in the matrix (1 if the crc has no restrictions)
+        crc_rows = lf_restr.index.get_indexer(allo1.index.levels[0])[allo1.index.codes[0]]
+        period_cols = period_codes(allo1.index.get_level_values('Date').values.astype('datetime64[D]'), self.period_freq) - period_codes(np.array([pd.Timestamp(self.from_date).date()], dtype='datetime64[D]'), self.period_freq)[0]
 
-        ### Update allo
-        allo2.rename(columns={'SwAllo': 'SwRestrAllo', 'GwAllo': 'GwRestrAllo', 'TotalAllo': 'TotalRestrAllo'}, inplace=True)
-        allo2['SwRestrAllo'] = allo2['SwRestrAllo'] * allo2['restr_ratio']
-        allo2['GwRestrAllo'] = allo2['GwRestrAllo'] * allo2['restr_ratio']
-        allo2['TotalRestrAllo'] = allo2['TotalRestrAllo'] * allo2['restr_ratio']
+        restr_ratio = np.ones(len(allo1))
+        restricted = (crc_rows >= 0) & (period_cols >= 0) & (period_cols < lf_restr.shape[1])
+        restr_ratio[restricted] = lf_restr.values[crc_rows[restricted], period_cols[restricted]]
 
-        allo2.set_index(param.pk, inplace=True)
+        ### Update allo
+        allo2 = allo1.rename(columns={'SwAllo': 'SwRestrAllo', 'GwAllo': 'GwRestrAllo', 'TotalAllo': 'TotalRestrAllo'}).mul(restr_ratio, axis=0)
+        allo2['restr_ratio'] = restr_ratio
 
         setattr(self, 'restr_allo_ts', allo2)
 
 
+    @util.stage()
     def get_ts(self, datasets, freq, groupby, irr_season=False, usage_allo_ratio=2, combine_meters=False):
         """
         Function to create a time series of allocation and usage.
@@ -363,6 +608,46 @@ class AlloUsage(object):
         DataFrame
             Indexed by the groupby (and date)
         """
+        all3 = self._sum_ts(datasets, freq, groupby, irr_season, usage_allo_ratio, combine_meters).round()
+
+        return all3
+
+
+    def get_ts_ratios(self, datasets, freq, groupby, usage_allo_ratios, irr_season=False, combine_meters=False):
+        """
+        Function to create the time series of get_ts for several usage_allo_ratios (e.g. for a sensitivity analysis of the high usage outliers). The usage per consent and the water year usage/allocation ratios are only calculated once and each ratio only removes its outliers. The datasets that don't depend on the usage_allo_ratio are only calculated once.
+
+        Parameters
+        ----------
+        datasets : list of str
+            The dataset types to be returned. Must be one or more of {ds}.
+        freq : str
+            Pandas time frequency code for the time interval. Must be one of 'D', 'W', 'M', 'A', or 'A-JUN'.
+        groupby : list of str
+            The fields that should grouped by when returned. See get_ts.
+        usage_allo_ratios : list of int or float
+            The cut off ratios of usage/allocation.
+        irr_season : bool
+            Should the calculations and the resulting time series be only over the irrigation season? The irrigation season is from October through to the end of April.
+        combine_meters : bool
+            When estimating the metered allocation, if one meter on a consent has usage data should all meters on the consent be considered metered? True, will be generous, False will not.
+
+        Results
+        -------
+        DataFrame
+            Indexed by the usage_allo_ratio, the groupby, and date
+        """
+        ts_list = [self.get_ts(datasets, freq, groupby[:], irr_season, r, combine_meters) for r in usage_allo_ratios]
+
+        ts1 = pd.concat(ts_list, keys=usage_allo_ratios, names=['usage_allo_ratio'])
+
+        return ts1
+
+
+    def _sum_ts(self, datasets, freq, groupby, irr_season=False, usage_allo_ratio=2, combine_meters=False, decode=True):
+        """
+        Function to create the time series of get_ts before rounding. decode=False will keep the categorical keys.
+        """
         ### Add in date to groupby if it's not there
         if not 'Date' in groupby:
             groupby.append('Date')
@@ -372,54 +657,336 @@ class AlloUsage(object):
             raise ValueError('datasets must be a list that includes one or more of ' + str(self.dataset_types))
 
         ### Check new to old parameters and remove attributes if necessary
+        ## The period_freq is the freq of the restrictions, metered allocation, and usage splits. The daily base only differs in the freq of the time series.
+        freq_agg = freq
         if 'A' in freq:
-            freq_agg = freq
             freq = 'M'
-        else:
-            freq_agg = freq
+        period_freq = freq
+        if self.daily_base:
+            freq = 'D'
 
         if hasattr(self, 'freq'):
             if (self.freq != freq) or (self.irr_season != irr_season):
                 for d in param.temp_datasets:
                     if hasattr(self, d):
                         delattr(self, d)
+            elif self.period_freq != period_freq:
+                for d in param.period_datasets:
+                    if hasattr(self, d):
+                        delattr(self, d)
 
         ### Assign pararameters
         setattr(self, 'freq', freq)
+        setattr(self, 'period_freq', period_freq)
         setattr(self, 'irr_season', irr_season)
 
         ### Get the results and combine
         all1 = []
 
-        if 'Allo' in datasets:
-            self._get_allo_ts()
-            all1.append(self.allo_ts)
-        if 'MeteredAllo' in datasets:
-            self._get_metered_allo_ts(combine_meters=combine_meters)
-            all1.append(self.metered_allo_ts)
-        if 'RestrAllo' in datasets:
-            self._get_restr_allo_ts()
-            all1.append(self.restr_allo_ts)
-        if 'MeteredRestrAllo' in datasets:
-            self._get_metered_allo_ts(True, combine_meters=combine_meters)
-            all1.append(self.metered_restr_allo_ts)
-        if 'Usage' in datasets:
-            self._get_usage_ts(usage_allo_ratio)
-            all1.append(self.usage_crc_ts)
-
-        if 'A' in freq_agg:
-            all2 = util.grp_ts_agg(pd.concat(all1, axis=1).reset_index(), ['RecordNumber', 'AllocationBlock', 'Wap'], 'Date', freq_agg).sum().reset_index()
-        else:
-            all2 = pd.concat(all1, axis=1).reset_index()
+        for d in ['Allo', 'MeteredAllo', 'RestrAllo', 'MeteredRestrAllo', 'Usage']:
+            if d in datasets:
+                all1.append(self._get_dataset(d, usage_allo_ratio, combine_meters))
+
+        ## Outer merges on the encoded keys rather than a concat, which would union the MultiIndexes as tuples
+        all2 = all1[0].reset_index()
+        for ts1 in all1[1:]:
+            all2 = pd.merge(all2, ts1.reset_index(), on=param.pk, how='outer')
+
+        ## The daily restr_ratios are averaged over the periods
+        if period_freq != freq:
+            agg = {c: 'mean' if c == 'restr_ratio' else 'sum' for c in all2.columns if c not in param.pk}
+            all2 = util.period_agg(all2, ['RecordNumber', 'AllocationBlock', 'Wap'], 'Date', period_freq, agg).reset_index()
+
+        if freq_agg != period_freq:
+            all2 = util.period_agg(all2, ['RecordNumber', 'AllocationBlock', 'Wap'], 'Date', freq_agg).reset_index()
 
         if not np.in1d(groupby, param.pk).all():
             all2 = self._merge_extra(all2, groupby)
 
-        all3 = all2.groupby(groupby).sum().round()
+        ## Observed categorical groupbys are not always sorted
+        all3 = all2.groupby(groupby, observed=True).sum().sort_index()
+
+        ## Decode the keys
+        if decode:
+            all3.index = all3.index.set_levels([l.astype(object) if isinstance(l, pd.CategoricalIndex) else l for l in all3.index.levels])
 
         return all3
 
 
+    def _period_dates(self, dates):
+        """
+        Function to convert the daily dates of the daily base to the end dates of their period_freq periods.
+        """
+        days = dates.values.astype('datetime64[D]')
+        ends = period_ends(period_codes(days, self.period_freq), self.period_freq).astype('datetime64[ns]')
+
+        return pd.Series(ends, index=dates.index, name=dates.name)
+
+
+    def _encode(self, data):
+        """
+        Function to encode the key columns of a DataFrame with the categories of the allo keys. Keys that are not in the allo become NaN.
+        """
+        data1 = data.copy()
+        for c, dtype in self.key_dtypes.items():
+            if c in data1:
+                data1[c] = data1[c].astype(dtype)
+
+        return data1
+
+
+    def _get_dataset(self, dataset, usage_allo_ratio=2, combine_meters=False):
+        """
+        Function to get a dataset time series at the current freq and irr_season from the result cache or to create it and add it to the cache. The key only includes the parameters that the dataset depends on.
+        """
+        if dataset not in ['Usage', 'MeteredAllo', 'MeteredRestrAllo']:
+            usage_allo_ratio = None
+        if 'Metered' not in dataset:
+            combine_meters = None
+        key = (dataset, self.freq, self.period_freq, self.irr_season, usage_allo_ratio, combine_meters)
+
+        ts1 = self.result_cache.get(key)
+        if ts1 is None:
+            if dataset == 'Allo':
+                self._get_allo_ts()
+                ts1 = self.allo_ts
+            elif dataset == 'MeteredAllo':
+                self._get_metered_allo_ts(combine_meters=combine_meters, usage_allo_ratio=usage_allo_ratio)
+                ts1 = self.metered_allo_ts
+            elif dataset == 'RestrAllo':
+                self._get_restr_allo_ts()
+                ts1 = self.restr_allo_ts
+            elif dataset == 'MeteredRestrAllo':
+                self._get_metered_allo_ts(True, combine_meters=combine_meters, usage_allo_ratio=usage_allo_ratio)
+                ts1 = self.metered_restr_allo_ts
+            else:
+                self._get_usage_ts(usage_allo_ratio)
+                ts1 = self.usage_crc_ts
+
+            self.result_cache.put(key, ts1)
+
+        return ts1
+
+
+    def get_ts_partitioned(self, datasets, freq, groupby, partition='CatchmentGroupName', n_procs=None, irr_season=False, usage_allo_ratio=2, combine_meters=False):
+        """
+        Function to create a time series of allocation and usage like get_ts, but with the consents split into partitions by a site or allocation column and each partition run in a separate process. Partitions that share a consent or a Wap are run together so that the results are the same as get_ts. The source data that has already been read is split with the partitions, otherwise each partition reads its own.
+
+        Parameters
+        ----------
+        datasets : list of str
+            The dataset types to be returned. Must be one or more of {ds}.
+        freq : str
+            Pandas time frequency code for the time interval. Must be one of 'D', 'W', 'M', 'A', or 'A-JUN'.
+        groupby : list of str
+            The fields that should grouped by when returned. See get_ts.
+        partition : str
+            The column of the allo (e.g. CatchmentGroupName, SwazName, or CwmsName) to partition the consents by.
+        n_procs : int or None
+            The number of processes. None will use the number of processors on the machine.
+        irr_season : bool
+            Should the calculations and the resulting time series be only over the irrigation season? The irrigation season is from October through to the end of April.
+        usage_allo_ratio : int or float
+            The cut off ratio of usage/allocation. Any usage above this ratio will be removed from the results (subsequently reducing the metered allocation).
+        combine_meters : bool
+            When estimating the metered allocation, if one meter on a consent has usage data should all meters on the consent be considered metered? True, will be generous, False will not.
+
+        Results
+        -------
+        DataFrame
+            Indexed by the groupby (and date)
+        """
+        if partition not in self.allo:
+            raise ValueError('partition must be a column of the allo (e.g. one of ' + str(param.site_cols[4:]) + ')')
+
+        if not 'Date' in groupby:
+            groupby.append('Date')
+
+        ### Split the consents
+        labels = _partition_labels(self.allo, partition)
+        parts = [self._subset(labels == l) for l in np.unique(labels)]
+
+        ### Run the partitions
+        with ProcessPoolExecutor(n_procs) as executor:
+            futures = [executor.submit(_partition_ts, p, datasets, freq, groupby, irr_season, usage_allo_ratio, combine_meters) for p in parts]
+            ts_list = [f.result() for f in futures]
+
+        ## Groups that are in more than one partition need to be summed
+        ts1 = pd.concat(ts_list).groupby(level=groupby).sum().round()
+
+        return ts1
+
+
+    def export_ts(self, path, datasets, freq, groupby=None, partition='CatchmentGroupName', format='parquet', irr_season=False, usage_allo_ratio=2, combine_meters=False):
+        """
+        Function to write the time series of get_ts, or the per consent/block/Wap tables of the datasets, to a Parquet or Arrow IPC dataset partitioned by water year and a grouping column. The key columns are kept as categoricals. The datasets can be read back with export.rd_ts, which only reads the partitions that pass the filters.
+
+        Parameters
+        ----------
+        path : str
+            The directory to write to. With groupby=None, each dataset is written to a subdirectory named after its table (e.g. allo_ts).
+        datasets : list of str
+            The dataset types to be written. Must be one or more of {ds}.
+        freq : str
+            Pandas time frequency code for the time interval. Must be one of 'D', 'W', 'M', 'A', or 'A-JUN'.
+        groupby : list of str or None
+            The groupby of get_ts to write. None will write each dataset by RecordNumber, AllocationBlock, and Wap.
+        partition : str or None
+            The column to partition by within each water year. It is added to the groupby if it's not there. None will only partition by water year.
+        format : str
+            Either 'parquet' or 'arrow'.
+        irr_season : bool
+            Should the calculations and the resulting time series be only over the irrigation season? The irrigation season is from October through to the end of April.
+        usage_allo_ratio : int or float
+            The cut off ratio of usage/allocation. Any usage above this ratio will be removed from the results (subsequently reducing the metered allocation).
+        combine_meters : bool
+            When estimating the metered allocation, if one meter on a consent has usage data should all meters on the consent be considered metered? True, will be generous, False will not.
+
+        Returns
+        -------
+        list of str
+            The paths of the written datasets.
+        """
+        partition_cols = ['WaterYear']
+        if partition is not None:
+            partition_cols.append(partition)
+
+        if groupby is None:
+            groupby1 = ['RecordNumber', 'AllocationBlock', 'Wap']
+            sets = [(os.path.join(path, param.export_tables[d]), [d]) for d in datasets]
+        else:
+            groupby1 = groupby[:]
+            sets = [(path, datasets)]
+
+        if (partition is not None) and (partition not in groupby1):
+            groupby1.append(partition)
+
+        paths = []
+        for path1, datasets1 in sets:
+            ts1 = self._sum_ts(datasets1, freq, groupby1[:], irr_season, usage_allo_ratio, combine_meters, decode=False).round()
+            export.write_ts(ts1, path1, partition_cols, format)
+            paths.append(path1)
+
+        return paths
+
+
+    def _subset(self, mask, from_date=None, to_date=None):
+        """
+        Function to copy the object with a subset of the allo rows and the source data of the subset, but without any time series results. The from_date and to_date can narrow the dates of the copy.
+        """
+        alloc = copy.copy(self)
+
+        if from_date is not None:
+            setattr(alloc, 'from_date', from_date)
+        if to_date is not None:
+            setattr(alloc, 'to_date', to_date)
+
+        allo1 = self.allo[mask].copy()
+        allo1.index = allo1.index.remove_unused_levels()
+        crcs = allo1.index.get_level_values('RecordNumber').unique()
+        waps = allo1.index.get_level_values('Wap').unique()
+
+        setattr(alloc, 'allo', allo1)
+        setattr(alloc, 'waps', np.asarray(waps.astype(object)))
+        setattr(alloc, 'result_cache', LRUCache(self.result_cache.max_size))
+        setattr(alloc, 'profile_records', [])
+
+        for d in param.temp_datasets + ['freq', 'period_freq', 'irr_season', 'allo_intervals']:
+            if d in alloc.__dict__:
+                delattr(alloc, d)
+
+        if hasattr(self, 'ts_usage_summ'):
+            setattr(alloc, 'ts_usage_summ', self.ts_usage_summ[self.ts_usage_summ.Wap.isin(waps)])
+        if hasattr(self, 'usage_ts_daily'):
+            dates = self.usage_ts_daily.Date
+            setattr(alloc, 'usage_ts_daily', self.usage_ts_daily[self.usage_ts_daily.Wap.isin(waps) & (dates >= alloc.from_date) & (dates <= alloc.to_date)])
+        if hasattr(self, 'lf_restr_daily'):
+            dates = self.lf_restr_daily.index.get_level_values('Date')
+            setattr(alloc, 'lf_restr_daily', self.lf_restr_daily[self.lf_restr_daily.index.get_level_values('RecordNumber').isin(crcs) & (dates >= alloc.from_date) & (dates <= alloc.to_date)])
+
+        return alloc
+
+
+    def allo_totals(self, freq, groupby, irr_season=False):
+        """
+        Function to calculate the allocation totals (the Allo dataset of get_ts) from the allocation intervals rather than the time series of every consent/block/Wap (see allocation_ts.allo_intervals and allocation_ts.interval_ts). This is much quicker and uses much less memory than get_ts for long time series at the 'D' and 'W' freqs. The 'D' and 'W' totals are the allocated rates and the others are volumes like get_ts. The totals are rounded after they are summed rather than per consent/block/Wap, so they can differ slightly from get_ts.
+
+        Parameters
+        ----------
+        freq : str
+            Pandas time frequency code for the time interval. Must be one of 'D', 'W', 'M', 'A', or 'A-JUN'.
+        groupby : list of str
+            The fields that should grouped by when returned. Can be any of the allo index levels or columns (e.g. RecordNumber, Wap, CatchmentGroupName). Date will always be included as part of the output group, so it doesn't need to be specified in the groupby.
+        irr_season : bool
+            Should only the irrigation season (October through to the end of April) be included?
+
+        Returns
+        -------
+        DataFrame
+            Indexed by the groupby (and date) with the GwAllo, SwAllo, and TotalAllo columns
+        """
+        if freq not in param.allo_type_dict:
+            raise ValueError('freq must be one of ' + str(list(param.allo_type_dict)))
+
+        if not 'Date' in groupby:
+            groupby.append('Date')
+
+        if not hasattr(self, 'allo_intervals'):
+            setattr(self, 'allo_intervals', allo_intervals(self.allo, self.from_date, self.to_date))
+
+        value_col = 'AllocatedRate' if param.allo_type_dict[freq] == 'AllocatedRate' else 'DayVolume'
+        months = [10, 11, 12, 1, 2, 3, 4] if irr_season else None
+        by = [c for c in groupby if c != 'Date']
+
+        allo1 = interval_ts(self.allo_intervals, freq, value_col, by + ['HydroFeature'], months=months)
+
+        ## Remove the dates outside of the irrigation season
+        if irr_season and ('A' not in freq):
+            allo1 = allo1[allo1.index.get_level_values('Date').month.isin(months)]
+
+        ## Rearrange
+        allo2 = allo1.unstack('HydroFeature').rename(columns={'Groundwater': 'GwAllo', 'Surface Water': 'SwAllo'})
+        allo2.columns = list(allo2.columns)
+        for c in ['GwAllo', 'SwAllo']:
+            if not c in allo2:
+                allo2[c] = 0
+        allo2 = allo2[['GwAllo', 'SwAllo']].fillna(0)
+        allo2['TotalAllo'] = allo2['GwAllo'] + allo2['SwAllo']
+
+        allo2 = allo2.reorder_levels(groupby).sort_index().round()
+        allo2.index = allo2.index.set_levels([l.astype(object) if isinstance(l, pd.CategoricalIndex) else l for l in allo2.index.levels])
+
+        return allo2
+
+
+    def profile_report(self):
+        """
+        Function to summarise the profiled stages. The stages are in the order that they finished, so the nested stages (depth > 0) are before the stage that called them. The time and memory of a stage include those of its nested stages.
+
+        Returns
+        -------
+        DataFrame
+            with the stage, depth, freq, start, time (in seconds), rows_in, rows_out, and mem_delta (in bytes) columns
+        """
+        profile1 = pd.DataFrame(self.profile_records, columns=['stage', 'depth', 'freq', 'start', 'time', 'rows_in', 'rows_out', 'mem_delta'])
+        profile1['start'] = pd.to_datetime(profile1['start'], unit='s')
+
+        return profile1
+
+
+    def cache_info(self):
+        """
+        Function to summarise the get_ts result cache.
+
+        Returns
+        -------
+        dict
+            of the hits, misses, number of entries, size in bytes, and max_size
+        """
+        return self.result_cache.info()
+
+
+    @util.stage()
     def _merge_extra(self, data, cols):
         """
 
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+#####################################
+### Parameters
+
+formats = {'parquet': 'parquet', 'arrow': 'ipc'}
+
+#####################################
+### Functions
+
+
+def water_year(dates):
+    """
+    Function to get the water year (July to June) of dates. The water year is labelled by the year that it ends in, like the 'A-JUN' freq.
+
+    Parameters
+    ----------
+    dates : Series or DatetimeIndex
+
+    Returns
+    -------
+    Series or Index of int
+    """
+    if isinstance(dates, pd.Series):
+        dates = dates.dt
+
+    return dates.year + (dates.month > 6).astype(int)
+
+
+def write_ts(ts, path, partition_cols=['WaterYear'], format='parquet'):
+    """
+    Function to write a time series DataFrame as a hive partitioned Parquet or Arrow IPC dataset (e.g. path/WaterYear=2019/CatchmentGroupName=Ashley/part-0.parquet). A WaterYear column is added from the Date column if it's needed. The categorical columns are kept as dictionary columns. Any existing partitions of the dataset that are written to are replaced.
+
+    Parameters
+    ----------
+    ts : DataFrame
+        The time series with a Date column or index level.
+    path : str
+        The directory of the dataset.
+    partition_cols : list of str
+        The columns (or index levels) to partition by.
+    format : str
+        Either 'parquet' or 'arrow'.
+
+    Returns
+    -------
+    None
+    """
+    if format not in formats:
+        raise ValueError('format must be one of ' + str(list(formats)))
+
+    ts1 = ts.reset_index()
+    if ('WaterYear' in partition_cols) and ('WaterYear' not in ts1):
+        ts1['WaterYear'] = water_year(ts1['Date'])
+
+    ## The partition values are in the directory names
+    for c in partition_cols:
+        if isinstance(ts1[c].dtype, pd.CategoricalDtype):
+            ts1[c] = ts1[c].astype(ts1[c].cat.categories.dtype)
+
+    table = pa.Table.from_pandas(ts1, preserve_index=False)
+    partitioning = ds.partitioning(table.select(partition_cols).schema, flavor='hive')
+
+    ds.write_dataset(table, path, format=formats[format], partitioning=partitioning, existing_data_behavior='delete_matching')
+
+
+def rd_ts(path, filters=None, columns=None, format='parquet'):
+    """
+    Function to read a dataset from write_ts. The filters on the partition columns are applied to the directory names, so only the partitions that are needed are read.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the dataset.
+    filters : list of tuple or None
+        The filters in the pandas read_parquet form (e.g. [('WaterYear', '>=', 2018), ('CatchmentGroupName', 'in', ['Ashley'])]).
+    columns : list of str or None
+        The columns to read. None will read all of them.
+    format : str
+        Either 'parquet' or 'arrow'.
+
+    Returns
+    -------
+    DataFrame
+    """
+    if format not in formats:
+        raise ValueError('format must be one of ' + str(list(formats)))
+
+    dataset = ds.dataset(path, format=formats[format], partitioning='hive')
+    expr = pq.filters_to_expression(filters) if filters else None
+
+    ts1 = dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+    return ts1
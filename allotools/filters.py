@@ -5,7 +5,7 @@ Created on Wed Oct  3 16:40:35 2018
 @author: michaelek
 """
 import pandas as pd
-from pdsql import mssql
+from allotools.backends import MssqlBackend
 from allotools import parameters as param
 #import parameters as param
 
@@ -13,7 +13,7 @@ from allotools import parameters as param
 ### Functions
 
 
-def rd_allo(from_date='1900-07-01', to_date='2020-06-30', where_in=None, include_hydroelectric=False):
+def rd_allo(from_date='1900-07-01', to_date='2020-06-30', where_in=None, include_hydroelectric=False, backend=None, site_filter=None, sites=None):
     """
     Function to filter consents..
 
@@ -25,14 +25,29 @@ def rd_allo(from_date='1900-07-01', to_date='2020-06-30', where_in=None, include
         The end date for the time series.
     where_in : dict
         The keys should be the column names and the values should be a list of values on those columns.
+    include_hydroelectric : bool
+        Should hydroelectric takes be included?
+    backend : Backend or None
+        The data source. None will use the MssqlBackend.
+    site_filter : dict or None
+        A dict in the form of {str: [values]} of the ExternalSite table. Only the allocation of the matching Waps is returned.
+    sites : DataFrame or None
+        The sites of the site_filter from rd_sites if they have already been read, so that they aren't read again.
 
     Returns
     -------
     DataFrame
         Allocation
     """
-    ### allocation
-    allo1 = mssql.rd_sql(param.crc_server, param.crc_database, param.allo_table, param.allo_cols, where_in=where_in)
+    if backend is None:
+        backend = MssqlBackend()
+
+    if sites is not None:
+        sites = sites.reset_index()
+
+    ### allocation - the filters are also compiled into the query where the backend can
+    exclude_uses = None if include_hydroelectric else ['hydroelectric']
+    allo1 = backend.rd_allo(where_in, status=param.status_codes, exclude_uses=exclude_uses, from_date=from_date, to_date=to_date, min_days=10, site_where_in=site_filter, sites=sites)
     allo1 = allo1[allo1.ConsentStatus.isin(param.status_codes)].copy()
     if not include_hydroelectric:
         allo1 = allo1[allo1.WaterUse != 'hydroelectric']
@@ -51,13 +66,18 @@ def rd_allo(from_date='1900-07-01', to_date='2020-06-30', where_in=None, include
     return allo2
 
 
-def rd_sites(where_in=None):
+def rd_sites(where_in=None, backend=None):
     """
     where_in : dict
         The keys should be the column names and the values should be a list of values on those columns.
+    backend : Backend or None
+        The data source. None will use the MssqlBackend.
     """
+    if backend is None:
+        backend = MssqlBackend()
+
     ### Site and attributes
-    sites = mssql.rd_sql(param.hydro_server, param.hydro_database, param.site_table, param.site_cols, where_in=where_in)
+    sites = backend.rd_sites(where_in, waps_only=True)
     sites1 = sites[sites.ExtSiteID.str.contains('[A-Z]+\d\d/\d+')].copy()
 
     return sites1.set_index('ExtSiteID')
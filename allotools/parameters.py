@@ -18,6 +18,16 @@ ts_summ_table = 'TSDataNumericDailySumm'
 ts_table = 'TSDataNumericDaily'
 lf_table = 'reporting.TSCrcBlockRestr'
 
+### Query cache
+cache_ttl = 24*60*60
+cache_max_size = 2*1024**3
+
+### get_ts result cache
+result_cache_size = 1024**3
+
+### Prefetch
+prefetch_chunk_size = 500
+
 dataset_dict = {9: 'Surface Water', 12: 'Groundwater'}
 
 #sd_dict = {7: 'sd1_7', 30: 'sd1_30', 150: 'sd1_150'}
@@ -36,12 +46,19 @@ dataset_types = ['Allo', 'RestrAllo', 'MeteredAllo', 'MeteredRestrAllo', 'Usage'
 
 pk = ['RecordNumber', 'AllocationBlock', 'Wap', 'Date']
 
+key_cols = ['RecordNumber', 'HydroFeature', 'AllocationBlock', 'Wap']
+
 allo_cols = ['RecordNumber', 'HydroFeature', 'AllocationBlock', 'ExtSiteID', 'FromDate', 'ToDate', 'FromMonth', 'ToMonth', 'AllocatedRate', 'AllocatedAnnualVolume', 'WaterUse', 'IrrigationArea', 'ConsentStatus']
 
 site_cols = ['ExtSiteID', 'ExtSiteName', 'NZTMX', 'NZTMY', 'CatchmentName', 'CatchmentNumber', 'CatchmentGroupName', 'CatchmentGroupNumber', 'SwazName', 'SwazGroupName', 'SwazSubRegionalName', 'GwazName', 'CwmsName']
 
 
-#temp_datasets = ['allo_ts', 'total_allo_ts', 'restr_allo_ts', 'lf_restr', 'usage_crc_ts', 'usage_ts', 'usage_crc_ts', 'metered_allo_ts', 'metered_restr_allo_ts']
+temp_datasets = ['allo_ts', 'restr_allo_ts', 'lf_restr', 'usage_crc_base', 'usage_crc_ts', 'usage_ts', 'metered_allo_ts', 'metered_restr_allo_ts']
+
+## The datasets of the daily base that depend on the period_freq
+period_datasets = ['restr_allo_ts', 'lf_restr', 'usage_crc_base', 'usage_crc_ts', 'metered_allo_ts', 'metered_restr_allo_ts']
+
+export_tables = {'Allo': 'allo_ts', 'RestrAllo': 'restr_allo_ts', 'MeteredAllo': 'metered_allo_ts', 'MeteredRestrAllo': 'metered_restr_allo_ts', 'Usage': 'usage_crc_ts'}
 
 #datasets = {'allo': ['total_allo', 'sw_allo', 'gw_allo'],
 
@@ -6,9 +6,8 @@ Created on Wed Feb 20 15:25:06 2019
 """
 import os
 import numpy as np
-import seaborn as sns
 import pandas as pd
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 #from collections import OrderedDict
 #from datetime import datetime
 
@@ -16,20 +15,195 @@ import matplotlib.pyplot as plt
 #####################################
 ### Global parameters
 
-date1 = pd.Timestamp.now()
-date2 = date1.strftime('%Y%m%d%H%M')
+## seaborn, matplotlib, and the timestamp of the plot names are set on first use (see _import_plot)
+sns = None
+plt = None
+date1 = None
+date2 = None
 
-sns.set_style("whitegrid")
-sns.set_context('poster')
 base_names = {'{}Allo': '{}RestrAllo', '{}MeteredAllo': '{}MeteredRestrAllo', '{}Usage': '{}Usage'}
 base_label_names = {'{}Allo': '{} Allocation', '{}RestrAllo': '{} Allocation with Restrictions', '{}MeteredAllo': '{} Metered Allocation', '{}MeteredRestrAllo': '{} Metered Allocation with Restrictions', '{}Usage': '{} Usage'}
 dict_type = {'water_supply': 'Water Supply', 'irrigation': 'Irrigation', 'stockwater': 'Stockwater', 'other': 'Other', 'industrial': 'Industrial', 'municipal': 'Municipal'}
 
+## The figure of the process that is reused for every plot
+_fig = None
+
 #####################################
 ### Functions
 
 
-def plot_group(self, freq, val='Total', group='SwazName', with_restr=True, yaxis_mag=1000000, yaxis_lab='Million', col_pal='pastel', export_path='', **kwargs):
+def _import_plot():
+    """
+    Function to import seaborn and matplotlib and set the plot style on the first use. They are slow to import, so they are only imported when plotting.
+    """
+    global sns, plt, date1, date2
+
+    if sns is None:
+        import seaborn
+        import matplotlib.pyplot
+
+        seaborn.set_style("whitegrid")
+        seaborn.set_context('poster')
+
+        sns = seaborn
+        plt = matplotlib.pyplot
+        date1 = pd.Timestamp.now()
+        date2 = date1.strftime('%Y%m%d%H%M')
+
+
+def _reuse_fig(figsize=(15, 10)):
+    """
+    Function to get the figure of the process cleared and with a new axes. Clearing and reusing one figure is much quicker than creating a new figure for every plot.
+    """
+    global _fig
+
+    if (_fig is None) or (not plt.fignum_exists(_fig.number)):
+        _fig = plt.figure(figsize=figsize)
+    _fig.clf()
+    ax = _fig.add_subplot(111)
+
+    return _fig, ax
+
+
+def _close_fig():
+    """
+    Function to close the figure of the process.
+    """
+    global _fig
+
+    if _fig is not None:
+        plt.close(_fig)
+        _fig = None
+
+
+def _init_worker():
+    """
+    Function to initialise the plotting processes with the non-interactive Agg backend.
+    """
+    _import_plot()
+    plt.switch_backend('Agg')
+
+
+def _render(func, tasks, n_procs=1):
+    """
+    Function to render the plots either in this process or in a pool of processes.
+    """
+    if n_procs == 1:
+        try:
+            paths = [func(*t) for t in tasks]
+        finally:
+            _close_fig()
+    else:
+        with ProcessPoolExecutor(n_procs, initializer=_init_worker) as executor:
+            futures = [executor.submit(func, *t) for t in tasks]
+            paths = [f.result() for f in futures]
+
+    return paths
+
+
+def _finish_fig(fig, ax, export_name, export_path):
+    """
+    Function to format the x axis and save the figure.
+    """
+    xticks = ax.get_xticks()
+    if len(xticks) > 15:
+        for label in ax.get_xticklabels()[::2]:
+            label.set_visible(False)
+        ax.xaxis_date()
+        fig.autofmt_xdate(ha='center')
+        fig.tight_layout()
+    fig.tight_layout()
+#          sns.despine(offset=10, trim=True)
+
+    # Save figure
+    export_name = export_name.replace('/', '-').replace(' ', '-')
+    path1 = os.path.join(export_path, export_name)
+    fig.savefig(path1)
+
+    return path1
+
+
+def _date_axis(ax, dates):
+    """
+    Function to set up the categorical date x axis like the seaborn barplot.
+    """
+    ax.set_xticks(np.arange(len(dates)))
+    ax.set_xticklabels(dates.astype('str'))
+    ax.set_xlim(-0.5, len(dates) - 0.5)
+    ax.xaxis.grid(False)
+
+
+def _bars_group(ax, set1, vol_names, col_pal1, with_restr):
+    """
+    Function to draw the adjacent (and hatched restriction) bars of plot_group directly with matplotlib. The bars have the same positions, colours, and labels as the seaborn barplots.
+    """
+    x = np.arange(len(set1))
+    width = 0.8 / len(vol_names)
+    offsets = (np.arange(len(vol_names)) - (len(vol_names) - 1) / 2) * width
+
+    for k, name in enumerate(vol_names):
+        ax.bar(x + offsets[k], set1[name].values, width, color=sns.desaturate(col_pal1[k], 0.75), edgecolor='0', label=name)
+
+    if with_restr:
+        for k, name in enumerate(vol_names.values()):
+            label = 'unused' if 'Usage' in name else name
+            ax.bar(x + offsets[k], set1[name].values, width, color=sns.desaturate(col_pal1[k], 0.75), edgecolor='0', hatch='/', label=label)
+
+    _date_axis(ax, set1.Date)
+
+
+def _bars_stacked(ax, grp1, i, grp2, col_lab):
+    """
+    Function to draw the stacked bars of plot_stacked directly with matplotlib. The bars have the same positions, colours, and labels as the seaborn barplots.
+    """
+    dates = pd.Series(grp1.index.get_level_values('Date').unique().sort_values())
+    x = np.arange(len(dates))
+
+    for u in grp2:
+        grp3 = grp1.loc[(i, u, slice(None))]
+        values = pd.Series(grp3.values, index=grp3.index.get_level_values('Date')).reindex(dates.values).values
+        ax.bar(x, values, 0.8, color=sns.desaturate(col_lab[u], 0.75), edgecolor='0', label=u)
+
+    _date_axis(ax, dates)
+
+
+def _plot_group_fig(i, set1, val, vol_names, label_names, col_pal1, with_restr, yaxis_lab, export_path, engine='seaborn'):
+    """
+    Function to plot and save one group of plot_group.
+    """
+    fig, ax = _reuse_fig()
+
+    if engine == 'matplotlib':
+        _bars_group(ax, set1, vol_names, col_pal1, with_restr)
+    else:
+        allo_all = pd.melt(set1, id_vars='Date', value_vars=list(vol_names.keys()), var_name='tot_allo')
+
+        index1 = allo_all.Date.astype('str')
+
+        ## Plot total allo
+        sns.barplot(x=index1, y='value', hue='tot_allo', data=allo_all, palette=col_pal1, edgecolor='0', ax=ax)
+
+        if with_restr:
+            allo_up_all = pd.melt(set1, id_vars='Date', value_vars=list(vol_names.values()), var_name='up_allo')
+            allo_up_all.loc[allo_up_all.up_allo.str.contains('Usage'), 'up_allo'] = 'unused'
+            allo_up_all.loc[allo_up_all.up_allo.str.contains('Usage'), 'value'] = 0
+            sns.barplot(x=index1, y='value', hue='up_allo', data=allo_up_all, palette=col_pal1, edgecolor='0', hatch='/', ax=ax)
+    ax.set_ylabel('Water Volume $(' + yaxis_lab + '\; m^{3}/year$)')
+    ax.set_xlabel('Water Year')
+
+    # Legend
+    handles, lbs = ax.get_legend_handles_labels()
+    order1 = [lbs.index(j) for j in label_names if j in lbs]
+    labels = [label_names[lbs[i]] for i in order1 if lbs[i] in label_names]
+    ax.legend([handles[i] for i in order1], labels, loc='upper left')
+#        leg1.legendPatch.set_path_effects(pathe.withStroke(linewidth=5, foreground="w"))
+
+    export_name = '_'.join([i, val, date1.strftime('%Y%m%d%H%M')]) + '.png'
+
+    return _finish_fig(fig, ax, export_name, export_path)
+
+
+def plot_group(self, freq, val='Total', group='SwazName', with_restr=True, yaxis_mag=1000000, yaxis_lab='Million', col_pal='pastel', export_path='', ts=None, n_procs=1, engine='seaborn', **kwargs):
     """
     Function to plot the allocation, metered allocation, and usage as a time series barchart with three adjacent bars per time period. Optionally with restriction volumes.
 
@@ -51,14 +225,24 @@ def plot_group(self, freq, val='Total', group='SwazName', with_restr=True, yaxis
         The seaborn color palette to use.
     export_path : str
         The path where all the plots will be saved.
+    ts : DataFrame or None
+        A precomputed output of get_ts with the group and Date as the groupby and the Allo, MeteredAllo, and Usage (and RestrAllo and MeteredRestrAllo if with_restr) datasets. None will run get_ts.
+    n_procs : int
+        The number of processes to render the plots in. Each process uses the Agg backend.
+    engine : str
+        The renderer of the bars. Either 'seaborn' or 'matplotlib'. The bars are already aggregated, so 'matplotlib' draws the same bars directly from the values without the seaborn statistics and is much quicker.
     **kwargs
         Any kwargs to be passed to get_ts.
 
     Returns
     -------
-    None
-        But outputs many png files to the export_path.
+    list of str
+        The paths of the png files saved to the export_path.
     """
+    if engine not in ['seaborn', 'matplotlib']:
+        raise ValueError("engine must be either 'seaborn' or 'matplotlib'")
+
+    _import_plot()
     plt.ioff()
 
     ### prepare inputs
@@ -76,64 +260,58 @@ def plot_group(self, freq, val='Total', group='SwazName', with_restr=True, yaxis
         datasets.extend(['RestrAllo', 'MeteredRestrAllo'])
 
     ### Get ts data
-    ts1 = self.get_ts(datasets, freq, groupby, **kwargs)
+    if ts is None:
+        ts1 = self.get_ts(datasets, freq, groupby, **kwargs)
+    else:
+        ts1 = ts
 
     ts2 = ts1[[c for c in ts1 if val in c]] / yaxis_mag
 
     ### Prepare data
     top_grp = ts2.groupby(level=group)
 
-    for i, grp1 in top_grp:
+    tasks = [(i, grp1.loc[i].reset_index(), val, vol_names, label_names, col_pal1, with_restr, yaxis_lab, export_path, engine) for i, grp1 in top_grp if grp1.size > 1]
+
+    ### Plot
+    paths = _render(_plot_group_fig, tasks, n_procs)
+
+    plt.ion()
 
-        if grp1.size > 1:
+    return paths
 
-            set1 = grp1.loc[i].reset_index()
 
-            allo_all = pd.melt(set1, id_vars='Date', value_vars=list(vol_names.keys()), var_name='tot_allo')
+def _plot_stacked_fig(i, grp1, vol_name, stack, col_lab, yaxis_lab, export_path, engine='seaborn'):
+    """
+    Function to plot and save one group of plot_stacked.
+    """
+    grp2 = grp1.groupby(level=stack).sum().sort_values(ascending=False).index
+
+    fig, ax = _reuse_fig()
+
+    if engine == 'matplotlib':
+        _bars_stacked(ax, grp1, i, grp2, col_lab)
+    else:
+        for u in grp2:
+            grp3 = grp1.loc[(i, u, slice(None))]
+            allo_all = pd.melt(grp3.reset_index(), id_vars='Date', value_vars='vol', var_name=u)
 
             index1 = allo_all.Date.astype('str')
+            sns.barplot(x=index1, y='value', data=allo_all, edgecolor='0', color=col_lab[u], label=u, ax=ax)
 
-            ## Plot total allo
-            fig, ax = plt.subplots(figsize=(15, 10))
-            sns.barplot(x=index1, y='value', hue='tot_allo', data=allo_all, palette=col_pal1, edgecolor='0')
-
-            if with_restr:
-                allo_up_all = pd.melt(set1, id_vars='Date', value_vars=list(vol_names.values()), var_name='up_allo')
-                allo_up_all.loc[allo_up_all.up_allo.str.contains('Usage'), 'up_allo'] = 'unused'
-                allo_up_all.loc[allo_up_all.up_allo.str.contains('Usage'), 'value'] = 0
-                sns.barplot(x=index1, y='value', hue='up_allo', data=allo_up_all, palette=col_pal1, edgecolor='0', hatch='/')
-            plt.ylabel('Water Volume $(' + yaxis_lab + '\; m^{3}/year$)')
-            plt.xlabel('Water Year')
-
-            # Legend
-            handles, lbs = ax.get_legend_handles_labels()
-            order1 = [lbs.index(j) for j in label_names if j in lbs]
-            labels = [label_names[lbs[i]] for i in order1 if lbs[i] in label_names]
-            plt.legend([handles[i] for i in order1], labels, loc='upper left')
-    #        leg1.legendPatch.set_path_effects(pathe.withStroke(linewidth=5, foreground="w"))
-
-            # Other plotting adjustments
-            xticks = ax.get_xticks()
-            if len(xticks) > 15:
-                for label in ax.get_xticklabels()[::2]:
-                    label.set_visible(False)
-                ax.xaxis_date()
-                fig.autofmt_xdate(ha='center')
-                plt.tight_layout()
-            plt.tight_layout()
-#          sns.despine(offset=10, trim=True)
+#        plt.ylabel('Allocated Water Volume $(10^{' + str(pw) + '} m^{3}/year$)')
+    ax.set_ylabel('Water Volume $(' + yaxis_lab + '\; m^{3}/year$)')
+    ax.set_xlabel('Water Year')
 
-            # Save figure
-            plot2 = ax.get_figure()
-            export_name = '_'.join([i, val, date1.strftime('%Y%m%d%H%M')]) + '.png'
-            export_name = export_name.replace('/', '-').replace(' ', '-')
-            plot2.savefig(os.path.join(export_path, export_name))
-            plt.close()
+    # Legend
+    handles, lbs = ax.get_legend_handles_labels()
+    ax.legend(handles, lbs, loc='upper left')
 
-    plt.ion()
+    export_name = '_'.join([i, vol_name, stack, date1.strftime('%Y%m%d%H%M')]) + '.png'
+
+    return _finish_fig(fig, ax, export_name, export_path)
 
 
-def plot_stacked(self, freq, val='Total', stack='WaterUse', group='SwazName', yaxis_mag=1000000, yaxis_lab='Million', col_pal='pastel', export_path='', **kwargs):
+def plot_stacked(self, freq, val='Total', stack='WaterUse', group='SwazName', yaxis_mag=1000000, yaxis_lab='Million', col_pal='pastel', export_path='', ts=None, n_procs=1, engine='seaborn', **kwargs):
     """
     Function to plot the allocation stacked by a specific 'stack' group as a time series barchart.
 
@@ -147,8 +325,6 @@ def plot_stacked(self, freq, val='Total', stack='WaterUse', group='SwazName', ya
         The field of categories used for the volume stacking.
     group : str
         The grouping of the plot sets. Where each plot will be broken into the group values.
-    with_restr : bool
-        Should the restriction volumes be included in the plots?
     yaxis_mag : int
         The magnitude that the volumes should be divided by and plotted with on the Y axis.
     yaxis_lab : str
@@ -157,14 +333,24 @@ def plot_stacked(self, freq, val='Total', stack='WaterUse', group='SwazName', ya
         The seaborn color palette to use.
     export_path : str
         The path where all the plots will be saved.
+    ts : DataFrame or None
+        A precomputed output of get_ts with the group, stack, and Date as the groupby and the Allo dataset. None will run get_ts.
+    n_procs : int
+        The number of processes to render the plots in. Each process uses the Agg backend.
+    engine : str
+        The renderer of the bars. Either 'seaborn' or 'matplotlib'. The bars are already aggregated, so 'matplotlib' draws the same bars directly from the values without the seaborn statistics and is much quicker.
     **kwargs
         Any kwargs to be passed to get_ts.
 
     Returns
     -------
-    None
-        But outputs many png files to the export_path.
+    list of str
+        The paths of the png files saved to the export_path.
     """
+    if engine not in ['seaborn', 'matplotlib']:
+        raise ValueError("engine must be either 'seaborn' or 'matplotlib'")
+
+    _import_plot()
     plt.ioff()
 
     ### Prepare inputs
@@ -182,7 +368,10 @@ def plot_stacked(self, freq, val='Total', stack='WaterUse', group='SwazName', ya
 #        datasets.extend(['restr_allo'])
 
     ### Get ts data
-    ts1 = self.get_ts(datasets, freq, groupby, **kwargs)
+    if ts is None:
+        ts1 = self.get_ts(datasets, freq, groupby, **kwargs)
+    else:
+        ts1 = ts
 
     ts2 = ts1[vol_name] / yaxis_mag
 
@@ -198,45 +387,11 @@ def plot_stacked(self, freq, val='Total', stack='WaterUse', group='SwazName', ya
     stack_levels = ts3.index.levels[1]
     col_lab = {stack_levels[i]: col_pal1[i] for i in np.arange(stack_levels.size)}
 
-    for i, grp1 in top_grp:
-        i
-        if grp1.size > 1:
-
-            grp2 = grp1.groupby('WaterUse').sum().sort_values(ascending=False).index
-
-            fig, ax = plt.subplots(figsize=(15, 10))
-
-            for u in grp2:
-                grp3 = grp1.loc[(i, u, slice(None))]
-                allo_all = pd.melt(grp3.reset_index(), id_vars='Date', value_vars='vol', var_name=u)
-
-                index1 = allo_all.Date.astype('str')
-                sns.barplot(x=index1, y='value', data=allo_all, edgecolor='0', color=col_lab[u], label=u)
-
-    #        plt.ylabel('Allocated Water Volume $(10^{' + str(pw) + '} m^{3}/year$)')
-            plt.ylabel('Water Volume $(' + yaxis_lab + '\; m^{3}/year$)')
-            plt.xlabel('Water Year')
-
-            # Legend
-            handles, lbs = ax.get_legend_handles_labels()
-            plt.legend(handles, lbs, loc='upper left')
-
-            xticks = ax.get_xticks()
-            if len(xticks) > 15:
-                for label in ax.get_xticklabels()[::2]:
-                    label.set_visible(False)
-                ax.xaxis_date()
-                fig.autofmt_xdate(ha='center')
-                plt.tight_layout()
-            plt.tight_layout()
-    #      sns.despine(offset=10, trim=True)
+    tasks = [(i, grp1, vol_name, stack, col_lab, yaxis_lab, export_path, engine) for i, grp1 in top_grp if grp1.size > 1]
 
-            # Save figure
-            plot2 = ax.get_figure()
-            export_name = '_'.join([i, vol_name, stack, date1.strftime('%Y%m%d%H%M')]) + '.png'
-            export_name = export_name.replace('/', '-').replace(' ', '-')
-            plot2.savefig(os.path.join(export_path, export_name))
-            plt.close()
+    ### Plot
+    paths = _render(_plot_stacked_fig, tasks, n_procs)
 
     plt.ion()
 
+    return paths
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from allotools import parameters as param
+from allotools.backends import LocalBackend, ts_summ_cols, ts_cols, lf_cols
+
+#####################################
+### Parameters
+
+water_uses = ['irrigation', 'stockwater', 'water_supply', 'industrial', 'municipal', 'other', 'hydroelectric']
+water_use_probs = [0.6, 0.12, 0.1, 0.08, 0.04, 0.05, 0.01]
+
+#####################################
+### Functions
+
+
+def gen_tables(n_consents=1000, n_years=1, to_date='2019-06-30', n_waps=None, n_catchments=10, metered_frac=0.8, seed=0):
+    """
+    Function to generate a random, but reproducible, set of the source tables with the same names and columns as the ECan databases. The tables can be written to a LocalBackend for testing and benchmarking AlloUsage without the databases.
+
+    Parameters
+    ----------
+    n_consents : int
+        The number of consents (RecordNumbers). Around a fifth of the consents take from a second Wap in the same catchment.
+    n_years : int
+        The number of years of daily usage and low flow restriction data up to the to_date.
+    to_date : str
+        The end date of the daily data.
+    n_waps : int or None
+        The number of Waps. None will use two thirds of the n_consents.
+    n_catchments : int
+        The number of catchments that the Waps are split over.
+    metered_frac : float
+        The fraction of the Waps with daily usage data.
+    seed : int
+        The seed of the random number generator.
+
+    Returns
+    -------
+    dict
+        of table name to DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    to_date1 = pd.Timestamp(to_date)
+    from_date1 = to_date1 - pd.DateOffset(years=n_years) + pd.DateOffset(days=1)
+    dates = pd.date_range(from_date1, to_date1)
+
+    if n_waps is None:
+        n_waps = max(1, n_consents * 2 // 3)
+
+    ### Sites
+    wap_index = np.arange(n_waps)
+    waps = np.array(['{}{:02d}/{:05d}'.format(chr(65 + i % 26), (i // 26) % 100, i) for i in wap_index])
+    catch = rng.integers(0, n_catchments, n_waps)
+    catch_names = np.array(['Catchment' + str(i) for i in range(n_catchments)])
+
+    sites = pd.DataFrame({'ExtSiteID': waps, 'ExtSiteName': waps, 'NZTMX': rng.integers(1300000, 1700000, n_waps), 'NZTMY': rng.integers(5000000, 5400000, n_waps), 'CatchmentName': catch_names[catch], 'CatchmentNumber': catch, 'CatchmentGroupName': catch_names[catch // 2 * 2], 'CatchmentGroupNumber': catch // 2, 'SwazName': catch_names[catch], 'SwazGroupName': catch_names[catch // 2 * 2], 'SwazSubRegionalName': np.where(catch % 2 == 0, 'North', 'South'), 'GwazName': catch_names[catch], 'CwmsName': np.where(catch < (n_catchments / 2), 'Waimakariri', 'Selwyn')})
+
+    ### Allocation
+    crcs = np.array(['CRC{:06d}'.format(i) for i in range(n_consents)])
+    crc_wap = rng.integers(0, n_waps, n_consents)
+    sw_wap = rng.random(n_waps) < 0.3
+
+    ## The second Waps are in the same catchment
+    extra = rng.choice(n_consents, n_consents // 5, replace=False)
+    catch_order = np.argsort(catch, kind='stable')
+    catch_count = np.bincount(catch, minlength=n_catchments)
+    catch_start = np.concatenate(([0], np.cumsum(catch_count)[:-1]))
+    extra_catch = catch[crc_wap[extra]]
+    extra_wap = catch_order[catch_start[extra_catch] + (rng.random(len(extra)) * catch_count[extra_catch]).astype(int)]
+
+    rows = np.concatenate((np.arange(n_consents), extra))
+    row_wap = np.concatenate((crc_wap, extra_wap))
+    n_rows = len(rows)
+
+    from_dates = to_date1 - pd.to_timedelta(rng.integers(365, 365 * (n_years + 10), n_consents), unit='D')
+    to_dates = from_dates + pd.to_timedelta(rng.integers(365 * 5, 365 * 35, n_consents), unit='D')
+    water_use = rng.choice(water_uses, n_consents, p=water_use_probs)
+    irr = water_use == 'irrigation'
+    rate = rng.integers(1, 100, n_consents)
+
+    allo = pd.DataFrame({'RecordNumber': crcs[rows], 'HydroFeature': np.where(sw_wap[row_wap], 'Surface Water', 'Groundwater'), 'AllocationBlock': np.where(rng.random(n_rows) < 0.9, 'A', 'B'), 'ExtSiteID': waps[row_wap], 'FromDate': from_dates[rows], 'ToDate': to_dates[rows], 'FromMonth': np.where(irr, 4, 1)[rows], 'ToMonth': np.where(irr, 10, 12)[rows], 'AllocatedRate': rate[rows], 'AllocatedAnnualVolume': (rate * 86.4 * np.where(irr, 120, 250)).round()[rows], 'WaterUse': water_use[rows], 'IrrigationArea': np.where(irr, rate * 2, 0)[rows], 'ConsentStatus': np.where(rng.random(n_rows) < 0.95, 'Issued - Active', 'Terminated - Expired')})
+    allo = allo.drop_duplicates(['RecordNumber', 'HydroFeature', 'AllocationBlock', 'ExtSiteID']).reset_index(drop=True)
+
+    ### Daily usage
+    metered = wap_index[rng.random(n_waps) < metered_frac]
+    wap_rate = np.bincount(crc_wap, weights=rate, minlength=n_waps)
+    season = 1 + np.cos((dates.dayofyear.values - 15) / 365.25 * 2 * np.pi)
+
+    value = np.outer(wap_rate[metered] * 86.4 * 0.3, season) * rng.gamma(2, 0.5, (len(metered), len(dates)))
+    ## Add a few negative values and spikes for the filters
+    value[rng.random(value.shape) < 0.001] = -1
+    spikes = rng.random(value.shape) < 0.001
+    value[spikes] = value[spikes] * 20
+
+    ts = pd.DataFrame({'ExtSiteID': np.repeat(waps[metered], len(dates)), 'DatasetTypeID': np.repeat(np.where(sw_wap[metered], 9, 12), len(dates)), 'DateTime': np.tile(dates.values, len(metered)), 'Value': value.ravel().round(1)})
+
+    ts_summ = pd.DataFrame({'ExtSiteID': waps[metered], 'DatasetTypeID': np.where(sw_wap[metered], 9, 12), 'FromDate': dates[0], 'ToDate': dates[-1]})
+
+    ### Low flow restrictions on the surface water takes over summer
+    sw_allo = allo.loc[allo.HydroFeature == 'Surface Water', ['RecordNumber', 'AllocationBlock']].drop_duplicates()
+    summer = dates[dates.month.isin([12, 1, 2, 3])].values
+    n_days = rng.integers(0, len(summer) // 4 + 1, len(sw_allo))
+    restr_dates = np.concatenate([rng.choice(summer, n, replace=False) for n in n_days]) if len(sw_allo) else summer[:0]
+
+    lf = pd.DataFrame({'RecordNumber': np.repeat(sw_allo['RecordNumber'].values, n_days), 'AllocationBlock': np.repeat(sw_allo['AllocationBlock'].values, n_days), 'RestrDate': restr_dates, 'Allocation': rng.integers(0, 11, n_days.sum()) * 10})
+
+    tables = {param.allo_table: allo[param.allo_cols], param.site_table: sites[param.site_cols], param.ts_summ_table: ts_summ[ts_summ_cols], param.ts_table: ts[['ExtSiteID', 'DatasetTypeID'] + ts_cols[1:]], param.lf_table: lf[lf_cols]}
+
+    return tables
+
+
+def gen_backend(path, **kwargs):
+    """
+    Function to generate the source tables with gen_tables and write them to a LocalBackend.
+
+    Parameters
+    ----------
+    path : str
+        The path to the SQLite file or the parquet directory.
+    **kwargs
+        Any kwargs to be passed to gen_tables.
+
+    Returns
+    -------
+    LocalBackend
+    """
+    backend = LocalBackend(path)
+    for table, df in gen_tables(**kwargs).items():
+        backend.write_table(table, df)
+
+    return backend
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from allotools.allocation_ts import allo_ts_apply, allo_ts_vec, allo_ts_daily, allo_intervals, interval_ts, restr_matrix
+
+#################################
+### Parameters
+
+from_date = '2008-07-01'
+to_date = '2012-06-30'
+freq_cols = {'D': 'AllocatedRate', 'W': 'AllocatedRate', 'M': 'AllocatedAnnualVolume', 'A-JUN': 'AllocatedAnnualVolume'}
+n_allo = 50
+
+rng = np.random.default_rng(9)
+from_dates = pd.Timestamp('2006-01-01') + pd.to_timedelta(rng.integers(0, 3000, n_allo), 'D')
+to_dates = from_dates + pd.to_timedelta(rng.integers(11, 2000, n_allo), 'D')
+
+allo = pd.DataFrame({'FromDate': from_dates, 'ToDate': to_dates, 'FromMonth': rng.integers(1, 13, n_allo), 'ToMonth': rng.integers(1, 13, n_allo), 'AllocatedRate': rng.uniform(0, 100, n_allo).round(1), 'AllocatedAnnualVolume': rng.uniform(0, 1000000, n_allo).round()})
+allo.index = pd.MultiIndex.from_arrays([['CRC' + str(i) for i in range(n_allo)], ['Groundwater'] * n_allo, ['A'] * n_allo, ['Wap' + str(i) for i in range(n_allo)]], names=['RecordNumber', 'HydroFeature', 'AllocationBlock', 'Wap'])
+
+####################################
+### Run tests
+
+
+def test_allo_ts_vec():
+    for freq, restr_col in freq_cols.items():
+        allo1 = allo.apply(allo_ts_apply, axis=1, from_date=from_date, to_date=to_date, freq=freq, restr_col=restr_col).stack().sort_index()
+        allo2 = allo_ts_vec(allo, from_date, to_date, freq, restr_col).sort_index()
+
+        assert allo1.index.equals(allo2.index)
+        assert np.array_equal(allo1.values, allo2.values)
+
+
+def test_interval_ts():
+    iv1 = allo_intervals(allo, from_date, to_date)
+
+    ## Volumes
+    allo1 = allo_ts_daily(allo, from_date, to_date).reset_index()
+    allo1['Date'] = allo1['Date'] + pd.offsets.MonthEnd(0)
+    allo1 = allo1.groupby(list(allo.index.names) + ['Date'])['allo'].sum()
+    allo2 = interval_ts(iv1, 'M', 'DayVolume')
+    allo3 = interval_ts(iv1, 'A-JUN', 'DayVolume', by=['HydroFeature'], max_cells=1000)
+
+    ## Rates
+    allo4 = allo_ts_vec(allo.assign(AllocatedRate=allo.AllocatedRate.round()), from_date, to_date, 'D', 'AllocatedRate')
+    allo5 = interval_ts(iv1.assign(AllocatedRate=iv1.AllocatedRate.round()), 'D', 'AllocatedRate')
+
+    assert np.allclose(allo2.reindex(allo1.index).values, allo1.values)
+    assert allo2.drop(allo1.index).abs().sum() < 0.000001
+    assert np.isclose(allo3.sum(), allo1.sum())
+    assert (allo3.index.get_level_values('Date').month == 6).all()
+    assert np.array_equal(allo5.reindex(allo4.index).values, allo4.values)
+    assert allo5.drop(allo4.index).sum() == 0
+
+
+def test_restr_matrix():
+    days = pd.date_range(from_date, to_date)
+    restr_days = rng.choice(len(days), 500, replace=False)
+    restr = pd.DataFrame({'RecordNumber': rng.choice(['CRC0', 'CRC1', 'CRC2'], 500), 'Date': days[restr_days], 'restr_ratio': rng.integers(0, 11, 500) * 0.1})
+    restr = restr.set_index(['RecordNumber', 'Date'])['restr_ratio']
+
+    for freq in ['D', 'W', 'M']:
+        m1 = restr_matrix(restr, from_date, to_date, freq)
+        m2 = restr.groupby(['RecordNumber', pd.Grouper(level='Date', freq=freq)]).mean().unstack().reindex(index=m1.index, columns=m1.columns)
+
+        assert (m1.dtypes == 'float32').all()
+        assert np.allclose(m1, m2.fillna(1))
+        assert m1.columns[-1] >= pd.Timestamp(to_date)
+
+    assert len(restr_matrix(restr, from_date, to_date, 'D').columns) == len(days)
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from allotools import AlloUsage, filters, synthetic, parameters as param
+from allotools.backends import LocalBackend, MssqlBackend, lf_agg
+
+#################################
+### Parameters
+
+from_date = '2016-07-01'
+to_date = '2018-06-30'
+datasets = ['Allo', 'RestrAllo', 'MeteredAllo', 'MeteredRestrAllo', 'Usage']
+
+allo = pd.DataFrame({'RecordNumber': ['CRC000001', 'CRC000002', 'CRC000003'], 'HydroFeature': ['Groundwater', 'Surface Water', 'Groundwater'], 'AllocationBlock': ['A', 'A', 'A'], 'ExtSiteID': ['J36/0001', 'J36/0002', 'J36/0002'], 'FromDate': ['2010-01-01', '2017-01-15', '2012-01-01'], 'ToDate': ['2030-01-01', '2030-01-01', '2030-01-01'], 'FromMonth': [1, 1, 4], 'ToMonth': [12, 12, 10], 'AllocatedRate': [10, 20, 5], 'AllocatedAnnualVolume': [100000, 200000, 50000], 'WaterUse': ['irrigation', 'stockwater', 'hydroelectric'], 'IrrigationArea': [10, 20, 5], 'ConsentStatus': ['Issued - Active', 'Issued - Active', 'Issued - Active']})
+
+sites = pd.DataFrame({'ExtSiteID': ['J36/0001', 'J36/0002', 'Ashley River'], 'ExtSiteName': ['well', 'river', 'river'], 'NZTMX': [1500000, 1500100, 1500200], 'NZTMY': [5200000, 5200100, 5200200], 'CatchmentName': ['Ashley'] * 3, 'CatchmentNumber': [1] * 3, 'CatchmentGroupName': ['Ashley'] * 3, 'CatchmentGroupNumber': [1] * 3, 'SwazName': ['Ashley', 'Ashley', 'Ashley'], 'SwazGroupName': ['Ashley'] * 3, 'SwazSubRegionalName': ['North'] * 3, 'GwazName': ['Ashley'] * 3, 'CwmsName': ['Waimakariri'] * 3})
+
+ts_summ = pd.DataFrame({'ExtSiteID': ['J36/0001', 'J36/0002'], 'DatasetTypeID': [12, 9], 'FromDate': ['2015-01-01', '2017-07-01'], 'ToDate': ['2019-01-01', '2019-01-01']})
+
+dates = pd.date_range(from_date, to_date)
+ts = pd.concat([pd.DataFrame({'ExtSiteID': 'J36/0001', 'DatasetTypeID': 12, 'DateTime': dates.astype(str), 'Value': 100.0}), pd.DataFrame({'ExtSiteID': 'J36/0002', 'DatasetTypeID': 9, 'DateTime': dates[365:].astype(str), 'Value': 200.0})])
+
+lf = pd.DataFrame({'RecordNumber': 'CRC000001', 'AllocationBlock': 'A', 'RestrDate': dates[:31].astype(str), 'Allocation': 50})
+
+tables = {param.allo_table: allo, param.site_table: sites, param.ts_summ_table: ts_summ, param.ts_table: ts, param.lf_table: lf}
+
+####################################
+### Run tests
+
+
+def test_local_backend(tmp_path):
+    pq_dir = str(tmp_path)
+    sqlite_path = os.path.join(pq_dir, 'allo_usage.sqlite')
+
+    results = []
+    for path in [sqlite_path, pq_dir]:
+        backend = LocalBackend(path)
+        for table, df in tables.items():
+            backend.write_table(table, df)
+
+        a1 = AlloUsage(from_date, to_date, backend=backend)
+        results.append(a1.get_ts(datasets, 'A-JUN', ['RecordNumber']))
+
+    a2 = AlloUsage(from_date, to_date, backend=backend, usage_chunk_size=1)
+    results.append(a2.get_ts(datasets, 'A-JUN', ['RecordNumber']))
+
+    a3 = AlloUsage(from_date, to_date, backend=backend, prefetch=True)
+    results.append(a3.get_ts(datasets, 'A-JUN', ['RecordNumber']))
+
+    ## Without any metered Waps
+    backend.write_table(param.ts_summ_table, ts_summ.assign(DatasetTypeID=1))
+    e1 = AlloUsage(from_date, to_date, backend=backend).get_ts(['Allo', 'Usage'], 'M', ['Wap'])
+    e2 = AlloUsage(from_date, to_date, backend=backend, usage_chunk_size=1).get_ts(['Allo', 'Usage'], 'M', ['Wap'])
+
+    ts1 = results[0]
+
+    assert ts1.equals(results[1])
+    assert ts1.equals(results[2])
+    assert ts1.equals(results[3])
+    assert len(ts1) == 4
+    assert ts1.TotalAllo.sum() == 584522
+    assert ts1.TotalUsage.sum() == 146000
+    assert ts1.TotalMeteredAllo.sum() == 399992
+    assert ts1.TotalRestrAllo.sum() == 580276
+    assert e1.equals(e2)
+    assert 'TotalUsage' in e2
+
+
+def test_rd_parquet(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    backend.write_table(param.ts_table, ts)
+
+    ## The date bounds shouldn't index with a mask of the unfiltered rows
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UserWarning)
+        ts1 = backend.rd_ts(['J36/0002'], [9], '2017-07-10', '2017-07-20')
+
+    ts2 = backend.rd_ts([], [9], '2017-07-10', '2017-07-20')
+
+    assert len(ts1) == 11
+    assert (ts1.ExtSiteID == 'J36/0002').all()
+    assert ts2.empty
+    assert list(ts2.columns) == list(ts1.columns)
+
+
+def test_daily_base(tmp_path):
+    backend = synthetic.gen_backend(str(tmp_path), n_consents=200, n_years=2, seed=3)
+    groupby = ['RecordNumber', 'AllocationBlock', 'Wap']
+
+    a1 = AlloUsage('2017-07-01', '2019-06-30', backend=backend)
+    a2 = AlloUsage('2017-07-01', '2019-06-30', backend=backend, daily_base=True)
+
+    ## The 'D' allocations are volumes rather than rates, but the rows and restrictions are the same
+    d1 = a1.get_ts(datasets, 'D', groupby[:])
+    d2 = a2.get_ts(datasets, 'D', groupby[:])
+
+    assert d1.index.equals(d2.index)
+    assert np.allclose(d1.restr_ratio, d2.restr_ratio)
+
+    ## The other freqs only differ by the rounding of the monthly allocations
+    m1 = a1.get_ts(datasets, 'M', groupby[:])
+    m2 = a2.get_ts(datasets, 'M', groupby[:])
+    allo_ts = a2.allo_ts
+    y1 = a1.get_ts(datasets, 'A-JUN', groupby[:])
+    y2 = a2.get_ts(datasets, 'A-JUN', groupby[:])
+
+    assert a2.allo_ts is allo_ts
+    assert m1.index.equals(m2.index)
+    assert m1.columns.equals(m2.columns)
+    assert np.allclose(m1, m2, rtol=0.001, atol=1)
+    assert y1.index.equals(y2.index)
+    assert np.allclose(y1, y2, rtol=0.001, atol=6)
+    assert y1.restr_ratio.equals(y2.restr_ratio)
+
+
+def test_result_cache(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    for table, df in tables.items():
+        backend.write_table(table, df)
+
+    a1 = AlloUsage(from_date, to_date, backend=backend)
+    ts1 = a1.get_ts(datasets, 'A-JUN', ['RecordNumber'])
+    misses = a1.cache_info()['misses']
+    m1 = a1.get_ts(['MeteredAllo'], 'M', ['RecordNumber'], usage_allo_ratio=0.1)
+    ts2 = a1.get_ts(datasets, 'A-JUN', ['RecordNumber'])
+    info = a1.cache_info()
+
+    a2 = AlloUsage(from_date, to_date, backend=backend, result_cache_size=0)
+    m2 = a2.get_ts(['MeteredAllo'], 'M', ['RecordNumber'], usage_allo_ratio=0.1)
+
+    assert ts1.equals(ts2)
+    assert m1.equals(m2)
+    assert m1.TotalMeteredAllo.sum() == 0
+    assert info['hits'] == 7
+    assert info['misses'] == misses + 2
+    assert a2.cache_info()['entries'] == 0
+
+
+def test_key_encoding(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    for table, df in tables.items():
+        backend.write_table(table, df)
+
+    a1 = AlloUsage(from_date, to_date, backend=backend)
+    ts1 = a1.get_ts(datasets, 'M', ['RecordNumber', 'Wap'])
+
+    assert a1.usage_ts_daily['Wap'].dtype == 'category'
+    assert a1.lf_restr_daily.index.levels[0].dtype == 'category'
+    assert ts1.index.levels[0].dtype == object
+    assert ts1.index.levels[1].dtype == object
+    assert ts1.TotalUsage.sum() == 146000
+
+
+def test_profile(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    for table, df in tables.items():
+        backend.write_table(table, df)
+
+    a1 = AlloUsage(from_date, to_date, backend=backend, profile=True)
+    ts1 = a1.get_ts(datasets, 'A-JUN', ['RecordNumber'])
+    profile1 = a1.profile_report()
+
+    a2 = AlloUsage(from_date, to_date, backend=backend)
+    ts2 = a2.get_ts(datasets, 'A-JUN', ['RecordNumber'])
+
+    stages = ['_usage_summ', '_est_allo_ts', '_process_usage', '_get_usage_ts', '_lowflow_data', '_get_restr_allo_ts', '_get_metered_allo_ts', 'get_ts']
+
+    assert ts1.equals(ts2)
+    assert set(stages).issubset(profile1.stage)
+    assert profile1.iloc[-1]['rows_out'] == len(ts1)
+    assert (profile1['time'] > 0).all()
+    assert profile1['mem_delta'].notnull().all()
+    assert len(a2.profile_report()) == 0
+
+
+def test_allo_totals(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    for table, df in tables.items():
+        backend.write_table(table, df)
+
+    a1 = AlloUsage(from_date, to_date, backend=backend)
+    d1 = a1.get_ts(['Allo'], 'D', ['CatchmentName'])
+    d2 = a1.allo_totals('D', ['CatchmentName'])
+    m1 = a1.get_ts(['Allo'], 'M', ['RecordNumber'], irr_season=True)
+    m2 = a1.allo_totals('M', ['RecordNumber'], irr_season=True)
+
+    assert d1.equals(d2)
+    assert m1.index.equals(m2.index)
+    assert (m1 - m2).abs().max().max() <= 1
+
+
+def test_get_ts_ratios(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    for table, df in tables.items():
+        backend.write_table(table, df)
+
+    a1 = AlloUsage(from_date, to_date, backend=backend)
+    ts1 = a1.get_ts_ratios(['Usage', 'MeteredAllo'], 'M', ['RecordNumber'], [0.1, 2])
+    usage_base = a1.usage_crc_base
+
+    a2 = AlloUsage(from_date, to_date, backend=backend)
+    ts2 = a2.get_ts(['Usage', 'MeteredAllo'], 'M', ['RecordNumber'], usage_allo_ratio=0.1)
+    ts3 = a2.get_ts(['Usage', 'MeteredAllo'], 'M', ['RecordNumber'], usage_allo_ratio=2)
+
+    assert ts1.loc[0.1].equals(ts2)
+    assert ts1.loc[2].equals(ts3)
+    assert a1.usage_crc_base is usage_base
+    assert ts2.TotalUsage.sum() < ts3.TotalUsage.sum()
+
+
+def test_lf_agg(tmp_path):
+    lf_dates = pd.date_range('2016-06-20', '2017-07-10').astype(str)
+    lf2 = pd.DataFrame({'RecordNumber': ['CRC000001', 'CRC000002'] * len(lf_dates) * 2, 'AllocationBlock': 'A', 'RestrDate': list(lf_dates.repeat(2)) * 2, 'Allocation': [(i * 7) % 11 * 10 for i in range(len(lf_dates) * 4)]})
+
+    pq_dir = str(tmp_path)
+    for path in [os.path.join(pq_dir, 'allo_usage.sqlite'), pq_dir]:
+        backend = LocalBackend(path)
+        backend.write_table(param.lf_table, lf2)
+        for freq in ['D', 'W', 'M', 'A-JUN', 'A']:
+            lf3 = backend.rd_lf_agg(['CRC000001', 'CRC000002'], from_date, to_date, freq).sort_values(['RecordNumber', 'Date']).reset_index(drop=True)
+            lf4 = lf_agg(backend.rd_lf(['CRC000001', 'CRC000002'], from_date, to_date), freq)
+
+            assert lf3['RecordNumber'].equals(lf4['RecordNumber'])
+            assert lf3['Date'].equals(lf4['Date'])
+            assert np.allclose(lf3['Allocation'], lf4['Allocation'])
+
+    d1 = lf_agg(lf2, 'D')
+
+    assert len(d1) == len(lf_dates) * 2
+    assert (d1.Allocation <= lf2.groupby(['RecordNumber', 'RestrDate']).Allocation.max().values).all()
+
+
+def test_filter_pushdown(tmp_path):
+    tables1 = synthetic.gen_tables(300, seed=4)
+    site_filter = {'CatchmentGroupName': ['Catchment2', 'Catchment4']}
+
+    ## The filters in pandas on the whole tables
+    allo1 = tables1[param.allo_table].copy()
+    days = (allo1.ToDate - allo1.FromDate).dt.days
+    allo1 = allo1[allo1.ConsentStatus.isin(param.status_codes) & (allo1.WaterUse != 'hydroelectric') & (days > 10) & (allo1.FromDate < to_date) & (allo1.ToDate > from_date)]
+    sites1 = tables1[param.site_table]
+    waps = sites1.loc[sites1.CatchmentGroupName.isin(site_filter['CatchmentGroupName']), 'ExtSiteID']
+    allo1 = allo1[allo1.ExtSiteID.isin(waps)]
+
+    pq_dir = str(tmp_path)
+    for path in [os.path.join(pq_dir, 'allo_usage.sqlite'), pq_dir]:
+        backend = LocalBackend(path)
+        for table, df in tables1.items():
+            backend.write_table(table, df)
+
+        allo2 = filters.rd_allo(from_date, to_date, backend=backend, site_filter=site_filter)
+        sites2 = backend.rd_sites(site_filter, waps_only=True)
+
+        assert len(allo2) == len(allo1)
+        assert set(allo2.index.get_level_values('RecordNumber')).issubset(allo1.RecordNumber)
+        assert allo2.AllocatedRate.sum() == allo1.AllocatedRate.sum()
+        assert len(sites2) == len(waps)
+
+    ## The site table is only read once
+    rd_sites = backend.rd_sites
+    calls = []
+    backend.rd_sites = lambda *args, **kwargs: calls.append(args) or rd_sites(*args, **kwargs)
+    a1 = AlloUsage(from_date, to_date, backend=backend, site_filter=site_filter)
+
+    assert len(allo1) > 0
+    assert len(a1.allo) == len(allo1)
+    assert len(calls) == 1
+
+
+def test_mssql_empty_where_in():
+    ## These return before connecting, as an empty IN () is an error in SQL Server
+    backend = MssqlBackend()
+    lf1 = backend.rd_lf_agg([], from_date, to_date, 'M')
+    ts1 = backend.rd_ts_agg([], [12], from_date, to_date, 'M')
+    allo1 = backend.rd_allo(status=param.status_codes, site_where_in={'CatchmentGroupName': ['Ashley']}, sites=pd.DataFrame(columns=['ExtSiteID']))
+
+    assert lf1.empty
+    assert list(lf1.columns) == ['RecordNumber', 'Date', 'Allocation']
+    assert ts1.empty
+    assert list(ts1.columns) == ['Wap', 'Date', 'TotalUsage']
+    assert allo1.empty
+    assert list(allo1.columns) == param.allo_cols
+
+
+def test_backend_usage_agg(tmp_path):
+    tables1 = synthetic.gen_tables(100, seed=5)
+    ds = ['Usage', 'MeteredAllo']
+
+    pq_dir = str(tmp_path)
+    for path in [os.path.join(pq_dir, 'allo_usage.sqlite'), pq_dir]:
+        backend = LocalBackend(path)
+        for table, df in tables1.items():
+            backend.write_table(table, df)
+
+        a1 = AlloUsage('2018-07-01', '2019-06-30', backend=backend)
+        a2 = AlloUsage('2018-07-01', '2019-06-30', backend=backend, backend_usage_agg=True, prefetch=True)
+        for freq in ['D', 'M', 'A-JUN']:
+            ts1 = a1.get_ts(ds, freq, ['Wap'])
+            ts2 = a2.get_ts(ds, freq, ['Wap'])
+
+            assert ts1.index.equals(ts2.index)
+            assert (ts1 - ts2).abs().max().max() <= 1
+
+        ## Without any metered Waps
+        backend.write_table(param.ts_summ_table, tables1[param.ts_summ_table].assign(DatasetTypeID=1))
+        e1 = AlloUsage('2018-07-01', '2019-06-30', backend=backend).get_ts(['Allo', 'Usage'], 'M', ['Wap'])
+        e2 = AlloUsage('2018-07-01', '2019-06-30', backend=backend, backend_usage_agg=True).get_ts(['Allo', 'Usage'], 'M', ['Wap'])
+
+        assert e1.equals(e2)
+        assert 'TotalUsage' in e2
+
+    errors = []
+    for kwargs in [{'spike_method': 'mad'}, {'daily_base': True}]:
+        try:
+            AlloUsage('2018-07-01', '2019-06-30', backend=backend, backend_usage_agg=True, **kwargs)
+        except ValueError:
+            errors.append(kwargs)
+
+    assert not hasattr(a2, 'usage_ts_daily')
+    assert len(errors) == 2
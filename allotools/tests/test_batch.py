@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import pandas as pd
+from allotools import AlloUsage, synthetic, batch
+
+####################################
+### Run tests
+
+
+def test_batch(tmp_path):
+    path = str(tmp_path)
+    data_path = os.path.join(path, 'data.sqlite')
+    backend = synthetic.gen_backend(data_path, n_consents=100, n_years=2, n_catchments=4, seed=1)
+
+    config = {'from_date': '2017-07-01', 'to_date': '2019-06-30', 'local_path': data_path, 'export_path': os.path.join(path, 'output'), 'n_procs': 2,
+              'jobs': [{'name': 'c0', 'filter': {'CatchmentGroupName': ['Catchment0']}, 'ts': [{'datasets': ['Allo', 'Usage'], 'freq': 'A-JUN', 'groupby': ['CatchmentName'], 'usage_allo_ratio': 10}], 'plots': [{'kind': 'group', 'freq': 'A-JUN', 'group': 'CatchmentName', 'with_restr': False, 'engine': 'matplotlib'}]},
+                       {'name': 'c2_2019', 'filter': {'CatchmentGroupName': ['Catchment2']}, 'from_date': '2018-07-01', 'ts': [{'datasets': ['Allo', 'RestrAllo'], 'freq': 'M', 'groupby': ['WaterUse']}]}]}
+    config_path = os.path.join(path, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+
+    code = batch.main([config_path])
+
+    ts1 = pd.read_csv(os.path.join(path, 'output', 'c0', 'c0_A-JUN_CatchmentName.csv'), index_col=['CatchmentName', 'Date'])
+    ts2 = pd.read_csv(os.path.join(path, 'output', 'c2_2019', 'c2_2019_M_WaterUse.csv'), index_col=['WaterUse', 'Date'], parse_dates=['Date'])
+
+    a1 = AlloUsage('2017-07-01', '2019-06-30', site_filter={'CatchmentGroupName': ['Catchment0']}, backend=backend)
+    ts3 = a1.get_ts(['Allo', 'Usage'], 'A-JUN', ['CatchmentName'], usage_allo_ratio=10)
+
+    a2 = AlloUsage('2018-07-01', '2019-06-30', site_filter={'CatchmentGroupName': ['Catchment2']}, backend=backend)
+    ts4 = a2.get_ts(['Allo', 'RestrAllo'], 'M', ['WaterUse'])
+
+    n_plots = len([p for p in os.listdir(os.path.join(path, 'output', 'c0')) if p.endswith('.png')])
+
+    assert code == 0
+    assert (ts1.values == ts3.values).all()
+    assert (ts2.values == ts4.values).all()
+    assert ts2.index.get_level_values('Date').min() >= pd.Timestamp('2018-07-01')
+    assert n_plots > 0
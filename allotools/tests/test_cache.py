@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import warnings
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from allotools import cache
+
+#################################
+### Parameters
+
+ts_data = pd.DataFrame({'ExtSiteID': ['J36/0001', 'J36/0001', 'J36/0002', 'J36/0003'], 'DateTime': pd.to_datetime(['2018-07-01', '2018-07-02', '2018-07-01', '2018-07-02']), 'Value': [1.0, 2.0, 3.0, 4.0]})
+
+####################################
+### Run tests
+
+
+def _add_entries(cache_dir, prefix, n):
+    for i in range(n):
+        with cache._index_lock(cache_dir):
+            index1 = cache._rd_index(cache_dir)
+            index1[prefix + str(i)] = {'size': 0}
+            cache._wr_index(cache_dir, index1)
+
+
+def test_rd_sql_cache(tmp_path, monkeypatch):
+    queries = []
+
+    def rd_sql(server, database, table, col_names=None, where_in=None, from_date=None, to_date=None, date_col=None, stmt=None):
+        queries.append(table)
+        if stmt is not None:
+            return ts_data.groupby('ExtSiteID', as_index=False)['Value'].sum()
+        df = ts_data
+        if where_in is not None:
+            df = df[df.ExtSiteID.isin(where_in['ExtSiteID'])]
+        return df[col_names].reset_index(drop=True)
+
+    monkeypatch.setattr('pdsql.mssql.rd_sql', rd_sql)
+    cache_dir = str(tmp_path)
+    cols = ['ExtSiteID', 'DateTime', 'Value']
+
+    ## Exact and superset hits
+    df1 = cache.rd_sql('server', 'db', 'ts', cols, cache_dir=cache_dir)
+    df2 = cache.rd_sql('server', 'db', 'ts', cols, cache_dir=cache_dir)
+    df3 = cache.rd_sql('server', 'db', 'ts', ['ExtSiteID', 'Value'], {'ExtSiteID': ['J36/0001']}, from_date='2018-07-02', date_col='DateTime', cache_dir=cache_dir)
+
+    assert len(queries) == 1
+    assert df1.equals(df2)
+    assert df3.Value.tolist() == [2.0]
+
+    ## Refresh and eviction
+    cache.rd_sql('server', 'db', 'ts', cols, cache_dir=cache_dir, refresh=True)
+    cache.rd_sql('server', 'db', 'ts2', cols, cache_dir=cache_dir, max_size=1)
+    cache.rd_sql('server', 'db', 'ts', cols, cache_dir=cache_dir, ttl=0)
+
+    assert queries == ['ts', 'ts', 'ts2', 'ts']
+    assert len(cache._rd_index(cache_dir)) == 1
+
+    ## Custom statements are only reused for the same statement
+    stmt = 'SELECT ExtSiteID, SUM(Value) AS Value FROM ts GROUP BY ExtSiteID'
+    df4 = cache.rd_sql('server', 'db', 'ts', stmt=stmt, cache_dir=cache_dir)
+    df5 = cache.rd_sql('server', 'db', 'ts', stmt=stmt, cache_dir=cache_dir)
+    cache.rd_sql('server', 'db', 'ts', cols, cache_dir=cache_dir)
+
+    assert queries == ['ts', 'ts', 'ts2', 'ts', 'ts']
+    assert df4.equals(df5)
+    assert len(df4) == 3
+    assert len(cache._rd_index(cache_dir)) == 2
+
+
+def test_filter_cached():
+    meta = cache._query_meta('server', 'db', 'ts', ['ExtSiteID', 'Value'], {'ExtSiteID': ['J36/0001', 'J36/0003']}, '2018-07-02', '2018-07-02', 'DateTime')
+
+    ## The filters shouldn't index with a mask of the unfiltered rows
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UserWarning)
+        df1 = cache._filter_cached(ts_data, meta)
+
+    assert df1.Value.tolist() == [2.0, 4.0]
+    assert list(df1.columns) == ['ExtSiteID', 'Value']
+
+
+def test_index_lock(tmp_path):
+    cache_dir = str(tmp_path)
+
+    ## Every process reads, modifies, and writes the same index
+    with ProcessPoolExecutor(4) as executor:
+        futures = [executor.submit(_add_entries, cache_dir, p, 50) for p in ['a', 'b', 'c', 'd']]
+        [f.result() for f in futures]
+
+    assert len(cache._rd_index(cache_dir)) == 200
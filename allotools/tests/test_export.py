@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import os
+import pandas as pd
+from allotools import AlloUsage, synthetic, export
+
+#################################
+### Parameters
+
+datasets = ['Allo', 'RestrAllo', 'MeteredAllo', 'MeteredRestrAllo', 'Usage']
+
+####################################
+### Run tests
+
+
+def test_export_ts(tmp_path):
+    path = str(tmp_path)
+    backend = synthetic.gen_backend(os.path.join(path, 'data.sqlite'), n_consents=100, n_years=2, n_catchments=4, seed=1)
+
+    a1 = AlloUsage('2017-07-01', '2019-06-30', backend=backend)
+    ts1 = a1.get_ts(datasets, 'M', ['CatchmentGroupName', 'WaterUse'])
+
+    paths1 = a1.export_ts(os.path.join(path, 'ts'), datasets, 'M', ['CatchmentGroupName', 'WaterUse'])
+    ts2 = export.rd_ts(paths1[0]).set_index(['CatchmentGroupName', 'WaterUse', 'Date'])[ts1.columns].sort_index()
+    ts3 = export.rd_ts(paths1[0], [('WaterYear', '=', 2019), ('CatchmentGroupName', 'in', ['Catchment0'])])
+
+    paths2 = a1.export_ts(os.path.join(path, 'tables'), ['Allo', 'Usage'], 'A-JUN', format='arrow')
+    allo1 = export.rd_ts(paths2[0], format='arrow')
+
+    assert len(paths1) == 1
+    assert ts2.equals(ts1)
+    assert (ts3.WaterYear == 2019).all()
+    assert (ts3.CatchmentGroupName == 'Catchment0').all()
+    assert paths2[0].endswith('allo_ts')
+    assert isinstance(allo1.RecordNumber.dtype, pd.CategoricalDtype)
+    assert allo1.TotalAllo.sum() == ts1.TotalAllo.sum()
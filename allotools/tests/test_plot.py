@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import matplotlib.image as mpimg
+from allotools import AlloUsage, synthetic
+
+#################################
+### Parameters
+
+datasets = ['Allo', 'RestrAllo', 'MeteredAllo', 'MeteredRestrAllo', 'Usage']
+
+####################################
+### Run tests
+
+
+def test_plots(tmp_path):
+    export_path = str(tmp_path)
+    backend = synthetic.gen_backend(os.path.join(export_path, 'data.sqlite'), n_consents=100, n_years=2, n_catchments=4, seed=1)
+
+    a1 = AlloUsage('2017-07-01', '2019-06-30', backend=backend)
+    ts1 = a1.get_ts(datasets, 'A-JUN', ['CatchmentName', 'Date'])
+
+    paths1 = a1.plot_group('A-JUN', group='CatchmentName', export_path=export_path, ts=ts1, n_procs=2)
+    paths2 = a1.plot_stacked('A-JUN', group='CatchmentName', export_path=export_path)
+
+    assert len(paths1) == 4
+    assert len(paths2) == 4
+    assert all(os.path.isfile(p) for p in paths1 + paths2)
+
+
+def test_plot_engines(tmp_path):
+    export_path = str(tmp_path)
+    backend = synthetic.gen_backend(os.path.join(export_path, 'data.sqlite'), n_consents=100, n_years=2, n_catchments=4, seed=1)
+
+    a1 = AlloUsage('2017-07-01', '2019-06-30', backend=backend)
+    ts1 = a1.get_ts(datasets, 'A-JUN', ['CatchmentName', 'Date'])
+
+    images = {}
+    for engine in ['seaborn', 'matplotlib']:
+        os.makedirs(os.path.join(export_path, engine))
+        paths1 = a1.plot_group('A-JUN', group='CatchmentName', export_path=os.path.join(export_path, engine), ts=ts1, engine=engine)
+        paths2 = a1.plot_stacked('A-JUN', group='CatchmentName', export_path=os.path.join(export_path, engine), engine=engine)
+        images[engine] = [mpimg.imread(p) for p in paths1 + paths2]
+
+    assert len(images['matplotlib']) == 8
+    assert all(np.array_equal(i1, i2) for i1, i2 in zip(images['seaborn'], images['matplotlib']))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+from allotools import AlloUsage, synthetic, benchmark
+
+#################################
+### Parameters
+
+n_consents = 50
+n_years = 1
+datasets = ['Allo', 'RestrAllo', 'MeteredAllo', 'MeteredRestrAllo', 'Usage']
+
+####################################
+### Run tests
+
+
+def test_gen_tables():
+    tables1 = synthetic.gen_tables(n_consents, n_years, seed=1)
+    tables2 = synthetic.gen_tables(n_consents, n_years, seed=1)
+    tables3 = synthetic.gen_tables(n_consents, n_years, seed=2)
+
+    allo_table = list(tables1)[0]
+
+    assert all(df.equals(tables2[t]) for t, df in tables1.items())
+    assert not tables1[allo_table].equals(tables3[allo_table])
+    assert tables1[allo_table].RecordNumber.nunique() == n_consents
+
+
+def test_benchmark(tmp_path):
+    results = benchmark.run(n_consents, n_years, freqs=['M'], plots=False, path=str(tmp_path))
+    baseline_path = os.path.join(str(tmp_path), 'baseline.json')
+    benchmark.save_baseline(results, baseline_path)
+    comp1 = benchmark.compare(results, baseline_path)
+
+    assert len(results) == 7
+    assert (results['time'] > 0).all()
+    assert ((comp1['time_ratio'] - 1).abs() < 0.000001).all()
+    assert (~comp1['regression']).all()
+
+
+def test_lazy_imports():
+    time1, loaded = benchmark.import_time(repeat=1)
+
+    assert time1 > 0
+    assert loaded == []
+
+
+def test_get_ts_partitioned(tmp_path):
+    backend = synthetic.gen_backend(str(tmp_path), n_consents=200, n_years=n_years, seed=1)
+
+    a1 = AlloUsage('2018-07-01', '2019-06-30', backend=backend)
+    ts1 = a1.get_ts(datasets, 'M', ['RecordNumber', 'Wap'])
+    ts2 = a1.get_ts_partitioned(datasets, 'M', ['RecordNumber', 'Wap'], partition='CatchmentName', n_procs=2)
+    ts3 = a1.get_ts_partitioned(datasets, 'A-JUN', ['CwmsName'], partition='WaterUse', n_procs=2)
+
+    assert ts1.equals(ts2)
+    assert ts3.equals(a1.get_ts(datasets, 'A-JUN', ['CwmsName']))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pandas as pd
+from allotools import AlloUsage, synthetic, parameters as param
+from allotools.backends import LocalBackend
+from allotools import usage
+from allotools.usage import remove_spikes, prep_usage, update_usage_store, iter_usage, usage_allo_ratio
+
+#################################
+### Parameters
+
+dates = pd.date_range('2018-07-01', '2018-07-10')
+tsdata = pd.DataFrame({'Wap': ['J36/0001'] * 10 + ['J36/0002'] * 10, 'Date': np.tile(dates, 2), 'TotalUsage': [10.0] * 20})
+tsdata.loc[[4, 10, 15], 'TotalUsage'] = 100
+
+ts_dates = pd.date_range('2018-07-01', '2018-08-31')
+ts = pd.DataFrame({'ExtSiteID': np.repeat(['J36/0001', 'J36/0002'], len(ts_dates)), 'DatasetTypeID': 12, 'DateTime': np.tile(ts_dates, 2), 'Value': np.tile(np.arange(len(ts_dates), dtype='float64'), 2)})
+ts.loc[ts.DateTime.isin(['2018-07-31', '2018-08-01', '2018-08-20']), 'Value'] = 500
+
+####################################
+### Run tests
+
+
+def test_remove_spikes():
+    shift1 = remove_spikes(tsdata, 'shift')
+    mad1 = remove_spikes(tsdata, 'mad')
+
+    ## The shift filter can't assess the first value of a Wap, so it shouldn't be compared to the previous Wap
+    assert shift1.TotalUsage.iloc[10] == 100
+    assert shift1.TotalUsage.sum() == 290
+    assert mad1.TotalUsage.sum() == 200
+
+
+def test_update_usage_store(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    backend.write_table(param.ts_table, ts)
+    store_path = os.path.join(str(tmp_path), 'store')
+
+    update_usage_store(store_path, backend, ['J36/0001'], [12], '2018-07-01', '2018-07-31', 'mad')
+    update_usage_store(store_path, backend, ['J36/0001', 'J36/0002'], [12], '2018-07-01', '2018-08-15', 'mad')
+    store1 = update_usage_store(store_path, backend, ['J36/0001', 'J36/0002'], [12], '2018-07-01', '2018-08-31', 'mad')
+
+    all1 = prep_usage(ts, 'mad')
+
+    assert store1.equals(all1)
+
+
+def test_update_usage_store_window(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    backend.write_table(param.ts_table, ts)
+    store_path = os.path.join(str(tmp_path), 'store')
+
+    reads = []
+    rd_ts = backend.rd_ts
+    def rd_ts_count(waps, dataset_types, from_date=None, to_date=None):
+        reads.append((list(waps), from_date, to_date))
+        return rd_ts(waps, dataset_types, from_date, to_date)
+    backend.rd_ts = rd_ts_count
+
+    ## Extend the window on both sides with a Wap that has no data
+    update_usage_store(store_path, backend, ['J36/0001', 'J36/0003'], [12], '2018-07-20', '2018-08-10', 'mad')
+    store1 = update_usage_store(store_path, backend, ['J36/0001', 'J36/0003'], [12], '2018-07-01', '2018-08-31', 'mad')
+    n_reads = len(reads)
+    store2 = update_usage_store(store_path, backend, ['J36/0001', 'J36/0003'], [12], '2018-07-05', '2018-08-31', 'mad')
+
+    ## Other dataset types are kept apart
+    store3 = update_usage_store(store_path, backend, ['J36/0001'], [9], '2018-07-01', '2018-08-31', 'mad')
+
+    all1 = prep_usage(ts[ts.ExtSiteID == 'J36/0001'], 'mad')
+
+    assert store1.equals(all1)
+    assert len(reads) == n_reads + 1
+    assert store2.equals(all1[all1.Date >= '2018-07-05'].reset_index(drop=True))
+    assert store3.empty
+
+
+def test_iter_usage_store(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    backend.write_table(param.ts_table, ts)
+    store_path = os.path.join(str(tmp_path), 'store')
+    data_path = os.path.join(store_path, usage.store_dir.format('12'))
+
+    update_usage_store(store_path, backend, ['J36/0001', 'J36/0002'], [12], '2018-07-01', '2018-07-31', 'mad')
+    mtime1 = os.stat(usage._store_wap_path(data_path, 'J36/0001')).st_mtime_ns
+
+    ## Only the files of the updated Waps are written
+    update_usage_store(store_path, backend, ['J36/0002'], [12], '2018-07-01', '2018-08-31', 'mad')
+
+    chunks = list(iter_usage(backend, ['J36/0001', 'J36/0002'], [12], '2018-07-01', '2018-07-31', 1, 'mad', store_path=store_path))
+    all1 = update_usage_store(store_path, backend, ['J36/0001', 'J36/0002'], [12], '2018-07-01', '2018-07-31', 'mad')
+
+    assert os.stat(usage._store_wap_path(data_path, 'J36/0001')).st_mtime_ns == mtime1
+    assert [c.Wap.unique().tolist() for c in chunks] == [['J36/0001'], ['J36/0002']]
+    assert pd.concat(chunks).reset_index(drop=True).equals(all1)
+
+
+def test_update_usage_store_no_waps(tmp_path):
+    backend = synthetic.gen_backend(os.path.join(str(tmp_path), 'allo_usage.sqlite'), n_consents=50, metered_frac=0, seed=1)
+    store_path = os.path.join(str(tmp_path), 'store')
+
+    store1 = update_usage_store(store_path, backend, [], [12], '2018-07-01', '2019-06-30')
+
+    a1 = AlloUsage('2018-07-01', '2019-06-30', backend=backend, usage_store=store_path)
+    ts1 = a1.get_ts(['Allo', 'Usage'], 'M', ['Wap'])
+    ts2 = AlloUsage('2018-07-01', '2019-06-30', backend=backend).get_ts(['Allo', 'Usage'], 'M', ['Wap'])
+
+    assert store1.empty
+    assert list(store1.columns) == ['Wap', 'Date', 'TotalUsage']
+    assert len(ts1) > 0
+    assert ts1.equals(ts2)
+
+
+def test_usage_allo_ratio():
+    usage_dates = pd.date_range('2017-05-01', '2018-08-31', freq='M')
+    usage1 = pd.DataFrame({'RecordNumber': np.repeat(['CRC1', 'CRC2', 'CRC3'], len(usage_dates)), 'AllocationBlock': 'A', 'Date': np.tile(usage_dates, 3), 'TotalAllo': np.repeat([100.0, 100.0, 0.0], len(usage_dates)), 'TotalUsage': np.repeat([50.0, 300.0, 10.0], len(usage_dates))})
+    usage1.loc[3, 'TotalUsage'] = np.nan
+    usage1 = usage1.sample(frac=1, random_state=1)
+
+    ratio1 = pd.Series(usage_allo_ratio(usage1), index=usage1.index)
+
+    ## The old transform of the water year totals
+    t1 = usage1.set_index('Date').groupby(['RecordNumber', 'AllocationBlock', pd.Grouper(freq='A-JUN')])[['TotalAllo', 'TotalUsage']].transform('sum')
+    flags = [(t1['TotalUsage'] > (t1['TotalAllo'] * r)).values for r in [1, 2, 5]]
+
+    assert all(np.array_equal(f, (ratio1 > r).values) for f, r in zip(flags, [1, 2, 5]))
+    assert np.isclose(ratio1.loc[0], 0.5)
+    assert np.isclose(ratio1.loc[4], 50 * 11 / 1200)
+    assert np.isinf(ratio1[usage1.RecordNumber == 'CRC3']).all()
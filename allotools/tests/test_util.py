@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from allotools import util
+
+#################################
+### Parameters
+
+dates = pd.date_range('2016-06-20', '2019-07-10', freq='D')
+n_sites = 5
+
+####################################
+### Run tests
+
+
+def test_period_agg():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'Wap': np.tile(['W' + str(i) for i in range(n_sites)], len(dates)), 'Date': np.repeat(dates, n_sites), 'Value': rng.random(len(dates) * n_sites), 'Other': rng.random(len(dates) * n_sites)})
+    df = df.sample(frac=0.5, random_state=1)
+    df['Wap'] = df['Wap'].astype('category')
+
+    for freq in ['D', 'W', 'M', 'A-JUN', 'A-Jun', 'A']:
+        grp1 = df.set_index('Date').groupby(['Wap', pd.Grouper(freq=freq)], observed=True)
+
+        assert grp1.sum().sort_index().equals(util.period_agg(df, 'Wap', 'Date', freq).sort_index())
+        assert grp1.agg({'Value': 'min', 'Other': 'mean'}).sort_index().equals(util.period_agg(df, 'Wap', 'Date', freq, {'Value': 'min', 'Other': 'mean'}).sort_index())
+
+        ## grp_ts_agg groups the same as the old pd.Grouper for categorical and object Waps, including unobserved categories
+        for df1 in [df, df.astype({'Wap': str})]:
+            grp2 = df1.set_index('Date').groupby(['Wap', pd.Grouper(freq=freq)])
+            grp3 = util.grp_ts_agg(df1, 'Wap', 'Date', freq)
+
+            assert isinstance(grp3, pd.core.groupby.DataFrameGroupBy)
+            assert grp2.sum().equals(grp3.sum())
+            assert grp2.mean().equals(grp3.mean())
+
+    ## Any other freq is resampled with a pd.Grouper
+    grp3 = util.grp_ts_agg(df, 'Wap', 'Date', '2M').sum()
+
+    assert len(df.columns) == 4
+    assert grp3.index.names == ['Wap', 'Date']
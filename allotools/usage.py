@@ -4,9 +4,380 @@ Created on Sat Feb 16 08:51:31 2019
 
 @author: michaelek
 """
+import os
+import json
+import shutil
+from urllib.parse import quote
 import numpy as np
 import pandas as pd
-from allotools.filters import allo_filter
+import pyarrow as pa
+import pyarrow.dataset as ds
+from allotools.allocation_ts import period_codes
+
+#####################################
+### Parameters
+
+## The store has a directory per dataset types partitioned by Wap (one file per Wap)
+store_dir = 'usage_daily_{}'
+store_wap_file = 'part-0.parquet'
+store_meta_file = 'usage_daily_meta.json'
+usage_cols = ['Wap', 'Date', 'TotalUsage']
 
 #####################################
 ### Functions
+
+
+def remove_spikes(tsdata, method='shift', id_col='Wap', date_col='Date', val_col='TotalUsage', min_diff=2, window=7, n_mad=5):
+    """
+    Function to remove individual upward spikes from daily time series. Each site is filtered independently so that the filter never runs across the boundary between two sites.
+
+    Parameters
+    ----------
+    tsdata : DataFrame
+        Long format DataFrame with the id_col, date_col, and val_col.
+    method : str or None
+        Either 'shift' or 'mad'. 'shift' replaces a value with the mean of its two neighbours when it is greater than the sum of its neighbours plus min_diff. 'mad' replaces a value with the centred rolling median when it is greater than the median plus n_mad scaled median absolute deviations and more than min_diff above the median. None returns the input.
+    id_col : str
+        The site column.
+    date_col : str
+        The date column.
+    val_col : str
+        The value column to be filtered.
+    min_diff : int or float
+        The minimum difference for a value to be considered a spike.
+    window : int
+        The rolling window size in days for the 'mad' method.
+    n_mad : int or float
+        The number of scaled median absolute deviations above the median for the 'mad' method.
+
+    Returns
+    -------
+    DataFrame
+        sorted by id_col and date_col
+    """
+    if method is None:
+        return tsdata
+
+    tsdata1 = tsdata.sort_values([id_col, date_col]).reset_index(drop=True)
+    val1 = tsdata1[val_col].values.astype('float64')
+
+    if method == 'shift':
+        ids = tsdata1[id_col].values
+        same1 = np.zeros(len(ids), dtype=bool)
+        same1[1:-1] = (ids[1:-1] == ids[:-2]) & (ids[1:-1] == ids[2:])
+
+        prev1 = np.full(len(val1), np.nan)
+        prev1[1:] = val1[:-1]
+        next1 = np.full(len(val1), np.nan)
+        next1[:-1] = val1[1:]
+
+        with np.errstate(invalid='ignore'):
+            spikes = same1 & (val1 > (prev1 + next1 + min_diff))
+        val1[spikes] = ((prev1 + next1)/2)[spikes]
+
+    elif method == 'mad':
+        grp = tsdata1.groupby(id_col, sort=False)[val_col]
+        med1 = grp.rolling(window, center=True, min_periods=1).median().values
+        dev1 = pd.Series(np.abs(val1 - med1), index=tsdata1.index).groupby(tsdata1[id_col], sort=False)
+        mad1 = dev1.rolling(window, center=True, min_periods=1).median().values * 1.4826
+
+        with np.errstate(invalid='ignore'):
+            spikes = (val1 > (med1 + n_mad * mad1)) & ((val1 - med1) > min_diff)
+        val1[spikes] = med1[spikes]
+
+    else:
+        raise ValueError("method must be either 'shift', 'mad', or None")
+
+    tsdata1[val_col] = val1
+
+    return tsdata1
+
+
+def spike_reach(method='shift', window=7, **kwargs):
+    """
+    Function to determine how many days either side of a value can affect its result from remove_spikes.
+
+    Parameters
+    ----------
+    method : str or None
+        The remove_spikes method.
+    window : int
+        The rolling window size in days for the 'mad' method.
+
+    Returns
+    -------
+    int
+    """
+    if method is None:
+        return 0
+    elif method == 'shift':
+        return 1
+    else:
+        return 2 * (window // 2)
+
+
+def prep_usage(tsdata, spike_method='shift', spike_params=None):
+    """
+    Function to clean the raw daily usage data from the ts table. Negative values are set to zero and spikes are removed.
+
+    Parameters
+    ----------
+    tsdata : DataFrame
+        The raw data with the ExtSiteID, DateTime, and Value columns.
+    spike_method : str or None
+        The remove_spikes method.
+    spike_params : dict or None
+        Any kwargs to be passed to remove_spikes.
+
+    Returns
+    -------
+    DataFrame
+        with the Wap, Date, and TotalUsage columns
+    """
+    if spike_params is None:
+        spike_params = {}
+
+    tsdata1 = tsdata.rename(columns={'DateTime': 'Date', 'ExtSiteID': 'Wap', 'Value': 'TotalUsage'})
+    tsdata1['Date'] = pd.to_datetime(tsdata1['Date'])
+
+    ### filter - remove individual spikes and negative values
+    tsdata1.loc[tsdata1['TotalUsage'] < 0, 'TotalUsage'] = 0
+
+    tsdata1 = remove_spikes(tsdata1[usage_cols], spike_method, **spike_params)
+
+    return tsdata1
+
+
+def usage_allo_ratio(usage, grp_cols=['RecordNumber', 'AllocationBlock'], date_col='Date', allo_col='TotalAllo', usage_col='TotalUsage'):
+    """
+    Function to calculate the ratio of the water year (July to June) usage to allocation per grp_cols for every row. The water years are integer codes of the dates and the totals are one grouped reduction that is broadcast back to the rows by the group keys, so the rows can be in any order. Rows with a ratio over a usage_allo_ratio are outliers. Many thresholds can be compared to the same ratios.
+
+    Parameters
+    ----------
+    usage : DataFrame
+        The usage and allocation per grp_cols and date.
+    grp_cols : list of str
+        The columns to total by (with the water year).
+    date_col : str
+        The datetime column.
+    allo_col : str
+        The allocation column.
+    usage_col : str
+        The usage column. NaNs are ignored in the totals.
+
+    Returns
+    -------
+    ndarray of float
+        The ratios in the order of the rows. A water year with usage and no allocation has an infinite ratio and one without either has a NaN ratio.
+    """
+    wy = period_codes(usage[date_col].values, 'A-JUN')
+    keys = [usage[c].values for c in grp_cols] + [wy]
+    grp = pd.MultiIndex.from_arrays(keys).factorize()[0]
+
+    allo_sum = np.bincount(grp, weights=np.nan_to_num(usage[allo_col].values.astype('float64')))
+    usage_sum = np.bincount(grp, weights=np.nan_to_num(usage[usage_col].values.astype('float64')))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (usage_sum / allo_sum)[grp]
+
+    return ratio
+
+
+def empty_usage():
+    """
+    Function to create an empty DataFrame of the cleaned daily usage with the usage_cols.
+    """
+    return pd.DataFrame({'Wap': pd.Series(dtype='object'), 'Date': pd.Series(dtype='datetime64[ns]'), 'TotalUsage': pd.Series(dtype='float64')})
+
+
+def _store_wap_path(data_path, wap):
+    """
+    Function to get the path of the file of a Wap in the store. The Wap is percent encoded in the hive partition directory like pyarrow does.
+    """
+    return os.path.join(data_path, 'Wap=' + quote(wap, safe=''), store_wap_file)
+
+
+def _rd_store(data_path, waps):
+    """
+    Function to read the stored daily usage of the Waps. Only the files of the Waps are read.
+    """
+    paths = [_store_wap_path(data_path, w) for w in waps]
+    paths = [p for p in paths if os.path.isfile(p)]
+    if not paths:
+        return empty_usage()
+
+    partitioning = ds.partitioning(pa.schema([('Wap', pa.string())]), flavor='hive')
+    df = ds.dataset(paths, format='parquet', partitioning=partitioning, partition_base_dir=data_path).to_table().to_pandas()
+
+    return df[usage_cols]
+
+
+def _wr_store(data_path, df):
+    """
+    Function to write the daily usage of the Waps in df to the store, replacing the old files of those Waps. The files are written to a temp directory first and then moved over the old ones so that a failed write doesn't corrupt the store.
+    """
+    temp_path = data_path + '.tmp'
+    if os.path.isdir(temp_path):
+        shutil.rmtree(temp_path)
+
+    partitioning = ds.partitioning(pa.schema([('Wap', pa.string())]), flavor='hive')
+    ds.write_dataset(pa.Table.from_pandas(df[usage_cols], preserve_index=False), temp_path, format='parquet', partitioning=partitioning, basename_template='part-{i}.parquet')
+
+    for wap in df['Wap'].unique():
+        path1 = _store_wap_path(data_path, wap)
+        os.makedirs(os.path.dirname(path1), exist_ok=True)
+        os.replace(_store_wap_path(temp_path, wap), path1)
+    shutil.rmtree(temp_path)
+
+
+def update_usage_store(store_path, backend, waps, dataset_types, from_date, to_date, spike_method='shift', spike_params=None, overlap=14):
+    """
+    Function to incrementally update a local store of the cleaned daily usage data and return the requested data. The data is stored in a file per Wap and only the files of the requested Waps are read and only the files of the Waps with new data are written, so the memory and I/O scale with the Waps rather than the whole store. The store meta keeps the from and to dates that have already been read per dataset types and Wap, and only the dates outside of that window are read from the backend. Waps without any data in the window are not read again. The overlap is read and cleaned again with the new data on either side of the window so that the spike filter is correct at the seams. The store is rebuilt if the spike method or parameters change.
+
+    Parameters
+    ----------
+    store_path : str
+        The path to the store directory.
+    backend : Backend
+        The data source.
+    waps : list of str
+        The Waps to return.
+    dataset_types : list of int
+        The DatasetTypeIDs of the ts table.
+    from_date : str
+        The start date.
+    to_date : str
+        The end date.
+    spike_method : str or None
+        The remove_spikes method.
+    spike_params : dict or None
+        Any kwargs to be passed to remove_spikes.
+    overlap : int
+        The number of days inside the stored window to read and clean again. Must be at least twice spike_reach.
+
+    Returns
+    -------
+    DataFrame
+        with the Wap, Date, and TotalUsage columns
+    """
+    if spike_params is None:
+        spike_params = {}
+    reach = spike_reach(spike_method, **spike_params)
+    if overlap < (2 * reach):
+        raise ValueError('overlap must be at least ' + str(2 * reach) + ' days for this spike method')
+
+    stored = empty_usage()
+    ## e.g. a filter without any metered Waps
+    if len(waps) == 0:
+        return stored
+
+    from_date1 = pd.Timestamp(from_date).normalize()
+    to_date1 = pd.Timestamp(to_date).normalize()
+    overlap1 = pd.Timedelta(days=overlap)
+    reach1 = pd.Timedelta(days=reach)
+
+    if not os.path.isdir(store_path):
+        os.makedirs(store_path)
+    types_key = '-'.join(str(t) for t in sorted(set(dataset_types)))
+    data_path = os.path.join(store_path, store_dir.format(types_key))
+    meta_path = os.path.join(store_path, store_meta_file)
+
+    ### Read the store
+    meta = {'spike_method': spike_method, 'spike_params': spike_params, 'windows': {}}
+    if os.path.isfile(meta_path):
+        with open(meta_path) as f:
+            old_meta = json.load(f)
+        if (old_meta.get('spike_method') == spike_method) and (old_meta.get('spike_params') == spike_params) and ('windows' in old_meta):
+            meta = old_meta
+    if (types_key in meta['windows']) and os.path.isdir(data_path):
+        stored = _rd_store(data_path, [w for w in waps if w in meta['windows'][types_key]])
+    else:
+        meta['windows'][types_key] = {}
+        if os.path.isdir(data_path):
+            shutil.rmtree(data_path)
+        os.makedirs(data_path)
+    windows = meta['windows'][types_key]
+
+    ### Determine the dates to read per Wap
+    ## Each read is the fetch dates and the dates of the cleaned results to keep
+    win = pd.DataFrame([windows.get(w, [None, None]) for w in waps], index=waps, columns=['from', 'to'], dtype='object').apply(pd.to_datetime)
+    new = win['from'].isnull()
+    before = ~new & (win['from'] > from_date1)
+    after = ~new & (win['to'] < to_date1)
+
+    fetch_lst = [pd.DataFrame({'fetch_from': from_date1, 'fetch_to': to_date1, 'keep_from': from_date1, 'keep_to': to_date1}, index=win.index[new])]
+    fetch_lst.append(pd.DataFrame({'fetch_from': from_date1, 'fetch_to': win.loc[before, 'from'] + overlap1, 'keep_from': from_date1, 'keep_to': win.loc[before, 'from'] + overlap1 - reach1}, index=win.index[before]))
+    fetch_lst.append(pd.DataFrame({'fetch_from': win.loc[after, 'to'] - overlap1, 'fetch_to': to_date1, 'keep_from': win.loc[after, 'to'] - overlap1 + reach1, 'keep_to': to_date1}, index=win.index[after]))
+    fetch1 = pd.concat(fetch_lst)
+
+    ### Read and clean the new data
+    new_lst = []
+    for (f_from, f_to, k_from, k_to), grp in fetch1.groupby(['fetch_from', 'fetch_to', 'keep_from', 'keep_to']):
+        ts1 = backend.rd_ts(grp.index.tolist(), dataset_types, str(f_from.date()), str(f_to.date()))
+        if not ts1.empty:
+            ts2 = prep_usage(ts1, spike_method, spike_params)
+            new_lst.append(ts2[(ts2['Date'] >= k_from) & (ts2['Date'] <= k_to)])
+
+    if not fetch1.empty:
+        if new_lst:
+            new1 = pd.concat(new_lst)
+            stored = pd.concat([stored, new1]).drop_duplicates(['Wap', 'Date'], keep='last').sort_values(['Wap', 'Date']).reset_index(drop=True)
+
+            _wr_store(data_path, stored[stored['Wap'].isin(new1['Wap'].unique())])
+
+        ## The windows are updated even when there was no data so that those Waps are not read again
+        for w in fetch1.index.unique():
+            w_from = from_date1 if new[w] else min(win.loc[w, 'from'], from_date1)
+            w_to = to_date1 if new[w] else max(win.loc[w, 'to'], to_date1)
+            windows[w] = [str(w_from.date()), str(w_to.date())]
+
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    tsdata1 = stored[stored['Wap'].isin(waps) & (stored['Date'] >= from_date1) & (stored['Date'] <= to_date1)].reset_index(drop=True)
+
+    return tsdata1
+
+
+def iter_usage(backend, waps, dataset_types, from_date, to_date, chunk_size=500, spike_method='shift', spike_params=None, store_path=None):
+    """
+    Generator to read and clean the daily usage data in chunks of Waps so that only one chunk is in memory at a time. The cleaning is done per Wap, so the results are the same as reading all of the Waps at once.
+
+    Parameters
+    ----------
+    backend : Backend
+        The data source.
+    waps : list of str
+        The Waps to read.
+    dataset_types : list of int
+        The DatasetTypeIDs of the ts table.
+    from_date : str
+        The start date.
+    to_date : str
+        The end date.
+    chunk_size : int
+        The number of Waps per chunk.
+    spike_method : str or None
+        The remove_spikes method.
+    spike_params : dict or None
+        Any kwargs to be passed to remove_spikes.
+    store_path : str or None
+        The path to the usage store (see update_usage_store). None will read the data directly from the backend. Only the files of the Waps of a chunk are read and written.
+
+    Yields
+    ------
+    DataFrame
+        with the Wap, Date, and TotalUsage columns
+    """
+    waps = list(waps)
+    for i in range(0, len(waps), chunk_size):
+        waps1 = waps[i:(i + chunk_size)]
+        if store_path is None:
+            tsdata1 = backend.rd_ts(waps1, dataset_types, from_date, to_date)
+            tsdata1 = prep_usage(tsdata1, spike_method, spike_params)
+        else:
+            tsdata1 = update_usage_store(store_path, backend, waps1, dataset_types, from_date, to_date, spike_method, spike_params)
+
+        if not tsdata1.empty:
+            yield tsdata1
@@ -4,16 +4,71 @@ Created on Tue Oct  2 13:16:41 2018
 
 @author: michaelek
 """
+import json
+import time
+import logging
+import functools
+import tracemalloc
+import numpy as np
 import pandas as pd
+from allotools.allocation_ts import period_codes, period_ends
+
+#########################################
+### Parameters
+
+profile_logger = logging.getLogger('allotools.profile')
+
+## The freq codes that period_agg can do and their period_codes freq
+period_freqs = {'D': 'D', 'W': 'W', 'W-SUN': 'W', 'M': 'M', 'A-JUN': 'A-JUN', 'A': 'A', 'A-DEC': 'A'}
 
 
 #########################################
 ### Functions
 
 
+def period_agg(df, grp_col, ts_col, freq_code, agg='sum'):
+    """
+    Function to aggregate time series by the grp_col and the periods of the freq_code. The rows are grouped on the integer period codes calculated directly from the datetime64 values (see allocation_ts.period_codes) without sorting the groups. The period codes of the results are then converted to the period end dates like pd.Grouper. The input frame isn't copied or sorted, the results are in the order of the first row of each group, and only the observed combinations of categorical grp_cols are returned.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Dataframe with a datetime column.
+    grp_col : str or list of str
+        Column name(s) that contains the sites.
+    ts_col : str
+        The column name of the datetime column.
+    freq_code : str
+        The pandas frequency code for the aggregation. Must be one of 'D', 'W', 'M', 'A-JUN', or 'A'.
+    agg : str or dict
+        The aggregation of the other columns. Either a function name (e.g. 'sum') or a dict of column names to function names.
+
+    Returns
+    -------
+    DataFrame
+        indexed by the grp_col and ts_col
+    """
+    if isinstance(grp_col, str):
+        grp_col = [grp_col]
+
+    freq = period_freqs[freq_code.upper()]
+    codes = period_codes(df[ts_col].values, freq)
+
+    val_cols = [c for c in df.columns if c not in grp_col + [ts_col]]
+    keys = [df[c] for c in grp_col] + [pd.Series(codes, index=df.index, name=ts_col)]
+    df1 = df[val_cols].groupby(keys, observed=True, sort=False).agg(agg)
+
+    ## Label the periods with the end dates. Unsorted groupbys reorder the categories of categorical keys, so they are set back.
+    levels = [pd.CategoricalIndex(l, dtype=df[c].dtype, name=c) if isinstance(df[c].dtype, pd.CategoricalDtype) else l for c, l in zip(grp_col, df1.index.levels)]
+    levels.append(pd.DatetimeIndex(period_ends(df1.index.levels[-1].values, freq).astype('datetime64[ns]'), name=ts_col))
+    df1.index = df1.index.set_levels(levels, verify_integrity=False)
+
+    return df1
+
+
 def grp_ts_agg(df, grp_col, ts_col, freq_code, discrete=False, **kwargs):
     """
-    Simple function to aggregate time series with dataframes with a single column of sites and a column of times.
+    Simple function to aggregate time series with dataframes with a single column of sites and a column of times. The 'D', 'W', 'M', 'A-JUN', and 'A' freq_codes (without discrete, kwargs, or categorical grp_cols) are grouped on the period end dates of the integer period codes (see period_agg) rather than resampled with a pd.Grouper, which gives the same groups without copying the df. See period_agg for the aggregation itself.
 
     Parameters
     ----------
@@ -32,14 +87,25 @@ def grp_ts_agg(df, grp_col, ts_col, freq_code, discrete=False, **kwargs):
     -------
     Pandas resample object
     """
-
-    df1 = df.copy()
     if type(df[ts_col].iloc[0]) is pd.Timestamp:
-        df1.set_index(ts_col, inplace=True)
         if isinstance(grp_col, str):
             grp_col = [grp_col]
         else:
             grp_col = grp_col[:]
+
+        ## pd.Grouper also returns the empty periods of unobserved categories
+        cat = any(isinstance(df[c].dtype, pd.CategoricalDtype) for c in grp_col)
+        if (not discrete) and (not kwargs) and (not cat) and (freq_code.upper() in period_freqs):
+            freq = period_freqs[freq_code.upper()]
+            times = df[ts_col].values
+            ends = period_ends(period_codes(times, freq), freq).astype('datetime64[ns]')
+            ends[np.isnat(times)] = np.datetime64('NaT')
+            val_cols = [c for c in df.columns if c not in grp_col + [ts_col]]
+            df_grp = df.groupby(grp_col + [pd.Series(ends, index=df.index, name=ts_col)])[val_cols]
+            return (df_grp)
+
+        df1 = df.copy()
+        df1.set_index(ts_col, inplace=True)
         if discrete:
             val_cols = [c for c in df1.columns if c not in grp_col]
             df1[val_cols] = (df1[val_cols] + df1[val_cols].shift(-1))/2
@@ -49,3 +115,70 @@ def grp_ts_agg(df, grp_col, ts_col, freq_code, discrete=False, **kwargs):
     else:
         print('Make one column a timeseries!')
 
+
+def _n_rows(objs):
+    """
+    Function to count the rows of the DataFrames and Series in a list.
+    """
+    return sum(len(o) for o in objs if isinstance(o, (pd.DataFrame, pd.Series)))
+
+
+def stage(rows_in=None, rows_out=None):
+    """
+    Decorator to profile a stage (method) of an object with a profile attribute. When the profile attribute is False the method is called directly. Otherwise the wall time, the number of rows in and out, and the change in the traced python memory (when profile is not 'time') of the stage are appended to the profile_records attribute and logged as json to the 'allotools.profile' logger at the INFO level. The row counts are taken after the stage has run.
+
+    Parameters
+    ----------
+    rows_in : list of str or None
+        The attributes of the object that are the inputs of the stage. None will use the DataFrame and Series args.
+    rows_out : str or None
+        The attribute of the object that is the output of the stage. None will use the returned value.
+
+    Returns
+    -------
+    function
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.profile:
+                return func(self, *args, **kwargs)
+
+            ## Only trace the memory over the outermost stage
+            mem = self.profile != 'time'
+            start_trace = mem and (not tracemalloc.is_tracing())
+            if start_trace:
+                tracemalloc.start()
+            mem1 = tracemalloc.get_traced_memory()[0] if mem else 0
+
+            depth = self._profile_depth
+            setattr(self, '_profile_depth', depth + 1)
+            start_time = time.time()
+            start = time.perf_counter()
+            try:
+                result = func(self, *args, **kwargs)
+            finally:
+                time1 = time.perf_counter() - start
+                setattr(self, '_profile_depth', depth)
+                mem_delta = (tracemalloc.get_traced_memory()[0] - mem1) if mem else np.nan
+                if start_trace:
+                    tracemalloc.stop()
+
+            if rows_in is None:
+                n_in = _n_rows(list(args) + list(kwargs.values()))
+            else:
+                n_in = _n_rows([getattr(self, a) for a in rows_in if hasattr(self, a)])
+            if rows_out is None:
+                n_out = _n_rows([result])
+            else:
+                n_out = _n_rows([getattr(self, rows_out, None)])
+
+            record = {'stage': func.__name__, 'depth': depth, 'freq': getattr(self, 'freq', None), 'start': start_time, 'time': time1, 'rows_in': n_in, 'rows_out': n_out, 'mem_delta': mem_delta}
+            self.profile_records.append(record)
+            profile_logger.info(json.dumps(record, default=str))
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -19,7 +19,7 @@ descrip = 'Functions to process and analyse ECan allocation and usage data'
 if os.environ.get('READTHEDOCS', False) == 'True':
     INSTALL_REQUIRES = []
 else:
-    INSTALL_REQUIRES = ['pandas', 'pdsql', 'seaborn']
+    INSTALL_REQUIRES = ['pandas', 'pdsql', 'seaborn', 'pyarrow']
 
 # Get the long description from the README file
 with open(os.path.join(here, 'README.rst'), encoding='utf-8') as f:
@@ -178,10 +178,10 @@ setup(
     #
     # For example, the following would provide a command called `sample` which
     # executes the function `main` from this package when invoked:
-    # entry_points={  # Optional
-    #    'console_scripts': [
-    #        'sample=sample.command_line:t3',
-    #    ],
-    # },
+    entry_points={  # Optional
+       'console_scripts': [
+           'allotools-batch=allotools.batch:main',
+       ],
+    },
     license='Apache',
 )